@@ -177,6 +177,50 @@ function updateCountdown(el) {
 // BIDDING SYSTEM
 // =============================================
 
+// One key per user action: a retried request with the same key is answered
+// from the server's stored response instead of placing a second bid.
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// Keys of actions (URL + body) that haven't had a definite answer yet. Doing
+// the same thing again — a double submit, or trying again after a network
+// error — reuses the key, so the server acts once and replays its answer.
+const pendingActionKeys = {};
+
+// POST JSON under the action's Idempotency-Key. Network errors and 409 (the
+// original request is still running) are retried a few times with that key.
+async function postJsonOnce(url, payload, retries = 2) {
+    const body = JSON.stringify(payload);
+    const action = `${url} ${body}`;
+    const key = pendingActionKeys[action] || (pendingActionKeys[action] = newIdempotencyKey());
+    for (let attempt = 0; ; attempt++) {
+        let response;
+        try {
+            response = await fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+                body: body
+            });
+        } catch (error) {
+            if (attempt >= retries) throw error;  // the key stays for the user's next try
+            await new Promise(r => setTimeout(r, 500 * (attempt + 1)));
+            continue;
+        }
+        if (response.status === 409 && attempt < retries) {
+            await new Promise(r => setTimeout(r, 500 * (attempt + 1)));
+            continue;
+        }
+        if (response.status !== 409) {
+            delete pendingActionKeys[action];
+        }
+        return response;
+    }
+}
+
 async function placeBid(itemId) {
     const card = document.getElementById(`card-${itemId}`);
     const btn = card.querySelector('.bid-btn');
@@ -186,6 +230,7 @@ async function placeBid(itemId) {
     const countdownEl = card.querySelector('[data-ends-at]');
     const historyList = document.getElementById(`bid-history-${itemId}`);
     const minHint = document.getElementById(`min-bid-${itemId}`);
+    const proxyToggle = document.getElementById(`proxy-${itemId}`);
 
     const bidAmount = parseFloat(input.value);
 
@@ -201,13 +246,10 @@ async function placeBid(itemId) {
     input.disabled = true;
 
     try {
-        const response = await fetch(`/api/bid/${itemId}`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ amount: bidAmount })
-        });
+        // Checked: a hidden maximum the server bids up to on our behalf
+        const response = await postJsonOnce(`/api/bid/${itemId}`, proxyToggle && proxyToggle.checked
+            ? { max_amount: bidAmount }
+            : { amount: bidAmount });
 
         const data = await response.json();
 
@@ -245,8 +287,14 @@ async function placeBid(itemId) {
                 });
             }
 
-            btn.innerText = "Bid Placed!";
-            btn.style.background = "rgba(76, 175, 80, 0.3)";
+            if (data.outbid) {
+                showFlash(data.message, 'error');
+            } else if (data.your_max) {
+                showFlash(data.message, 'success');
+            }
+
+            btn.innerText = data.outbid ? "Outbid!" : "Bid Placed!";
+            btn.style.background = data.outbid ? "rgba(244, 67, 54, 0.3)" : "rgba(76, 175, 80, 0.3)";
             setTimeout(() => {
                 btn.innerText = originalText;
                 btn.disabled = false;
@@ -272,7 +320,7 @@ async function placeBid(itemId) {
 document.addEventListener('keydown', function(e) {
     if (e.key === 'Enter' && e.target.classList.contains('bid-amount-input')) {
         const card = e.target.closest('.card');
-        if (card) {
+        if (card && !card.querySelector('.bid-btn').disabled) {
             const itemId = card.id.replace('card-', '');
             placeBid(itemId);
         }
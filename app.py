@@ -4,17 +4,42 @@ Phase 1 MVP: Authentication, Real Auctions, Proper Bidding, Admin Dashboard
 """
 
 import os
+import time
 import uuid
 import json
+import csv
+import io
+import math
+import re
+import mmap
+import struct
+import hashlib
+import random
+import signal
+import socket
+import smtplib
 import secrets
+import shutil
+import tempfile
 import sqlite3
+import zipfile
+import zlib
+import fcntl
+import threading
+import collections
+import heapq
+import functools
+import concurrent.futures
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template, jsonify, request, redirect, url_for, flash, abort
+from flask import Flask, Blueprint, current_app, has_app_context, render_template, jsonify, make_response, request, session, redirect, url_for, flash, abort
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
+from flask_mail import Mail, Message
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
@@ -23,21 +48,24 @@ load_dotenv()
 # =============================================
 # APP CONFIGURATION
 # =============================================
+# Extensions and routes are defined at import time but bound to an app only in
+# create_app() (bottom of file), so tests can build isolated instances and
+# Gunicorn can build the app once in the master under --preload.
 
-app = Flask(__name__, static_folder='Static')
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+bp = Blueprint('main', __name__, cli_group=None)
 
-csrf = CSRFProtect(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+csrf = CSRFProtect()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please sign in to place a bid.'
 login_manager.login_message_category = 'info'
+mail = Mail()
 
 DB_NAME = "panties_fan.db"
 MIN_BID_INCREMENT = 5.00
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+SCHEMA_VERSION = 15  # bump whenever init_db() gains a table, index or migration
 
 
 def allowed_file(filename):
@@ -55,6 +83,69 @@ def admin_required(f):
     return decorated
 
 
+IDEMPOTENCY_TTL_HOURS = 24
+
+
+def idempotent(f):
+    """Decorator for JSON POST APIs: a retry carrying the same Idempotency-Key
+    header gets the stored response back without re-running the view (so no
+    double bids / double charges). Keys are scoped per user; use under
+    @login_required and above @rate_limited. Requests without the header
+    behave as before. 429s and 5xx are not stored, so the retry runs for real."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'success': False, 'message': 'Idempotency-Key is too long.'}), 400
+
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        conn = get_db()
+        # Claim the key first; only the request that inserts the row runs the view
+        claimed = conn.execute('''
+            INSERT INTO idempotency_keys (user_id, idem_key, endpoint, request_hash, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+        ''', (current_user.id, key, request.path, fingerprint,
+              datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))).rowcount
+        conn.commit()
+        if not claimed:
+            row = conn.execute('SELECT * FROM idempotency_keys WHERE user_id = ? AND idem_key = ?',
+                               (current_user.id, key)).fetchone()
+            conn.close()
+            if row['endpoint'] != request.path or row['request_hash'] != fingerprint:
+                return jsonify({'success': False,
+                                'message': 'This Idempotency-Key was already used for a different request.'}), 422
+            if row['status_code'] is None:
+                return jsonify({'success': False,
+                                'message': 'The original request is still being processed. Retry shortly.'}), 409
+            resp = current_app.response_class(row['response'], status=row['status_code'],
+                                               mimetype=row['mimetype'])
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        conn.close()
+
+        resp = None
+        try:
+            resp = make_response(f(*args, **kwargs))
+        finally:
+            conn = get_db()
+            if resp is None or resp.status_code >= 500 or resp.status_code == 429:
+                # Nothing durable happened (or we can't tell) — let the client retry for real
+                conn.execute('DELETE FROM idempotency_keys WHERE user_id = ? AND idem_key = ?',
+                             (current_user.id, key))
+            else:
+                conn.execute('''
+                    UPDATE idempotency_keys SET status_code = ?, mimetype = ?, response = ?
+                    WHERE user_id = ? AND idem_key = ?
+                ''', (resp.status_code, resp.mimetype, resp.get_data(as_text=True), current_user.id, key))
+            conn.commit()
+            conn.close()
+        return resp
+    return decorated
+
+
 SHIPPING_RATES = {
     'US': 85.00,
     'CA': 80.00,
@@ -66,9 +157,26 @@ SHIPPING_RATES = {
     'DEFAULT': 70.00,
 }
 
+# Columns copied from shipping_addresses onto shipments at checkout
+SHIPPING_ADDRESS_FIELDS = ('full_name', 'address_line1', 'address_line2', 'city',
+                           'state', 'postal_code', 'country', 'phone')
+
 PAYMENT_WINDOW_HOURS = 48  # Hours buyer has to pay before offer goes to next bidder
 
 
+def notify(conn, user_id, type_, title, message, link=None, created_at=None,
+           payment_id=None, auction_id=None):
+    """In-app notification plus an outbox email (caller commits; see EMAIL section).
+    payment_id / auction_id say what it is about, so it can be found and
+    cleaned up by key (idx_notifications_payment / _auction)."""
+    conn.execute('''
+        INSERT INTO notifications (user_id, type, title, message, link, created_at, payment_id, auction_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, type_, title, message, link,
+          created_at or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), payment_id, auction_id))
+    queue_email(conn, user_id, type_, title, message, link)
+
+
 def create_payment_for_winner(conn, auction_id):
     """Create a payment record + notification when an auction ends with a winner.
     Returns the payment row or None if no winner / already exists."""
@@ -82,29 +190,24 @@ def create_payment_for_winner(conn, auction_id):
         return existing
 
     token = secrets.token_urlsafe(32)
-    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    expires_str = (now + timedelta(hours=PAYMENT_WINDOW_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    conn.execute('''
-        INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at)
-        VALUES (?, ?, ?, 'awaiting_payment', ?, ?)
-    ''', (auction_id, auction['current_bidder_id'], auction['current_bid'], token, now_str))
+    payment_id = conn.execute('''
+        INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+        VALUES (?, ?, ?, 'awaiting_payment', ?, ?, ?)
+        RETURNING id
+    ''', (auction_id, auction['current_bidder_id'], auction['current_bid'], token, now_str, expires_str)).fetchone()[0]
 
     # Update auction status
     conn.execute("UPDATE auctions SET status = 'ended' WHERE id = ?", (auction_id,))
 
     # Create notification for winner
-    buyer = conn.execute('SELECT display_name FROM users WHERE id = ?',
-                         (auction['current_bidder_id'],)).fetchone()
-    conn.execute('''
-        INSERT INTO notifications (user_id, type, title, message, link, created_at)
-        VALUES (?, 'auction_won', ?, ?, ?, ?)
-    ''', (
-        auction['current_bidder_id'],
-        'You won an auction!',
-        f'Congratulations! You won "{auction["title"]}" for ${auction["current_bid"]:.2f}. Complete your payment within {PAYMENT_WINDOW_HOURS} hours.',
-        f'/pay/{token}',
-        now_str
-    ))
+    notify(conn, auction['current_bidder_id'], 'auction_won',
+           'You won an auction!',
+           f'Congratulations! You won "{auction["title"]}" for ${auction["current_bid"]:.2f}. Complete your payment within {PAYMENT_WINDOW_HOURS} hours.',
+           f'/pay/{token}', created_at=now_str, payment_id=payment_id, auction_id=auction_id)
 
     conn.commit()
     return conn.execute('SELECT * FROM payments WHERE auction_id = ?', (auction_id,)).fetchone()
@@ -129,34 +232,411 @@ def end_expired_auctions(conn):
         create_payment_for_winner(conn, row['id'])
 
 
+PAYMENT_EXPIRY_BATCH = 1000  # overdue payments handled per transaction
+
+
+def expire_overdue_payments(conn, limit=PAYMENT_EXPIRY_BATCH):
+    """Expire unpaid payments past their window and offer each item to the
+    next-highest distinct bidder who hasn't already had a chance at it.
+
+    Batch-oriented: one range scan on idx_payments_expiry, one grouped query for
+    the runner-ups, then executemany writes. Idempotent — rows are only touched
+    while still 'awaiting_payment', and a bidder is never offered the same
+    auction twice. Returns the number of payments expired."""
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    begin_write(conn)
+    overdue = conn.execute('''
+        SELECT p.id, p.auction_id, p.buyer_id, a.title
+        FROM payments p
+        JOIN auctions a ON a.id = p.auction_id
+        WHERE p.status = 'awaiting_payment' AND p.expires_at <= ?
+        ORDER BY p.expires_at
+        LIMIT ?
+    ''', (now_str, limit)).fetchall()
+    if not overdue:
+        conn.commit()
+        return 0
+
+    auction_ids = json.dumps([row['auction_id'] for row in overdue])
+    # Top remaining bid per auction, excluding everyone already offered it
+    # (the highest single bid is that bidder's best; earliest bid wins ties)
+    runner_ups = {row['auction_id']: row for row in conn.execute('''
+        SELECT auction_id, user_id, amount, id as bid_id FROM (
+            SELECT b.id, b.auction_id, b.user_id, b.amount,
+                   ROW_NUMBER() OVER (PARTITION BY b.auction_id ORDER BY b.amount DESC, b.id) as rank
+            FROM bids b
+            WHERE b.auction_id IN (SELECT value FROM json_each(?))
+              AND NOT EXISTS (SELECT 1 FROM payments p
+                              WHERE p.auction_id = b.auction_id AND p.buyer_id = b.user_id)
+        ) ranked
+        WHERE rank = 1
+    ''', (auction_ids,))}
+
+    expires_str = (now + timedelta(hours=PAYMENT_WINDOW_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    offers, unsold = [], []
+    for row in overdue:
+        nxt = runner_ups.get(row['auction_id'])
+        if nxt:
+            offers.append((row, nxt, secrets.token_urlsafe(32)))
+        else:
+            unsold.append((row['auction_id'],))
+
+    conn.executemany("UPDATE payments SET status = 'expired', completed_at = ? WHERE id = ? AND status = 'awaiting_payment'",
+                     ((now_str, row['id']) for row in overdue))
+    conn.executemany('''
+        INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+        VALUES (?, ?, ?, 'awaiting_payment', ?, ?, ?)
+    ''', ((row['auction_id'], nxt['user_id'], nxt['amount'], token, now_str, expires_str)
+          for row, nxt, token in offers))
+    conn.executemany('UPDATE auctions SET current_bid = ?, current_bidder_id = ? WHERE id = ?',
+                     ((nxt['amount'], nxt['user_id'], row['auction_id']) for row, nxt, _ in offers))
+    conn.executemany('UPDATE bids SET is_winning = CASE WHEN id = ? THEN 1 ELSE 0 END WHERE auction_id = ?',
+                     ((nxt['bid_id'], row['auction_id']) for row, nxt, _ in offers))
+    conn.executemany("UPDATE auctions SET status = 'unsold' WHERE id = ?", unsold)
+
+    for row in overdue:
+        notify(conn, row['buyer_id'], 'payment_expired',
+               'Payment Window Expired',
+               f'The {PAYMENT_WINDOW_HOURS}-hour payment window for "{row["title"]}" has passed and the item has been released.',
+               '/dashboard', created_at=now_str, payment_id=row['id'], auction_id=row['auction_id'])
+    offer_ids = dict(conn.execute('SELECT payment_token, id FROM payments WHERE payment_token IN (SELECT value FROM json_each(?))',
+                                  (json.dumps([token for _, _, token in offers]),)).fetchall())
+    for row, nxt, token in offers:
+        notify(conn, nxt['user_id'], 'second_chance',
+               'Second-Chance Offer!',
+               f'The winner of "{row["title"]}" didn\'t pay. It\'s yours for your top bid of ${nxt["amount"]:.2f} — complete payment within {PAYMENT_WINDOW_HOURS} hours.',
+               f'/pay/{token}', created_at=now_str, payment_id=offer_ids[token], auction_id=row['auction_id'])
+
+    conn.commit()
+    return len(overdue)
+
+
+# Order state machine. The payment status is the order's state; shipment and
+# auction statuses are derived from it and only written by transition_order()
+# (and, in bulk, by the expiry sweeper above).
+ORDER_STATUS_SYNC = {
+    # payment status: (shipment status, auction status)
+    'awaiting_payment': ('awaiting_payment', 'ended'),
+    'pending': ('awaiting_payment', 'ended'),
+    'paid': ('preparing', 'paid'),
+    'shipped': ('shipped', 'shipped'),
+    'completed': ('delivered', 'completed'),
+}
+
+ORDER_TRANSITIONS = {
+    # action: (statuses it may start from, status it moves to)
+    'pay_crypto': ({'awaiting_payment'}, 'pending'),
+    'pay_card': ({'awaiting_payment'}, 'paid'),
+    'mark_paid': ({'awaiting_payment', 'pending'}, 'paid'),
+    'ship': ({'paid'}, 'shipped'),
+    'deliver': ({'shipped'}, 'completed'),
+    # Admin correction; target given by caller. 'expired' is only a source: an
+    # order that lapsed by mistake (paid off-platform, say) can be brought
+    # back unless the item has since been offered to another bidder.
+    'override': (set(ORDER_STATUS_SYNC) | {'expired'}, None),
+}
+
+
+def transition_orders(conn, action, changes, status=None):
+    """Apply one ORDER_TRANSITIONS step to many orders in a single transaction.
+
+    changes is [(payment_id, payment, shipment, notice, audit)], each field as
+    described in transition_order(). Takes the write lock, loads every order in
+    one query, then writes each table with one executemany per statement shape
+    and the audit entries as one batch. Orders that don't exist or can't make
+    the transition are skipped. Caller commits.
+
+    Returns (orders before the change, {payment_id: reason} for skipped ones);
+    reason is None for an unknown order. An id listed more than once is acted
+    on once and its repeats are reported in skipped."""
+    sources, target = ORDER_TRANSITIONS[action]
+    target = target or status
+    if not conn.in_transaction:
+        begin_write(conn)
+    found = {row['id']: row for row in conn.execute('''
+        SELECT p.*, a.muse_id FROM payments p JOIN auctions a ON a.id = p.auction_id
+        WHERE p.id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps([c[0] for c in changes]),))}
+
+    done, skipped, applied, seen = [], {}, [], set()
+    for change in changes:
+        if change[0] in seen:  # a repeated id is only applied once
+            skipped.setdefault(change[0], 'Listed more than once; only the first entry was used.')
+            continue
+        seen.add(change[0])
+        order = found.get(change[0])
+        if not order:
+            skipped[change[0]] = None
+        elif order['status'] not in sources or target not in ORDER_STATUS_SYNC or target == order['status']:
+            skipped[change[0]] = (f"Can't {action.replace('_', ' ')} an order that is "
+                                  f"{order['status'].replace('_', ' ')}.")
+        else:
+            done.append(order)
+            applied.append(change)
+
+    # Reviving an expired order: refuse while a second-chance offer (or any
+    # other order) for the same auction is still open
+    revived = [o for o in done if o['status'] == 'expired']
+    if revived:
+        taken = dict(conn.execute('''
+            SELECT auction_id, MIN(id) FROM payments
+            WHERE auction_id IN (SELECT value FROM json_each(?)) AND status != 'expired'
+            GROUP BY auction_id
+        ''', (json.dumps([o['auction_id'] for o in revived]),)).fetchall())
+        for order in [o for o in revived if o['auction_id'] in taken]:
+            skipped[order['id']] = (f"The item has since been offered to another bidder "
+                                    f"(order #{taken[order['auction_id']]}).")
+            done.remove(order)
+            revived.remove(order)
+        applied = [c for c in applied if c[0] not in skipped]
+    if not done:
+        return done, skipped
+
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    shipment_status, auction_status = ORDER_STATUS_SYNC[target]
+    # First time through a state stamps its timestamp; overrides never erase one
+    stamp = {'paid': ('completed_at', None), 'shipped': (None, 'shipped_at'),
+             'completed': (None, 'delivered_at')}.get(target, (None, None))
+    # Back to awaiting_payment (an override) opens a fresh payment window; the
+    # old deadline has usually passed and the sweeper would expire it at once
+    reopen = {}
+    if target == 'awaiting_payment':
+        reopen['expires_at'] = (datetime.now(timezone.utc) + timedelta(hours=PAYMENT_WINDOW_HOURS)
+                                ).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def assignments(fields, stamp_col):
+        sql = ', '.join(f'{col} = ?' for col in fields)
+        if stamp_col and stamp_col not in fields:
+            sql += f', {stamp_col} = COALESCE({stamp_col}, ?)'
+            return sql, (*fields.values(), now_str)
+        return sql, tuple(fields.values())
+
+    # Orders paid outside checkout have no shipment yet; give them one to carry
+    # the status and tracking (the address snapshot stays empty)
+    conn.executemany('''
+        INSERT INTO shipments (payment_id, status, shipping_cost)
+        SELECT ?, 'awaiting_payment', NULL WHERE NOT EXISTS (SELECT 1 FROM shipments WHERE payment_id = ?)
+    ''', [(o['id'], o['id']) for o in done])
+
+    # Group rows by statement text so each distinct shape is one executemany
+    writes = collections.defaultdict(list)
+    # Expiry stamped completed_at; a revived order is only 'paid' from now on
+    revived_ids = {o['id'] for o in revived}
+    unexpire = {'completed_at': now_str if stamp[0] == 'completed_at' else None}
+    for payment_id, payment, shipment, _, _ in applied:
+        fields = {**reopen, **(unexpire if payment_id in revived_ids else {}), **(payment or {}), 'status': target}
+        sql, params = assignments(fields, stamp[0])
+        writes[f'UPDATE payments SET {sql} WHERE id = ?'].append((*params, payment_id))
+        sql, params = assignments(dict(shipment or {}, status=shipment_status), stamp[1])
+        writes[f'UPDATE shipments SET {sql} WHERE payment_id = ?'].append((*params, payment_id))
+    writes['UPDATE auctions SET status = ? WHERE id = ?'] = [(auction_status, o['auction_id']) for o in done]
+    # The revived buyer wins again (expiry may have passed the lead to a runner-up)
+    writes['UPDATE auctions SET current_bid = ?, current_bidder_id = ? WHERE id = ?'] = [
+        (o['amount'], o['buyer_id'], o['auction_id']) for o in revived]
+    writes['''
+        UPDATE bids SET is_winning = CASE WHEN id = (
+            SELECT id FROM bids WHERE auction_id = ? AND user_id = ? ORDER BY amount DESC, id LIMIT 1)
+        THEN 1 ELSE 0 END WHERE auction_id = ?
+    '''] = [(o['auction_id'], o['buyer_id'], o['auction_id']) for o in revived]
+    # A muse's sales count follows orders in and out of 'completed'
+    sold = collections.Counter()
+    for order in done:
+        if order['muse_id']:
+            sold[order['muse_id']] += (target == 'completed') - (order['status'] == 'completed')
+    writes['UPDATE muse_profiles SET total_sales = total_sales + ? WHERE id = ?'] = [
+        (n, muse_id) for muse_id, n in sold.items() if n]
+    for sql, rows in writes.items():
+        conn.executemany(sql, rows)
+
+    for order, (_, _, _, notice, _) in zip(done, applied):
+        if notice:
+            type_, title, message, link = notice
+            notify(conn, order['buyer_id'], type_, title, message,
+                   link and link.format_map(order), created_at=now_str,
+                   payment_id=order['id'], auction_id=order['auction_id'])
+    log_audit_many(conn, [('order', order['id'], *audit) for order, (*_, audit) in zip(done, applied) if audit])
+    return done, skipped
+
+
+def transition_order(conn, payment_id, action, status=None, payment=None, shipment=None,
+                     notice=None, audit=None):
+    """Move one order through an ORDER_TRANSITIONS step with all its side effects.
+
+    Re-reads the order under the write lock and checks the transition against
+    its current status, then writes payments, shipments, auctions, muse sales,
+    the buyer notification (notice = (type, title, message, link), where link
+    may use order columns like '/pay/{payment_token}') and the audit entry
+    (audit = (action, details)) in that one transaction. `payment` and
+    `shipment` are extra columns to set. Caller commits.
+
+    Returns the order row as it was before, None if there's no such order, or
+    raises ValueError (nothing written) if the transition isn't allowed."""
+    done, skipped = transition_orders(conn, action, [(payment_id, payment, shipment, notice, audit)], status)
+    if skipped.get(payment_id):
+        raise ValueError(skipped[payment_id])
+    return done[0] if done else None
+
+
 # =============================================
 # DATABASE
 # =============================================
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
-    conn.execute("PRAGMA busy_timeout=5000")
-    return conn
+_memory_keepalive = {}  # uri -> connection holding a shared-cache memory DB open
+
+
+def memory_database_uri(name):
+    """URI for a named in-memory database shared by every connection in this process."""
+    return f'file:{name}?mode=memory&cache=shared'
+
+
+def is_memory_database(path):
+    return path.startswith('file:') and 'mode=memory' in path
+
+
+def is_postgres_url(path):
+    return path.startswith(('postgresql://', 'postgres://'))
+
+
+# Per-connection SQLite tuning, chosen with STORAGE_PROFILE (env
+# PANTIESFAN_STORAGE_PROFILE). Measured with `python bench.py --profiles`; the
+# numbers are in bench_profiles.json and DEPLOY.md. Nothing there beats 'safe'
+# yet, so it stays the default until 'pi' is measured on the Pi's SD card.
+STORAGE_PROFILES = {
+    # SQLite's stock settings (default): fsync on every commit, 2MB page cache, no mmap
+    'safe': {'synchronous': 'FULL', 'cache_size': -2000, 'mmap_size': 0,
+             'temp_store': 'DEFAULT', 'wal_autocheckpoint': 1000},
+    # Raspberry Pi on an SD card. In WAL mode NORMAL syncs only at
+    # checkpoints: the database can't corrupt, but a power cut may lose the
+    # last few commits. Reads come through a 64MB mmap window (shared page
+    # cache, not per-process RAM) and sorts stay off the card. Auto-checkpoints
+    # run every 4000 pages instead of 1000, so fewer requests pay for one; the
+    # checkpoint_wal job does the rest in the background.
+    'pi': {'synchronous': 'NORMAL', 'cache_size': -8000, 'mmap_size': 64 * 1024 * 1024,
+           'temp_store': 'MEMORY', 'wal_autocheckpoint': 4000},
+    # SSD box with RAM to spare
+    'server': {'synchronous': 'NORMAL', 'cache_size': -64000, 'mmap_size': 512 * 1024 * 1024,
+               'temp_store': 'MEMORY', 'wal_autocheckpoint': 1000},
+}
+DEFAULT_STORAGE_PROFILE = 'safe'
+_profile_pragmas = {name: [f'PRAGMA {pragma} = {value}' for pragma, value in settings.items()]
+                    for name, settings in STORAGE_PROFILES.items()}
+
+
+def get_db(path=None, profile=None):
+    """Open a connection to the configured database (see storage())."""
+    return storage(path, profile).connect()
+
+
+# Storage backends. Routes talk to the database through the objects returned
+# by get_db(): a sqlite3 connection, or for a postgresql:// DATABASE a
+# PgConnection that takes the same inline SQL. The few operations whose
+# locking differs between the engines are methods on the backend.
+#   sqlite   - one file, one writer: BEGIN IMMEDIATE serializes all writes
+#   postgres - pooled connections (DATABASE_POOL_SIZE per process); a bid
+#              locks only its auction row, so bids on different auctions
+#              commit in parallel
+# Needs `pip install "psycopg[binary,pool]"` for PostgreSQL only.
+
+class SqliteStorage:
+    name = 'sqlite'
+
+    def __init__(self, path, profile):
+        self.path = path
+        self.pragmas = _profile_pragmas[profile]
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, uri=self.path.startswith('file:'))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA busy_timeout=5000")
+        for statement in self.pragmas:
+            conn.execute(statement)
+        return conn
+
+    def lock_auction(self, conn, auction_id):
+        """Start a write transaction that owns the auction; returns its row (or None)."""
+        begin_write(conn)
+        return conn.execute('SELECT * FROM auctions WHERE id = ?', (auction_id,)).fetchone()
+
+
+class PostgresStorage:
+    name = 'postgres'
+
+    def __init__(self, url, pool_size):
+        try:
+            import psycopg_pool
+        except ImportError as exc:
+            raise RuntimeError('A postgresql:// DATABASE needs psycopg: '
+                               'pip install "psycopg[binary,pool]"') from exc
+        self.pool = psycopg_pool.ConnectionPool(url, min_size=1, max_size=pool_size, timeout=10,
+                                                configure=configure_postgres, open=True)
+
+    def connect(self):
+        return PgConnection(self.pool.getconn(), self.pool)
+
+    def lock_auction(self, conn, auction_id):
+        """Lock just this auction's row until commit (other auctions stay open)."""
+        return begin_write(conn, 'SELECT * FROM auctions WHERE id = ? FOR UPDATE', (auction_id,)).fetchone()
+
+
+_storages = {}  # (database, profile, pid) -> backend; pools must not cross a fork
+
+
+def storage(path=None, profile=None):
+    """The storage backend for a database (default: the current app's)."""
+    config = None
+    if path is None or profile is None:
+        # Outside a request (scripts, tests) fall back to the module-level app
+        config = (current_app if has_app_context() else app).config
+        path = path or config['DATABASE']
+        profile = profile or config['STORAGE_PROFILE']
+    postgres = is_postgres_url(path)
+    key = (path, None if postgres else profile, os.getpid())
+    backend = _storages.get(key)
+    if backend is None:
+        if postgres:
+            backend = PostgresStorage(path, config['DATABASE_POOL_SIZE'] if config else DEFAULT_POOL_SIZE)
+        else:
+            backend = SqliteStorage(path, profile)
+        _storages[key] = backend
+    return backend
 
 
 def log_audit(conn, entity_type, entity_id, action, details=None):
     """Insert an entry into the audit_log table."""
-    details_json = json.dumps(details) if details else None
+    log_audit_many(conn, [(entity_type, entity_id, action, details)])
+
+
+def log_audit_many(conn, entries):
+    """Insert [(entity_type, entity_id, action, details)] into audit_log in one batch."""
     aid = current_user.id if current_user.is_authenticated else None
     now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-    conn.execute('''
+    conn.executemany('''
         INSERT INTO audit_log (entity_type, entity_id, action, details, admin_id, created_at)
         VALUES (?, ?, ?, ?, ?, ?)
-    ''', (entity_type, entity_id, action, details_json, aid, now_str))
+    ''', [(entity_type, entity_id, action, json.dumps(details) if details else None, aid, now_str)
+          for entity_type, entity_id, action, details in entries])
 
 
-def init_db():
-    """Create tables and seed data if database doesn't exist."""
-    fresh = not os.path.exists(DB_NAME)
-    conn = get_db()
+def init_db(path, profile=DEFAULT_STORAGE_PROFILE):
+    """Create tables and seed data if database doesn't exist.
+
+    Cheap when the schema is current: a single PRAGMA user_version read, so
+    worker (re)starts don't re-run the DDL script and migration probes."""
+    if is_memory_database(path) and path not in _memory_keepalive:
+        # A shared-cache memory DB vanishes when its last connection closes
+        _memory_keepalive[path] = sqlite3.connect(path, uri=True)
+    conn = get_db(path, profile)
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return
+    fresh = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()[0] == 0
+    if fresh:
+        # Lets archive_history() hand freed pages back with PRAGMA incremental_vacuum
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
 
     conn.executescript('''
         CREATE TABLE IF NOT EXISTS users (
@@ -224,7 +704,8 @@ def init_db():
             status TEXT DEFAULT 'pending',
             payment_token TEXT UNIQUE,
             created_at TEXT DEFAULT (datetime('now')),
-            completed_at TEXT
+            completed_at TEXT,
+            expires_at TEXT
         );
 
         CREATE TABLE IF NOT EXISTS shipments (
@@ -236,7 +717,16 @@ def init_db():
             status TEXT DEFAULT 'preparing',
             shipped_at TEXT,
             delivered_at TEXT,
-            shipping_cost REAL
+            shipping_cost REAL,
+            -- address as it was when the buyer confirmed (copied from shipping_addresses)
+            full_name TEXT,
+            address_line1 TEXT,
+            address_line2 TEXT,
+            city TEXT,
+            state TEXT,
+            postal_code TEXT,
+            country TEXT,
+            phone TEXT
         );
 
         CREATE TABLE IF NOT EXISTS shipping_addresses (
@@ -262,7 +752,9 @@ def init_db():
             message TEXT,
             link TEXT,
             is_read INTEGER DEFAULT 0,
-            created_at TEXT DEFAULT (datetime('now'))
+            created_at TEXT DEFAULT (datetime('now')),
+            payment_id INTEGER REFERENCES payments(id),
+            auction_id INTEGER REFERENCES auctions(id)
         );
 
         CREATE TABLE IF NOT EXISTS audit_log (
@@ -274,6 +766,66 @@ def init_db():
             admin_id INTEGER REFERENCES users(id),
             created_at TEXT DEFAULT (datetime('now'))
         );
+
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT NOT NULL,
+            payload TEXT,
+            priority INTEGER NOT NULL DEFAULT 50,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at TEXT NOT NULL,
+            dedupe_key TEXT,
+            locked_by TEXT,
+            locked_until TEXT,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, priority, run_at);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)
+            WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL,
+            idem_key TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER,
+            mimetype TEXT,
+            response TEXT,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, idem_key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at);
+
+        CREATE TABLE IF NOT EXISTS proxy_bids (
+            auction_id INTEGER NOT NULL REFERENCES auctions(id),
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            max_amount REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (auction_id, user_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            to_addr TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            message TEXT,
+            link TEXT,
+            digest INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            send_after TEXT NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, digest, send_after);
     ''')
 
     # Safe migration: add admin_notes to payments if missing
@@ -282,9 +834,167 @@ def init_db():
     except sqlite3.OperationalError:
         conn.execute("ALTER TABLE payments ADD COLUMN admin_notes TEXT")
 
+    # Safe migration: payment deadline column (backfilled from created_at)
+    try:
+        conn.execute("SELECT expires_at FROM payments LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.execute("ALTER TABLE payments ADD COLUMN expires_at TEXT")
+        conn.execute(f'''
+            UPDATE payments SET expires_at = strftime('%Y-%m-%dT%H:%M:%SZ', created_at, '+{PAYMENT_WINDOW_HOURS} hours')
+            WHERE expires_at IS NULL
+        ''')
+    # Sweeper range scan + runner-up lookups (see expire_overdue_payments)
+    conn.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_payments_expiry ON payments(expires_at) WHERE status = 'awaiting_payment';
+        CREATE INDEX IF NOT EXISTS idx_payments_auction_buyer ON payments(auction_id, buyer_id);
+        CREATE INDEX IF NOT EXISTS idx_bids_auction_amount ON bids(auction_id, amount DESC);
+    ''')
+    # Keyset paging of bid history (see bid_history_page)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bids_auction_id ON bids(auction_id, id DESC)')
+
+    # Per-(user, auction) bid summary for the buyer dashboard. Triggers keep it
+    # in step with every write to bids and auctions, whichever code path makes it.
+    has_state = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_auction_state'").fetchone()
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS user_auction_state (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            auction_id INTEGER NOT NULL REFERENCES auctions(id),
+            max_bid REAL NOT NULL,
+            bid_count INTEGER NOT NULL DEFAULT 0,
+            last_bid_at TEXT NOT NULL,
+            is_winning INTEGER NOT NULL DEFAULT 0,  -- user is auctions.current_bidder_id
+            is_live INTEGER NOT NULL DEFAULT 1,     -- auctions.status = 'live'
+            PRIMARY KEY (user_id, auction_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_uas_user_state ON user_auction_state(user_id, is_live, is_winning);
+        CREATE INDEX IF NOT EXISTS idx_uas_recent ON user_auction_state(user_id, last_bid_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_uas_auction ON user_auction_state(auction_id);
+
+        CREATE TRIGGER IF NOT EXISTS trg_uas_bid AFTER INSERT ON bids BEGIN
+            INSERT INTO user_auction_state (user_id, auction_id, max_bid, bid_count, last_bid_at, is_live)
+            VALUES (NEW.user_id, NEW.auction_id, NEW.amount, 1, NEW.placed_at,
+                    (SELECT status = 'live' FROM auctions WHERE id = NEW.auction_id))
+            ON CONFLICT (user_id, auction_id) DO UPDATE SET
+                max_bid = MAX(max_bid, excluded.max_bid),
+                bid_count = bid_count + 1,
+                last_bid_at = excluded.last_bid_at;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_uas_leader AFTER UPDATE OF current_bidder_id ON auctions
+        WHEN OLD.current_bidder_id IS NOT NEW.current_bidder_id BEGIN
+            UPDATE user_auction_state SET is_winning = (user_id = NEW.current_bidder_id)
+            WHERE auction_id = NEW.id AND user_id IN (OLD.current_bidder_id, NEW.current_bidder_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_uas_status AFTER UPDATE OF status ON auctions
+        WHEN (OLD.status = 'live') != (NEW.status = 'live') BEGIN
+            UPDATE user_auction_state SET is_live = (NEW.status = 'live') WHERE auction_id = NEW.id;
+        END;
+    ''')
+    if not has_state:
+        conn.execute('''
+            INSERT INTO user_auction_state (user_id, auction_id, max_bid, bid_count, last_bid_at, is_winning, is_live)
+            SELECT b.user_id, b.auction_id, MAX(b.amount), COUNT(*), MAX(b.placed_at),
+                   a.current_bidder_id IS b.user_id, a.status = 'live'
+            FROM bids b
+            JOIN auctions a ON a.id = b.auction_id
+            GROUP BY b.user_id, b.auction_id
+        ''')
+
+    # Safe migration: per-user digest window for low-priority emails (minutes, 0 = immediate)
+    try:
+        conn.execute("SELECT email_digest_minutes FROM users LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.execute("ALTER TABLE users ADD COLUMN email_digest_minutes INTEGER NOT NULL DEFAULT 60")
+
+    # One default address per user, enforced (keep the newest if there are several)
+    conn.execute('''
+        UPDATE shipping_addresses SET is_default = 0
+        WHERE is_default = 1
+          AND id NOT IN (SELECT MAX(id) FROM shipping_addresses WHERE is_default = 1 GROUP BY user_id)
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_shipping_addresses_default '
+                 'ON shipping_addresses(user_id) WHERE is_default = 1')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_shipments_payment ON shipments(payment_id)')
+
+    # Safe migration: address snapshot on shipments (backfilled from the buyer's default)
+    try:
+        conn.execute("SELECT full_name FROM shipments LIMIT 1")
+    except sqlite3.OperationalError:
+        for col in SHIPPING_ADDRESS_FIELDS:
+            conn.execute(f"ALTER TABLE shipments ADD COLUMN {col} TEXT")
+        cols = ', '.join(SHIPPING_ADDRESS_FIELDS)
+        conn.execute(f'''
+            UPDATE shipments SET ({cols}) = (
+                SELECT {', '.join('sa.' + c for c in SHIPPING_ADDRESS_FIELDS)}
+                FROM payments p
+                JOIN shipping_addresses sa ON sa.user_id = p.buyer_id AND sa.is_default = 1
+                WHERE p.id = shipments.payment_id
+            )
+        ''')
+
+    # Safe migration: auctions whose bids were moved to the cold archive
+    try:
+        conn.execute("SELECT archived_at FROM auctions LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.execute("ALTER TABLE auctions ADD COLUMN archived_at TEXT")
+
+    # Safe migration: notifications keyed by the order / auction they are about
+    # (backfilled from the /pay/<token> and /#card-<id> links they used to be matched on)
+    try:
+        conn.execute("SELECT payment_id FROM notifications LIMIT 1")
+    except sqlite3.OperationalError:
+        conn.execute("ALTER TABLE notifications ADD COLUMN payment_id INTEGER REFERENCES payments(id)")
+        conn.execute("ALTER TABLE notifications ADD COLUMN auction_id INTEGER REFERENCES auctions(id)")
+        conn.execute('''
+            UPDATE notifications SET (payment_id, auction_id) = (
+                SELECT p.id, p.auction_id FROM payments p WHERE p.payment_token = substr(notifications.link, 6))
+            WHERE link LIKE '/pay/%'
+        ''')
+        conn.execute('''
+            UPDATE notifications SET auction_id = CAST(substr(link, 8) AS INTEGER)
+            WHERE link LIKE '/#card-%'
+              AND EXISTS (SELECT 1 FROM auctions WHERE id = CAST(substr(notifications.link, 8) AS INTEGER))
+        ''')
+    conn.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_payment ON notifications(payment_id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_auction ON notifications(auction_id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(created_at) WHERE is_read = 1;
+    ''')
+
+    # Cross-process cache invalidation events (see CacheBus); cache_key holds
+    # the key JSON-encoded
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            cache_key,
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+    # Last checkpoint / backup outcome, one JSON row each (see checkpoint_wal)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+
+    # Forward-decayed bid velocity per auction (see TrendingBoard)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS auction_trending (
+            auction_id INTEGER PRIMARY KEY REFERENCES auctions(id),
+            score REAL NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_auction_trending_score ON auction_trending(score DESC);
+    ''')
+
     if fresh:
         _seed_data(conn)
 
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
 
@@ -341,6 +1051,772 @@ def _seed_data(conn):
     print("Database initialized with seed data.")
 
 
+# =============================================
+# POSTGRESQL ADAPTER
+# =============================================
+# PgConnection wraps a psycopg connection so the inline SQL written for
+# sqlite3 runs unchanged:
+#   - `?` placeholders; `IN (SELECT value FROM json_each(?))` gets the JSON
+#     array spread into one placeholder per element
+#   - rows read by column name or index (PgRow, like sqlite3.Row), and
+#     NUMERIC results come back as float
+#   - BEGIN IMMEDIATE takes a database-wide advisory lock until commit: the
+#     same one-writer guarantee the SQLite code was written against. Plain
+#     BEGIN is a no-op; psycopg opens a transaction on the first statement.
+#   - close() rolls back anything uncommitted and returns the connection to
+#     the pool
+# Statements that are SQLite-only (PRAGMA, ATTACH, backups) are not
+# translated; the callers skip them for PostgreSQL (see is_postgres()).
+
+DEFAULT_POOL_SIZE = 4            # per process; Gunicorn sync workers serve one request at a time
+PG_WRITE_LOCK = 0x70616E7469     # advisory lock key standing in for SQLite's write lock
+PG_CACHE_EVENTS_LOCK = 0x63616368  # orders cache_events ids by commit (see invalidate)
+PG_TRENDING_LOCK = 0x74726E64      # one TrendingBoard.flush() at a time
+
+_JSON_EACH_PARAM = re.compile(r'IN \(SELECT value FROM json_each\(\?\)\)')
+
+
+def is_postgres(conn):
+    return isinstance(conn, PgConnection)
+
+
+@functools.lru_cache(maxsize=1024)
+def _pg_statement(sql):
+    """Split a statement around its json_each(?) parameters: returns the
+    psycopg-style pieces and the index of each JSON array parameter."""
+    pieces = _JSON_EACH_PARAM.split(sql.replace('%', '%%'))
+    slots, count = [], 0
+    for piece in pieces[:-1]:
+        count += piece.count('?')
+        slots.append(count)
+        count += 1
+    return [piece.replace('?', '%s') for piece in pieces], tuple(slots)
+
+
+def _pg_query(sql, params):
+    pieces, slots = _pg_statement(sql)
+    if not slots:
+        return pieces[0], params
+    params = list(params)
+    query, args, start = [pieces[0]], [], 0
+    for slot, piece in zip(slots, pieces[1:]):
+        values = json.loads(params[slot])
+        args += params[start:slot] + values
+        start = slot + 1
+        query.append(f"IN ({', '.join(['%s'] * len(values)) or 'NULL'}){piece}")
+    return ''.join(query), args + params[start:]
+
+
+class PgRow(tuple):
+    """Row readable by index or column name, like sqlite3.Row."""
+    __slots__ = ()
+    columns = {}
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self.columns[key] if isinstance(key, str) else key)
+
+    def keys(self):
+        return list(self.columns)
+
+
+@functools.lru_cache(maxsize=1024)
+def _pg_row_type(names):
+    return type('PgRow', (PgRow,), {'__slots__': (), 'columns': {name: i for i, name in enumerate(names)}})
+
+
+def _pg_row_factory(cursor):
+    return _pg_row_type(tuple(column.name for column in cursor.description or ()))
+
+
+def configure_postgres(raw):
+    """Per-connection setup, run by the pool for each new connection."""
+    from psycopg.types.numeric import FloatLoader
+    raw.adapters.register_loader('numeric', FloatLoader)
+    raw.row_factory = _pg_row_factory
+    raw.execute("SET lock_timeout = '5s'")  # like busy_timeout=5000
+    raw.commit()
+
+
+class PgConnection:
+    """sqlite3.Connection look-alike over one psycopg connection."""
+
+    def __init__(self, raw, pool=None):
+        self.raw = raw
+        self.pool = pool
+
+    @property
+    def in_transaction(self):
+        from psycopg.pq import TransactionStatus
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def execute(self, sql, params=()):
+        statement = sql.strip().upper()
+        if statement == 'BEGIN IMMEDIATE':
+            sql, params = 'SELECT pg_advisory_xact_lock(?)', (PG_WRITE_LOCK,)
+        elif statement == 'BEGIN':
+            return self.raw.cursor()
+        return self.raw.execute(*_pg_query(sql, params))
+
+    def executemany(self, sql, seq_of_params):
+        query, = _pg_statement(sql)[0]  # (batches never use json_each)
+        cursor = self.raw.cursor()
+        cursor.executemany(query, list(seq_of_params))
+        return cursor
+
+    def executescript(self, script):
+        if self.in_transaction:
+            self.raw.commit()
+        self.raw.execute(script)
+        self.raw.commit()
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        raw, self.raw = self.raw, None
+        if raw is None:
+            return
+        if self.pool is None:
+            raw.close()
+            return
+        if not raw.closed:
+            raw.rollback()  # no-op when idle
+        self.pool.putconn(raw)
+
+    def __del__(self):
+        # A connection dropped without close() must still go back to the pool
+        if getattr(self, 'raw', None) is not None:
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+def connect_postgres(url, autocommit=False):
+    """A direct (unpooled) connection, for schema setup and the cache watcher."""
+    import psycopg
+    raw = psycopg.connect(url, autocommit=autocommit)
+    configure_postgres(raw)
+    return PgConnection(raw)
+
+
+# The same tables, indexes and triggers as init_db() ends up with after all
+# of its migrations, in PostgreSQL terms. Timestamps stay TEXT in the formats
+# the app writes, so string comparisons and strptime() work unchanged.
+POSTGRES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL);
+
+    CREATE OR REPLACE FUNCTION utc_now_text() RETURNS TEXT LANGUAGE sql STABLE AS
+        $$ SELECT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') $$;
+
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        display_name TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'buyer',
+        age_verified INTEGER DEFAULT 0,
+        dob TEXT,
+        created_at TEXT DEFAULT utc_now_text(),
+        last_login TEXT,
+        is_active INTEGER DEFAULT 1,
+        email_digest_minutes INTEGER NOT NULL DEFAULT 60
+    );
+
+    CREATE TABLE IF NOT EXISTS muse_profiles (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        display_name TEXT NOT NULL,
+        bio TEXT,
+        avatar_url TEXT,
+        verification TEXT DEFAULT 'pending',
+        total_sales INTEGER DEFAULT 0,
+        avg_rating DOUBLE PRECISION DEFAULT 0,
+        created_at TEXT DEFAULT utc_now_text()
+    );
+
+    CREATE TABLE IF NOT EXISTS auctions (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        muse_id INTEGER REFERENCES muse_profiles(id),
+        title TEXT NOT NULL,
+        description TEXT,
+        category TEXT,
+        wear_duration TEXT,
+        image TEXT NOT NULL,
+        starting_bid DOUBLE PRECISION NOT NULL,
+        current_bid DOUBLE PRECISION,
+        current_bidder_id INTEGER REFERENCES users(id),
+        bid_count INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'draft',
+        starts_at TEXT,
+        ends_at TEXT NOT NULL,
+        original_end TEXT NOT NULL,
+        created_at TEXT DEFAULT utc_now_text(),
+        created_by INTEGER REFERENCES users(id),
+        archived_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS bids (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        auction_id INTEGER NOT NULL REFERENCES auctions(id),
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        amount DOUBLE PRECISION NOT NULL,
+        placed_at TEXT DEFAULT utc_now_text(),
+        is_winning INTEGER DEFAULT 0,
+        ip_address TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        auction_id INTEGER REFERENCES auctions(id),
+        buyer_id INTEGER REFERENCES users(id),
+        amount DOUBLE PRECISION NOT NULL,
+        processor TEXT,
+        processor_txn TEXT,
+        status TEXT DEFAULT 'pending',
+        payment_token TEXT UNIQUE,
+        created_at TEXT DEFAULT utc_now_text(),
+        completed_at TEXT,
+        expires_at TEXT,
+        admin_notes TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS shipments (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        payment_id INTEGER REFERENCES payments(id),
+        tracking_number TEXT,
+        carrier TEXT DEFAULT 'DHL',
+        destination TEXT,
+        status TEXT DEFAULT 'preparing',
+        shipped_at TEXT,
+        delivered_at TEXT,
+        shipping_cost DOUBLE PRECISION,
+        full_name TEXT,
+        address_line1 TEXT,
+        address_line2 TEXT,
+        city TEXT,
+        state TEXT,
+        postal_code TEXT,
+        country TEXT,
+        phone TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS shipping_addresses (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        full_name TEXT NOT NULL,
+        address_line1 TEXT NOT NULL,
+        address_line2 TEXT,
+        city TEXT NOT NULL,
+        state TEXT,
+        postal_code TEXT NOT NULL,
+        country TEXT NOT NULL,
+        phone TEXT,
+        is_default INTEGER DEFAULT 1,
+        created_at TEXT DEFAULT utc_now_text()
+    );
+
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        type TEXT NOT NULL,
+        title TEXT NOT NULL,
+        message TEXT,
+        link TEXT,
+        is_read INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT utc_now_text(),
+        payment_id INTEGER REFERENCES payments(id),
+        auction_id INTEGER REFERENCES auctions(id)
+    );
+
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        entity_type TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        details TEXT,
+        admin_id INTEGER REFERENCES users(id),
+        created_at TEXT DEFAULT utc_now_text()
+    );
+
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        task TEXT NOT NULL,
+        payload TEXT,
+        priority INTEGER NOT NULL DEFAULT 50,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_at TEXT NOT NULL,
+        dedupe_key TEXT,
+        locked_by TEXT,
+        locked_until TEXT,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        finished_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id INTEGER NOT NULL,
+        idem_key TEXT NOT NULL,
+        endpoint TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        status_code INTEGER,
+        mimetype TEXT,
+        response TEXT,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, idem_key)
+    );
+
+    -- rowid: the order maxima were first set in (SQLite's implicit rowid)
+    CREATE TABLE IF NOT EXISTS proxy_bids (
+        auction_id INTEGER NOT NULL REFERENCES auctions(id),
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        max_amount DOUBLE PRECISION NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        rowid BIGINT GENERATED ALWAYS AS IDENTITY,
+        PRIMARY KEY (auction_id, user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        to_addr TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        message TEXT,
+        link TEXT,
+        digest INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        send_after TEXT NOT NULL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS user_auction_state (
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        auction_id INTEGER NOT NULL REFERENCES auctions(id),
+        max_bid DOUBLE PRECISION NOT NULL,
+        bid_count INTEGER NOT NULL DEFAULT 0,
+        last_bid_at TEXT NOT NULL,
+        is_winning INTEGER NOT NULL DEFAULT 0,
+        is_live INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (user_id, auction_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS cache_events (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        kind TEXT NOT NULL,
+        cache_key TEXT,
+        created_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS maintenance_state (
+        name TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS auction_trending (
+        auction_id INTEGER PRIMARY KEY REFERENCES auctions(id),
+        score DOUBLE PRECISION NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, priority, run_at);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)
+        WHERE status = 'queued' AND dedupe_key IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at);
+    CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, digest, send_after);
+    CREATE INDEX IF NOT EXISTS idx_payments_expiry ON payments(expires_at) WHERE status = 'awaiting_payment';
+    CREATE INDEX IF NOT EXISTS idx_payments_auction_buyer ON payments(auction_id, buyer_id);
+    CREATE INDEX IF NOT EXISTS idx_bids_auction_amount ON bids(auction_id, amount DESC);
+    CREATE INDEX IF NOT EXISTS idx_bids_auction_id ON bids(auction_id, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_uas_user_state ON user_auction_state(user_id, is_live, is_winning);
+    CREATE INDEX IF NOT EXISTS idx_uas_recent ON user_auction_state(user_id, last_bid_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_uas_auction ON user_auction_state(auction_id);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_shipping_addresses_default ON shipping_addresses(user_id) WHERE is_default = 1;
+    CREATE INDEX IF NOT EXISTS idx_shipments_payment ON shipments(payment_id);
+    CREATE INDEX IF NOT EXISTS idx_notifications_payment ON notifications(payment_id);
+    CREATE INDEX IF NOT EXISTS idx_notifications_auction ON notifications(auction_id);
+    CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(created_at) WHERE is_read = 1;
+    CREATE INDEX IF NOT EXISTS idx_auction_trending_score ON auction_trending(score DESC);
+
+    -- user_auction_state upkeep, as the SQLite triggers in init_db()
+    CREATE OR REPLACE FUNCTION uas_bid() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO user_auction_state (user_id, auction_id, max_bid, bid_count, last_bid_at, is_live)
+        VALUES (NEW.user_id, NEW.auction_id, NEW.amount, 1, NEW.placed_at,
+                (SELECT (status = 'live')::int FROM auctions WHERE id = NEW.auction_id))
+        ON CONFLICT (user_id, auction_id) DO UPDATE SET
+            max_bid = GREATEST(user_auction_state.max_bid, excluded.max_bid),
+            bid_count = user_auction_state.bid_count + 1,
+            last_bid_at = excluded.last_bid_at;
+        RETURN NULL;
+    END $$;
+    CREATE OR REPLACE TRIGGER trg_uas_bid AFTER INSERT ON bids
+        FOR EACH ROW EXECUTE FUNCTION uas_bid();
+
+    CREATE OR REPLACE FUNCTION uas_leader() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE user_auction_state SET is_winning = COALESCE(user_id = NEW.current_bidder_id, false)::int
+        WHERE auction_id = NEW.id AND user_id IN (OLD.current_bidder_id, NEW.current_bidder_id);
+        RETURN NULL;
+    END $$;
+    CREATE OR REPLACE TRIGGER trg_uas_leader AFTER UPDATE OF current_bidder_id ON auctions
+        FOR EACH ROW WHEN (OLD.current_bidder_id IS DISTINCT FROM NEW.current_bidder_id)
+        EXECUTE FUNCTION uas_leader();
+
+    CREATE OR REPLACE FUNCTION uas_status() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE user_auction_state SET is_live = (NEW.status = 'live')::int WHERE auction_id = NEW.id;
+        RETURN NULL;
+    END $$;
+    CREATE OR REPLACE TRIGGER trg_uas_status AFTER UPDATE OF status ON auctions
+        FOR EACH ROW WHEN ((OLD.status = 'live') IS DISTINCT FROM (NEW.status = 'live'))
+        EXECUTE FUNCTION uas_status();
+'''
+
+
+def init_postgres(url):
+    """init_db() for a postgresql:// DATABASE: create the schema and seed data
+    on first start. Needs PostgreSQL 14+."""
+    conn = connect_postgres(url)
+    # One process at a time (several may start together without --preload)
+    conn.execute('SELECT pg_advisory_lock(?)', (PG_WRITE_LOCK,))
+    try:
+        if conn.execute("SELECT to_regclass('schema_version') IS NOT NULL").fetchone()[0] and \
+                (conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0) >= SCHEMA_VERSION:
+            return
+        conn.executescript(POSTGRES_SCHEMA)
+        # The cold archive is SQLite-only; history is simply the live tables
+        for table, columns in ARCHIVE_TABLES.items():
+            conn.execute(f'CREATE OR REPLACE VIEW history_{table} AS SELECT {columns} FROM {table}')
+        if not conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            _seed_data(conn)
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (SCHEMA_VERSION,))
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute('SELECT pg_advisory_unlock(?)', (PG_WRITE_LOCK,))
+        conn.close()
+
+
+# =============================================
+# CACHE INVALIDATION (cross-process)
+# =============================================
+# Each Gunicorn worker, and the job worker, may keep small in-process caches
+# (LocalCache). A writer records a typed event with invalidate(conn, kind, key)
+# in the same transaction as the change. Before every request, each process
+# checks `PRAGMA data_version` on its own long-lived connection. That read
+# comes from the WAL index in shared memory, with no disk I/O, and shows
+# whether any other connection has committed since the last check. Only then
+# does the process read the new cache_events rows, as a primary-key range scan.
+# A change is therefore visible to the next request in every worker.
+# A shared mmap like the rate limiter's would not reach the separately
+# started job worker. The database does.
+
+CACHE_EVENT_RETENTION_MINUTES = 60  # longer than any worker goes without a request or poll
+
+
+class CacheBus:
+    """Delivers cache_events committed by any process to this process's caches."""
+
+    def __init__(self):
+        self.caches = collections.defaultdict(list)  # kind -> [LocalCache]
+        self.watchers = {}  # database path -> this process's watcher state
+        self.lock = threading.Lock()
+
+    def register(self, cache):
+        self.caches[cache.kind].append(cache)
+
+    def flush(self, path):
+        for caches in self.caches.values():
+            for cache in caches:
+                cache.invalidate(path)
+
+    def poll(self, path):
+        """Apply every event committed since the last poll (cheap when there are none)."""
+        with self.lock:
+            watcher = self.watchers.get(path)
+            if watcher is None or watcher['pid'] != os.getpid():
+                # First poll in this process (a forked worker must not reuse the
+                # master's connection, nor trust anything cached before the fork)
+                if is_postgres_url(path):
+                    conn = connect_postgres(path, autocommit=True)
+                else:
+                    conn = sqlite3.connect(path, uri=path.startswith('file:'), check_same_thread=False)
+                self.watchers[path] = {
+                    'pid': os.getpid(), 'conn': conn, 'version': self._data_version(conn),
+                    'last_id': conn.execute('SELECT COALESCE(MAX(id), 0) FROM cache_events').fetchone()[0],
+                }
+                self.flush(path)
+                return
+            version = self._data_version(watcher['conn'])
+            if version is not None and version == watcher['version']:
+                return
+            watcher['version'] = version
+            events = watcher['conn'].execute('SELECT id, kind, cache_key FROM cache_events WHERE id > ? ORDER BY id',
+                                             (watcher['last_id'],)).fetchall()
+            if not events:
+                return
+            if events[0][0] != watcher['last_id'] + 1:
+                # Ids are gapless (AUTOINCREMENT), so a gap means events were pruned
+                # unseen. (PostgreSQL also skips the ids of rolled-back inserts; the
+                # flush that costs is harmless.)
+                self.flush(path)
+            else:
+                for _, kind, key in events:
+                    for cache in self.caches.get(kind, ()):
+                        cache.invalidate(path, None if key is None else json.loads(key))
+            watcher['last_id'] = events[-1][0]
+
+    @staticmethod
+    def _data_version(conn):
+        # PostgreSQL has no commit counter, so there every poll reads cache_events
+        return None if is_postgres(conn) else conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def stats(self):
+        return {cache.kind: cache.stats() for caches in self.caches.values() for cache in caches}
+
+
+cache_bus = CacheBus()
+
+
+class LocalCache:
+    """Bounded LRU cache of loader results in this process, keyed per database
+    and emptied by cache events of its kind."""
+
+    def __init__(self, kind, maxsize=4096, bus=cache_bus):
+        self.kind = kind
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        bus.register(self)
+
+    def get(self, key, loader):
+        """Cached value for key, calling loader(key) on a miss (None is not cached)."""
+        path = (current_app if has_app_context() else app).config['DATABASE']
+        with self.lock:
+            if (path, key) in self.data:
+                self.data.move_to_end((path, key))
+                self.hits += 1
+                return self.data[(path, key)]
+            self.misses += 1
+        value = loader(key)
+        if value is not None:
+            with self.lock:
+                self.data[(path, key)] = value
+                if len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+        return value
+
+    def invalidate(self, path, key=None):
+        with self.lock:
+            if key is None:
+                for k in [k for k in self.data if k[0] == path]:
+                    del self.data[k]
+            else:
+                self.data.pop((path, key), None)
+
+    def stats(self):
+        return {'size': len(self.data), 'hits': self.hits, 'misses': self.misses}
+
+
+def invalidate(conn, kind, key=None):
+    """Record a cache event in the caller's transaction (caller commits). Every
+    process drops the cached `key` (or all entries when key is None) of this
+    kind before its next request."""
+    if kind not in cache_bus.caches:
+        raise ValueError(f'Unknown cache kind {kind!r}')
+    if is_postgres(conn):
+        # Ids must become visible in order; SQLite's single writer gives that for free
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (PG_CACHE_EVENTS_LOCK,))
+    conn.execute('INSERT INTO cache_events (kind, cache_key, created_at) VALUES (?, ?, ?)',
+                 (kind, None if key is None else json.dumps(key),
+                  datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')))
+
+
+@bp.before_app_request
+def poll_cache_events():
+    cache_bus.poll(current_app.config['DATABASE'])
+
+
+@bp.route('/admin/metrics/cache')
+@admin_required
+def admin_cache_metrics():
+    """Cache counters of the worker process that serves this request, as JSON."""
+    return jsonify(cache_bus.stats())
+
+
+user_cache = LocalCache('user')
+
+
+# =============================================
+# TRENDING AUCTIONS
+# =============================================
+# The landing page ranks live auctions by bid velocity with exponential time
+# decay: every bid counts 1 and its weight halves each
+# TRENDING_HALF_LIFE_SECONDS. The decay is applied forward. A bid at epoch
+# second t adds e^(λ·t), so a stored score never needs decaying and an
+# auction's rank only changes when it gets a bid. Scores are kept as
+# ln(Σ e^(λ·t)), which stays well inside float range. The decayed bid count
+# at any moment is e^(score − λ·now).
+#
+# Each process keeps the ranking in memory (TrendingBoard). It holds a
+# max-heap over the top TRENDING_TRACKED auctions plus its own bids; stale
+# heap entries are skipped when read. place_bid adds to it in O(1) plus one
+# heap push once the bid has committed. The process's own bids also collect
+# as pending deltas. Every TRENDING_FLUSH_SECONDS they are merged into
+# auction_trending in a short transaction of their own, right after a bid
+# commits (or from home() when bids have stopped); a failed flush puts them
+# back for the next one. Every TRENDING_REFRESH_SECONDS the heap is reloaded
+# from the top of idx_auction_trending_score, which brings in the other
+# workers' bids. The top-K never reads `bids`. A killed worker loses at most
+# a few seconds of trend signal; bids themselves are unaffected.
+
+TRENDING_HALF_LIFE_SECONDS = 3600
+TRENDING_DECAY = math.log(2) / TRENDING_HALF_LIFE_SECONDS  # λ, per second
+TRENDING_SIZE = 4           # auctions in the landing page's trending row
+TRENDING_MIN_HEAT = 1.5     # decayed bid count an auction needs to be shown (~2 recent bids)
+TRENDING_TRACKED = 100      # rows each process loads into its heap
+TRENDING_FLUSH_SECONDS = 10
+TRENDING_REFRESH_SECONDS = 15
+
+
+def _log_add(a, b):
+    """ln(e^a + e^b) without overflow; None stands for an empty sum."""
+    if a is None or b is None:
+        return b if a is None else a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class TrendingBoard:
+    """This process's trending ranking for one database."""
+
+    def __init__(self):
+        self.scores = {}   # auction_id -> (log score, ends_at)
+        self.heap = []     # (-log score, auction_id); superseded entries are skipped
+        self.pending = {}  # auction_id -> (log score, ends_at) not yet in auction_trending
+        self.flushed_at = self.loaded_at = 0.0  # monotonic
+        self.lock = threading.Lock()
+
+    def record(self, auction_id, bids, when, ends_at):
+        """Count `bids` bids placed on an auction at `when` (epoch seconds)."""
+        delta = math.log(bids) + TRENDING_DECAY * when
+        with self.lock:
+            score = _log_add(self.scores.get(auction_id, (None,))[0], delta)
+            self.scores[auction_id] = (score, ends_at)
+            heapq.heappush(self.heap, (-score, auction_id))
+            self.pending[auction_id] = (_log_add(self.pending.get(auction_id, (None,))[0], delta), ends_at)
+            if len(self.heap) > 2 * len(self.scores) + TRENDING_TRACKED:
+                self.heap = [(-score, aid) for aid, (score, _) in self.scores.items()]
+                heapq.heapify(self.heap)
+
+    def flush_due(self):
+        return bool(self.pending) and time.monotonic() - self.flushed_at >= TRENDING_FLUSH_SECONDS
+
+    def flush(self, conn):
+        """Merge pending bids into auction_trending in a short write transaction
+        of its own; conn must not be inside one. If the write fails, the bids
+        go back into pending for the next flush and the error is raised."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            begin_write(conn)
+            if is_postgres(conn):
+                # Rows are read, merged and written back, so flushes must not interleave
+                conn.execute('SELECT pg_advisory_xact_lock(?)', (PG_TRENDING_LOCK,))
+            stored = dict(conn.execute(
+                'SELECT auction_id, score FROM auction_trending WHERE auction_id IN (SELECT value FROM json_each(?))',
+                (json.dumps(list(pending)),)).fetchall())
+            now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            # Upsert in id order so concurrent flushes take row locks in the same order
+            conn.executemany('''
+                INSERT INTO auction_trending (auction_id, score, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (auction_id) DO UPDATE SET score = excluded.score, updated_at = excluded.updated_at
+            ''', [(auction_id, _log_add(stored.get(auction_id), score), now_str)
+                  for auction_id, (score, _) in sorted(pending.items())])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            with self.lock:
+                for auction_id, (score, ends_at) in pending.items():
+                    newer, newer_ends_at = self.pending.get(auction_id, (None, ends_at))
+                    self.pending[auction_id] = (_log_add(newer, score), newer_ends_at)
+            raise
+
+    def refresh(self, conn):
+        """Reload the heap from auction_trending, keeping unflushed local bids."""
+        rows = conn.execute('''
+            SELECT t.auction_id, t.score, a.ends_at
+            FROM auction_trending t
+            JOIN auctions a ON a.id = t.auction_id
+            WHERE a.status = 'live'
+            ORDER BY t.score DESC
+            LIMIT ?
+        ''', (TRENDING_TRACKED,)).fetchall()
+        with self.lock:
+            scores = {row[0]: (row[1], row[2]) for row in rows}
+            for auction_id, (score, ends_at) in self.pending.items():
+                scores[auction_id] = (_log_add(scores.get(auction_id, (None,))[0], score), ends_at)
+            self.scores = scores
+            self.heap = [(-score, auction_id) for auction_id, (score, _) in scores.items()]
+            heapq.heapify(self.heap)
+            self.loaded_at = time.monotonic()
+
+    def top(self, conn, k=TRENDING_SIZE):
+        """The k hottest auctions still running, as [(auction_id, bids per hour)]."""
+        if self.flush_due() and not shed_low_priority_writes():
+            # This worker has stopped taking bids; publish what it has
+            self.flush(conn)
+        if time.monotonic() - self.loaded_at >= TRENDING_REFRESH_SECONDS:
+            self.refresh(conn)
+        now = time.time()
+        now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        floor = math.log(TRENDING_MIN_HEAT) + TRENDING_DECAY * now
+        picked, kept = [], []
+        with self.lock:
+            while self.heap and len(picked) < k:
+                entry = heapq.heappop(self.heap)
+                score, auction_id = -entry[0], entry[1]
+                current = self.scores.get(auction_id)
+                if current is None or current[0] != score:
+                    continue  # superseded by a later bid, or dropped on reload
+                kept.append(entry)
+                if score < floor:
+                    break  # everything below has cooled off too
+                if current[1] > now_str:
+                    heat = math.exp(score - TRENDING_DECAY * now)
+                    picked.append((auction_id, heat * TRENDING_DECAY * 3600))
+            for entry in kept:
+                heapq.heappush(self.heap, entry)
+        return picked
+
+
+_trending_boards = {}  # database path -> TrendingBoard
+
+
+def trending_board(path=None):
+    if path is None:
+        path = (current_app if has_app_context() else app).config['DATABASE']
+    if path not in _trending_boards:
+        _trending_boards[path] = TrendingBoard()
+    return _trending_boards[path]
+
+
 # =============================================
 # USER MODEL (Flask-Login)
 # =============================================
@@ -360,6 +1836,11 @@ class User(UserMixin):
 
     @staticmethod
     def get_by_id(user_id):
+        """Served from user_cache; writers to users call invalidate(conn, 'user', id)."""
+        return user_cache.get(user_id, User._load)
+
+    @staticmethod
+    def _load(user_id):
         conn = get_db()
         row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
         conn.close()
@@ -388,10 +1869,10 @@ def load_user(user_id):
 # AUTH ROUTES
 # =============================================
 
-@app.route('/auth/register', methods=['GET', 'POST'])
+@bp.route('/auth/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     # Max DOB = 18 years ago
     max_dob = (datetime.now() - timedelta(days=18 * 365)).strftime('%Y-%m-%d')
@@ -462,15 +1943,15 @@ def register():
                     row['role'], row['age_verified'], row['is_active'])
         login_user(user)
         flash('Welcome to PantiesFan! Your account has been created.', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     return render_template('auth/register.html', max_dob=max_dob)
 
 
-@app.route('/auth/login', methods=['GET', 'POST'])
+@bp.route('/auth/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     if request.method == 'POST':
         email = request.form.get('email', '').lower().strip()
@@ -480,40 +1961,41 @@ def login():
 
         if user and check_password_hash(password_hash, password):
             login_user(user)
-            # Update last login
-            conn = get_db()
-            conn.execute('UPDATE users SET last_login = ? WHERE id = ?',
-                         (datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), user.id))
-            conn.commit()
-            conn.close()
+            # Update last login (cosmetic — skipped while writes are backed up)
+            if not shed_low_priority_writes():
+                conn = get_db()
+                conn.execute('UPDATE users SET last_login = ? WHERE id = ?',
+                             (datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), user.id))
+                conn.commit()
+                conn.close()
 
             flash(f'Welcome back, {user.display_name}!', 'success')
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('home'))
+            return redirect(next_page or url_for('main.home'))
         else:
             flash('Invalid email or password.', 'error')
 
     return render_template('auth/login.html')
 
 
-@app.route('/auth/logout')
+@bp.route('/auth/logout')
 @login_required
 def logout():
     logout_user()
     flash('You have been signed out.', 'info')
-    return redirect(url_for('home'))
+    return redirect(url_for('main.home'))
 
 
 # =============================================
 # MAIN ROUTES
 # =============================================
 
-@app.route('/')
+@bp.route('/')
 def home():
     conn = get_db()
 
-    # Auto-end expired auctions + create payment records for winners
-    end_expired_auctions(conn)
+    # Expired auctions are settled by the job worker — just make sure a run is queued
+    request_settlement(conn)
 
     # Fetch auctions with muse info
     rows = conn.execute('''
@@ -538,35 +2020,470 @@ def home():
                 item['last_bidder_name'] = bidder['display_name']
 
         # Get recent bids (last 5)
-        recent = conn.execute('''
-            SELECT b.amount, u.display_name as bidder
-            FROM bids b
-            JOIN users u ON b.user_id = u.id
-            WHERE b.auction_id = ?
-            ORDER BY b.placed_at DESC
-            LIMIT 5
-        ''', (item['id'],)).fetchall()
-        item['recent_bids'] = [dict(r) for r in recent]
+        recent = bid_history_page(conn, item['id'], limit=5, archived=item['archived_at'])
+        item['recent_bids'] = [{'amount': r['amount'], 'bidder': r['bidder']} for r in recent]
 
         auctions.append(item)
 
+    # Trending row: served from this worker's in-memory ranking
+    by_id = {item['id']: item for item in auctions}
+    trending = [dict(by_id[auction_id], bids_per_hour=rate)
+                for auction_id, rate in trending_board().top(conn) if auction_id in by_id]
+
     conn.close()
-    return render_template('index.html', auctions=auctions)
+    return render_template('index.html', auctions=auctions, trending=trending)
+
+
+# =============================================
+# RATE LIMITING
+# =============================================
+# Token buckets live in a shared mmap of an unlinked temp file created at
+# import time. Under `gunicorn --preload` that happens in the master, so every
+# forked worker reads and writes the same buckets — no DB round trip to decide
+# a 429. Without preload (dev server, tests) each process simply has its own.
+# Updates are serialized with lockf on that file, which the kernel releases if
+# the holder dies (a worker killed by Gunicorn's timeout must not stall bids).
+
+BID_LIMIT_PER_USER = (5, 0.5)       # burst, tokens/second: 5 quick bids, then one per 2s
+BID_LIMIT_PER_AUCTION = (40, 20.0)  # shared by every bidder on one auction
+
+
+class TokenBucketLimiter:
+    """Fixed-size, direct-mapped table of token buckets in shared memory.
+
+    A key hashing onto a slot held by another key takes the slot over with a
+    full bucket — harmless for rate limiting and keeps lookups O(1)."""
+
+    SLOT = struct.Struct('<Qdd')  # key hash, tokens, last refill (monotonic seconds)
+    COUNTERS = ('allowed', 'limited_user', 'limited_item')
+
+    def __init__(self, slots=8192):
+        self.slots = slots
+        self.counter_offset = self.SLOT.size * slots
+        self.file = tempfile.TemporaryFile()
+        self.file.truncate(self.counter_offset + 8 * len(self.COUNTERS))
+        self.mem = mmap.mmap(self.file.fileno(), self.counter_offset + 8 * len(self.COUNTERS))
+        self.thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        # lockf excludes other processes, the thread lock other threads
+        with self.thread_lock:
+            fcntl.lockf(self.file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _bump(self, counter):
+        offset = self.counter_offset + 8 * self.COUNTERS.index(counter)
+        struct.pack_into('<Q', self.mem, offset, struct.unpack_from('<Q', self.mem, offset)[0] + 1)
+
+    def hit(self, buckets):
+        """Take one token from every (scope, key, burst, rate) bucket, or from
+        none of them. Scope is 'user' or 'item'. Returns (0, None) when allowed,
+        else (retry_after_seconds, scope that ran dry)."""
+        now = time.monotonic()
+        with self._locked():
+            state = []
+            for scope, key, burst, rate in buckets:
+                h = self._hash(key)
+                offset = self.SLOT.size * (h % self.slots)
+                slot_key, tokens, last = self.SLOT.unpack_from(self.mem, offset)
+                if slot_key != h:
+                    tokens, last = burst, now
+                tokens = min(burst, tokens + (now - last) * rate)
+                if tokens < 1:
+                    self.SLOT.pack_into(self.mem, offset, h, tokens, now)
+                    self._bump(f'limited_{scope}')
+                    return math.ceil((1 - tokens) / rate), scope
+                state.append((offset, h, tokens))
+            for offset, h, tokens in state:
+                self.SLOT.pack_into(self.mem, offset, h, tokens - 1, now)
+            self._bump('allowed')
+        return 0, None
+
+    def stats(self):
+        with self._locked():
+            counters = {name: struct.unpack_from('<Q', self.mem, self.counter_offset + 8 * i)[0]
+                        for i, name in enumerate(self.COUNTERS)}
+            used = sum(1 for i in range(self.slots) if struct.unpack_from('<Q', self.mem, self.SLOT.size * i)[0])
+        return dict(counters, slots_used=used, slots=self.slots)
+
+
+bid_limiter = TokenBucketLimiter()
+
+
+def rate_limited(per_user, per_item=None, item_arg=None, limiter=bid_limiter):
+    """Decorator: token-bucket limit per logged-in user (and optionally per
+    item, e.g. per auction). Rejects with 429 + Retry-After before the view
+    touches the database. Put it below @idempotent, so a replayed
+    Idempotency-Key costs no token. Disable with RATE_LIMIT_ENABLED=False."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Flask-Login keeps the id in the signed session cookie; reading it
+            # directly needs no user_loader query. Anonymous requests fall
+            # through (see @login_required).
+            user_id = session.get('_user_id')
+            if user_id is None or not current_app.config['RATE_LIMIT_ENABLED']:
+                return f(*args, **kwargs)
+            buckets = [('user', f'{f.__name__}:u:{user_id}', *per_user)]
+            if per_item:
+                buckets.append(('item', f'{f.__name__}:i:{kwargs[item_arg]}', *per_item))
+            retry_after, scope = limiter.hit(buckets)
+            if retry_after:
+                message = ('Too many bids on this auction right now — try again in a moment.' if scope == 'item'
+                           else 'You are bidding too fast — please wait a moment.')
+                resp = jsonify({'success': False, 'message': message, 'retry_after': retry_after})
+                resp.status_code = 429
+                resp.headers['Retry-After'] = str(retry_after)
+                return resp
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+@bp.route('/admin/metrics/rate-limit')
+@admin_required
+def admin_rate_limit_metrics():
+    """Limiter counters (shared by all workers under --preload) as JSON."""
+    return jsonify(bid_limiter.stats())
+
+
+# =============================================
+# WRITE HEALTH GUARD (load shedding / read-only mode)
+# =============================================
+# SQLite has one writer. When writes back up, each request waits up to
+# busy_timeout and ties up one of only two sync workers. Timed BEGIN IMMEDIATE
+# calls (begin_write) record how long writers wait for the lock and how many
+# are waiting now. The state is kept in a small file-backed mmap next to the
+# database, so Gunicorn workers and the job worker all see the same figures.
+#   ok        -> normal
+#   shed      -> skip or defer low-priority writes: last_login stamps,
+#                marking notifications read, LOW-priority jobs (outbid notices)
+#   read_only -> reject every POST except bids, payments and sign-in, and show
+#                a banner; bids are never shed
+# Wait times decay with WRITE_HEALTH_DECAY_SECONDS, and a waiter left behind
+# by a killed worker stops counting once its process is gone (or after
+# WRITE_WAITER_EXPIRY_SECONDS), so the site recovers by itself once writes are
+# fast again. Admins can also force read-only mode (maintenance); the switch
+# clears the waiter count as well.
+
+WRITE_SHED_WAIT_MS = 250          # average lock wait that starts shedding
+WRITE_READ_ONLY_WAIT_MS = 2000    # ... and that closes the site to non-bid writes
+WRITE_SHED_QUEUE = 2              # writers waiting on the lock right now
+WRITE_READ_ONLY_QUEUE = 4
+WRITE_HEALTH_DECAY_SECONDS = 10.0
+WRITE_WAITER_EXPIRY_SECONDS = 30  # well past busy_timeout / lock_timeout (5s)
+# Bids, paying for a won auction (the payment window keeps running), signing
+# in, and the admin switch itself stay open in read-only mode
+WRITE_GUARD_EXEMPT = {'main.place_bid', 'main.payment_save_address', 'main.payment_confirm_method',
+                      'main.process_card_payment', 'main.login', 'main.admin_write_mode'}
+
+
+class WriteHealth:
+    """Shared lock-wait statistics: an exponentially decaying average of the
+    BEGIN IMMEDIATE wait, the writers waiting right now, and a forced
+    read-only flag.
+
+    Each waiting writer holds a slot (pid, since) rather than bumping a
+    counter, so a worker killed mid-wait cannot leave the queue looking full:
+    slots of dead processes, and slots older than WRITE_WAITER_EXPIRY_SECONDS
+    (no lock wait lasts that long), are not counted and get reused."""
+
+    MAGIC = b'WH2\0'
+    STATE = struct.Struct('<4sqdd')  # magic, forced read-only, average wait ms, last update (epoch)
+    SLOT = struct.Struct('<qd')      # waiter pid, waiting since (epoch; 0 = free)
+    SLOTS = 64
+    SIZE = STATE.size + SLOTS * SLOT.size
+
+    def __init__(self, path=None):
+        if path:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size < self.SIZE:
+                os.ftruncate(self.fd, self.SIZE)
+            self.mem = mmap.mmap(self.fd, self.SIZE)
+        else:
+            self.fd = None  # memory and PostgreSQL databases: this process only
+            self.mem = mmap.mmap(-1, self.SIZE)
+        self.thread_lock = threading.Lock()
+        with self._locked():
+            pass  # formats a new (or old-layout) file
+
+    @contextmanager
+    def _locked(self):
+        # lockf excludes other processes, the thread lock other threads
+        with self.thread_lock:
+            if self.fd is not None:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                if self.mem[:len(self.MAGIC)] != self.MAGIC:
+                    self.mem[:] = bytes(self.SIZE)
+                    self.STATE.pack_into(self.mem, 0, self.MAGIC, 0, 0.0, 0.0)
+                yield self.STATE.unpack_from(self.mem)[1:]
+            finally:
+                if self.fd is not None:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _decayed(avg_ms, updated):
+        return avg_ms * math.exp(-max(0.0, time.time() - updated) / WRITE_HEALTH_DECAY_SECONDS)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _waiters(self):
+        """(slot, pid, since) of every slot that still counts as waiting."""
+        cutoff = time.time() - WRITE_WAITER_EXPIRY_SECONDS
+        for slot in range(self.SLOTS):
+            pid, since = self.SLOT.unpack_from(self.mem, self.STATE.size + slot * self.SLOT.size)
+            if since > cutoff and (pid == os.getpid() or self._alive(pid)):
+                yield slot, pid, since
+
+    def enter(self):
+        """Mark this process as waiting for the write lock. Returns the slot to
+        pass to leave(), or None when every slot is busy (not counted then)."""
+        with self._locked():
+            busy = {slot for slot, _, _ in self._waiters()}
+            for slot in range(self.SLOTS):
+                if slot not in busy:
+                    self.SLOT.pack_into(self.mem, self.STATE.size + slot * self.SLOT.size,
+                                        os.getpid(), time.time())
+                    return slot
+        return None
+
+    def leave(self, slot, wait_ms=None):
+        """Free the slot from enter(); wait_ms (the lock was taken) feeds the average."""
+        with self._locked() as (forced, avg_ms, updated):
+            if slot is not None:
+                self.SLOT.pack_into(self.mem, self.STATE.size + slot * self.SLOT.size, 0, 0.0)
+            if wait_ms is not None:
+                avg_ms = self._decayed(avg_ms, updated)
+                self.STATE.pack_into(self.mem, 0, self.MAGIC, forced,
+                                     avg_ms + 0.3 * (wait_ms - avg_ms), time.time())
+
+    def force_read_only(self, on):
+        """Set or clear forced read-only mode. Either way the waiter slots are
+        cleared, so the admin switch also resets a queue count that looks stuck."""
+        with self._locked() as (_, avg_ms, updated):
+            self.mem[self.STATE.size:] = bytes(self.SIZE - self.STATE.size)
+            self.STATE.pack_into(self.mem, 0, self.MAGIC, int(on), avg_ms, updated)
+
+    def snapshot(self):
+        _, forced, avg_ms, updated = self.STATE.unpack_from(self.mem)
+        avg_ms = self._decayed(avg_ms, updated)
+        waiting = sum(1 for _ in self._waiters())
+        if forced or avg_ms >= WRITE_READ_ONLY_WAIT_MS or waiting >= WRITE_READ_ONLY_QUEUE:
+            level = 'read_only'
+        elif avg_ms >= WRITE_SHED_WAIT_MS or waiting >= WRITE_SHED_QUEUE:
+            level = 'shed'
+        else:
+            level = 'ok'
+        return {'level': level, 'forced_read_only': bool(forced), 'waiting': waiting,
+                'avg_wait_ms': round(avg_ms, 1)}
+
+
+_write_health = {}  # database path -> WriteHealth
+
+
+def write_health(path=None):
+    """The WriteHealth for a database (file-backed next to it, shared by every process)."""
+    if path is None:
+        path = (current_app if has_app_context() else app).config['DATABASE']
+    if path not in _write_health:
+        shared = not is_memory_database(path) and not is_postgres_url(path)
+        _write_health[path] = WriteHealth(f'{path}-writehealth' if shared else None)
+    return _write_health[path]
+
+
+def write_level():
+    return write_health().snapshot()['level']
+
+
+def shed_low_priority_writes():
+    """True when optional writes should be skipped to keep the lock free for bids."""
+    return write_level() != 'ok'
+
+
+def begin_write(conn, sql='BEGIN IMMEDIATE', params=()):
+    """BEGIN IMMEDIATE (or another locking statement, see lock_auction()),
+    timing the wait for the lock into write_health(). Returns the cursor."""
+    health = write_health()
+    slot = health.enter()
+    started = time.perf_counter()
+    wait_ms = None
+    try:
+        cursor = conn.execute(sql, params)
+        wait_ms = (time.perf_counter() - started) * 1000
+    finally:
+        health.leave(slot, wait_ms)
+    return cursor
+
+
+@bp.before_app_request
+def guard_writes():
+    """In read-only mode, refuse non-bid writes up front instead of letting them
+    queue on the lock."""
+    if request.method != 'POST' or request.endpoint in WRITE_GUARD_EXEMPT:
+        return None
+    if write_level() != 'read_only':
+        return None
+    message = 'The site is temporarily read-only while we catch up. Bidding still works — please try again in a few minutes.'
+    if request.path.startswith('/api/') or request.is_json:
+        resp = jsonify({'success': False, 'message': message, 'read_only': True})
+        resp.status_code = 503
+        resp.headers['Retry-After'] = str(int(WRITE_HEALTH_DECAY_SECONDS))
+        return resp
+    flash(message, 'error')
+    return redirect(request.referrer or url_for('main.home'))
+
+
+@bp.app_context_processor
+def inject_write_mode():
+    return {'site_read_only': write_level() == 'read_only'}
+
+
+@bp.route('/admin/metrics/write-health')
+@admin_required
+def admin_write_health():
+    """Lock-wait figures shared by all workers, as JSON."""
+    return jsonify(write_health().snapshot())
+
+
+@bp.route('/admin/write-mode', methods=['POST'])
+@admin_required
+def admin_write_mode():
+    """Force read-only mode on or off (maintenance)."""
+    on = request.form.get('read_only') == '1'
+    write_health().force_read_only(on)
+    flash('Site is now read-only (bids still accepted).' if on else 'Read-only mode switched off.',
+          'success')
+    return redirect(url_for('main.admin_dashboard'))
 
 
 # =============================================
 # BID API
 # =============================================
 
-@app.route('/api/bid/<int:item_id>', methods=['POST'])
+BID_PAGE_SIZE = 50
+
+
+def bid_history_page(conn, auction_id, before=None, limit=BID_PAGE_SIZE, detail=False, archived=False):
+    """Newest-first bids for one auction, keyset-paged on bid id.
+
+    `before` is the id of the last bid the caller already has (None for the
+    first page). Each page is an index range scan on idx_bids_auction_id, so
+    page 1000 costs the same as page 1. detail=True adds the admin-only
+    bidder email and IP address. Pass archived=auction['archived_at'] so
+    bids moved to the cold archive are read from there."""
+    extra = ', u.email as bidder_email, b.ip_address' if detail else ''
+    if archived:
+        attach_archive(conn)
+    return conn.execute(f'''
+        SELECT b.id, b.amount, b.placed_at, b.is_winning, u.display_name as bidder{extra}
+        FROM {'archive.bids' if archived else 'bids'} b
+        JOIN users u ON b.user_id = u.id
+        WHERE b.auction_id = ? AND b.id < ?
+        ORDER BY b.id DESC
+        LIMIT ?
+    ''', (auction_id, before if before is not None else 2 ** 63 - 1, limit)).fetchall()
+
+
+@bp.route('/api/auction/<int:auction_id>/bids')
+def auction_bid_history(auction_id):
+    """Page through an auction's bids, newest first.
+
+    Compact payload: `bids` is a list of [id, bidder, amount, placed_at,
+    is_winning] arrays (column names in `fields`). Pass `next` back as
+    ?before= to get the following page; it is null on the last page."""
+    before = request.args.get('before', type=int)
+    conn = get_db()
+    auction = conn.execute('SELECT archived_at FROM auctions WHERE id = ?', (auction_id,)).fetchone()
+    if not auction:
+        conn.close()
+        return jsonify({'success': False, 'message': 'Auction not found.'}), 404
+    rows = bid_history_page(conn, auction_id, before, archived=auction['archived_at'])
+    conn.close()
+    return jsonify({
+        'fields': ['id', 'bidder', 'amount', 'placed_at', 'is_winning'],
+        'bids': [[r['id'], r['bidder'], r['amount'], r['placed_at'], r['is_winning']] for r in rows],
+        'next': rows[-1]['id'] if len(rows) == BID_PAGE_SIZE else None,
+    })
+
+
+def resolve_proxy_bids(price, leader_id, proxies, leader_wins_ties=True):
+    """Resolve competing maximum bids in memory.
+
+    price/leader_id describe the auction after any direct bid in this request
+    (leader_id may be None). proxies is [(user_id, max_amount)] in the order
+    the maxima were set; earlier maxima win ties. A leader who got there by a
+    direct bid just now (leader_wins_ties=False) loses ties to standing maxima.
+    Returns (leader_id, price, bids): the outcome plus the visible bids to
+    record, in order — at most two however many proxies are competing."""
+    ceilings, order = {}, []
+    if leader_id:
+        ceilings[leader_id] = price
+        order.append(leader_id)
+    for user_id, max_amount in proxies:
+        if user_id not in ceilings:
+            order.append(user_id)
+        ceilings[user_id] = max(ceilings.get(user_id, 0), max_amount)
+
+    floor = price + MIN_BID_INCREMENT if leader_wins_ties else price
+    tie_rank = {u: i for i, u in enumerate(order)}
+    if leader_id and not leader_wins_ties:
+        tie_rank[leader_id] = len(order)
+    contenders = sorted((u for u in order if u == leader_id or ceilings[u] >= floor),
+                        key=lambda u: (-ceilings[u], tie_rank[u]))
+    if not contenders:
+        return leader_id, price, []
+    winner = contenders[0]
+    runner = contenders[1] if len(contenders) > 1 else None
+
+    if runner is None:
+        # Sole bidder: a newcomer opens at the minimum, a lone leader stays put
+        if winner == leader_id:
+            return leader_id, price, []
+        return winner, floor, [(winner, floor)]
+
+    bids = []
+    if ceilings[runner] > price:
+        # The runner-up's proxy bids all the way to its max before giving up
+        bids.append((runner, ceilings[runner]))
+    elif winner == leader_id:
+        return leader_id, price, []
+    new_price = min(ceilings[winner], ceilings[runner] + MIN_BID_INCREMENT)
+    bids.append((winner, new_price))
+    return winner, new_price, bids
+
+
+@bp.route('/api/bid/<int:item_id>', methods=['POST'])
 @login_required
+@idempotent  # a replay returns the stored answer without spending a rate-limit token
+@rate_limited(BID_LIMIT_PER_USER, BID_LIMIT_PER_AUCTION, item_arg='item_id')
 def place_bid(item_id):
+    """Place a bid. JSON body: {"amount": X} for a direct bid, or
+    {"max_amount": Y} to set a hidden maximum the server bids up to in
+    MIN_BID_INCREMENT steps. Competing maxima are resolved here in one
+    transaction, so a contested auction costs one request per bidder."""
     conn = get_db()
     now = datetime.now(timezone.utc)
     now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    # Get auction
-    auction = conn.execute('SELECT * FROM auctions WHERE id = ?', (item_id,)).fetchone()
+    # Serialize bids on this auction: price checks and updates must not interleave
+    auction = storage().lock_auction(conn, item_id)
 
     if not auction:
         conn.close()
@@ -587,19 +2504,31 @@ def place_bid(item_id):
 
     # Get bid amount from request
     data = request.get_json()
-    if not data or 'amount' not in data:
+    is_proxy = bool(data) and 'max_amount' in data
+    if not data or ('amount' not in data and not is_proxy):
         conn.close()
         return jsonify({'success': False, 'message': 'Bid amount is required.'}), 400
 
     try:
-        bid_amount = float(data['amount'])
+        bid_amount = float(data['max_amount'] if is_proxy else data['amount'])
     except (ValueError, TypeError):
         conn.close()
         return jsonify({'success': False, 'message': 'Invalid bid amount.'}), 400
 
+    price = auction['current_bid'] or auction['starting_bid']
+    previous_bidder_id = auction['current_bidder_id']
+
     # Validate bid amount
-    min_bid = (auction['current_bid'] or auction['starting_bid']) + MIN_BID_INCREMENT
-    if bid_amount < min_bid:
+    min_bid = price + MIN_BID_INCREMENT
+    if is_proxy and previous_bidder_id == current_user.id:
+        # The leader may raise their hidden max without bidding against themselves
+        current_max = conn.execute('SELECT max_amount FROM proxy_bids WHERE auction_id = ? AND user_id = ?',
+                                   (item_id, current_user.id)).fetchone()
+        if bid_amount <= max(price, current_max[0] if current_max else 0):
+            conn.close()
+            return jsonify({'success': False,
+                            'message': 'Your new maximum must be higher than your current one.'}), 400
+    elif bid_amount < min_bid:
         conn.close()
         return jsonify({
             'success': False,
@@ -609,87 +2538,132 @@ def place_bid(item_id):
     # Can't bid on own auction (check if current user is the muse)
     # In Phase 1, muses don't have accounts, so this is future-proofing
 
-    # Record the bid
-    previous_bidder_id = auction['current_bidder_id']
     ip_address = request.remote_addr
+    leader_id = previous_bidder_id
+    bids = []
 
-    conn.execute(
-        'INSERT INTO bids (auction_id, user_id, amount, ip_address) VALUES (?, ?, ?, ?)',
-        (item_id, current_user.id, bid_amount, ip_address)
-    )
-
-    # Clear previous winning bid flag
-    conn.execute('UPDATE bids SET is_winning = 0 WHERE auction_id = ?', (item_id,))
-    # Set new winning bid (get the latest bid ID first, then update it)
-    latest_bid = conn.execute('''
-        SELECT id FROM bids
-        WHERE auction_id = ? AND user_id = ? AND amount = ?
-        ORDER BY placed_at DESC LIMIT 1
-    ''', (item_id, current_user.id, bid_amount)).fetchone()
-    if latest_bid:
-        conn.execute('UPDATE bids SET is_winning = 1 WHERE id = ?', (latest_bid['id'],))
-
-    # Sniper protection: extend by 2 minutes if bid placed within last 5 minutes
+    if is_proxy:
+        conn.execute('''
+            INSERT INTO proxy_bids (auction_id, user_id, max_amount, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (auction_id, user_id) DO UPDATE SET max_amount = excluded.max_amount,
+                                                           updated_at = excluded.updated_at
+        ''', (item_id, current_user.id, bid_amount, now_str, now_str))
+    else:
+        # A direct bid is recorded as-is and becomes the price the maxima react to
+        bids.append((current_user.id, bid_amount))
+        price, leader_id = bid_amount, current_user.id
+
+    # Let every standing maximum respond, in memory, before writing anything else
+    proxies = conn.execute('''
+        SELECT user_id, max_amount FROM proxy_bids
+        WHERE auction_id = ? AND max_amount >= ?
+        ORDER BY updated_at, rowid
+    ''', (item_id, price)).fetchall()
+    leader_id, price, proxy_bids = resolve_proxy_bids(price, leader_id, [tuple(p) for p in proxies],
+                                                      leader_wins_ties=is_proxy)
+    bids += proxy_bids
+
+    # Record the visible bids (only the outcome, never each increment)
+    winning_bid_id = None
+    for user_id, amount in bids:
+        bid_id = conn.execute(
+            'INSERT INTO bids (auction_id, user_id, amount, ip_address) VALUES (?, ?, ?, ?) RETURNING id',
+            (item_id, user_id, amount, ip_address if user_id == current_user.id else None)
+        ).fetchone()[0]
+        if user_id == leader_id:
+            winning_bid_id = bid_id
+
+    # Sniper protection: extend by 2 minutes if bid placed within last 5 minutes (once per request)
     time_remaining = (ends_at - now).total_seconds()
     new_ends_at = ends_at
-    if time_remaining < 300:  # 5 minutes
+    if bids and time_remaining < 300:  # 5 minutes
         new_ends_at = ends_at + timedelta(minutes=2)
 
     new_ends_str = new_ends_at.strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    # Update auction
-    conn.execute('''
-        UPDATE auctions
-        SET current_bid = ?, current_bidder_id = ?, bid_count = bid_count + 1, ends_at = ?
-        WHERE id = ?
-    ''', (bid_amount, current_user.id, new_ends_str, item_id))
+    if bids:
+        # Move the winning flag to the leader's newest bid
+        conn.execute('UPDATE bids SET is_winning = CASE WHEN id = ? THEN 1 ELSE 0 END WHERE auction_id = ?',
+                     (winning_bid_id, item_id))
+
+        # Update auction
+        conn.execute('''
+            UPDATE auctions
+            SET current_bid = ?, current_bidder_id = ?, bid_count = bid_count + ?, ends_at = ?
+            WHERE id = ?
+        ''', (price, leader_id, len(bids), new_ends_str, item_id))
+
+    # Tell the previous leader they were outbid (off the request path)
+    if previous_bidder_id and previous_bidder_id not in (leader_id, current_user.id):
+        enqueue(conn, 'notify_outbid',
+                {'auction_id': item_id, 'user_id': previous_bidder_id, 'amount': price},
+                priority=JOB_PRIORITY_LOW)
 
     conn.commit()
 
+    # Count toward trending only once the bids are committed, and publish this
+    # worker's deltas in their own short transaction: the bid's row lock on its
+    # auction is released by now, so the flush can't deadlock with another
+    # worker's bid. The bid stands even if the flush fails.
+    if bids:
+        board = trending_board()
+        board.record(item_id, len(bids), now.timestamp(), new_ends_str)
+        if board.flush_due() and not shed_low_priority_writes():
+            try:
+                board.flush(conn)
+            except Exception as exc:
+                current_app.logger.warning('Trending flush failed (kept for the next one): %s', exc)
+
     # Get recent bids for response
-    recent = conn.execute('''
-        SELECT b.amount, u.display_name as bidder
-        FROM bids b
-        JOIN users u ON b.user_id = u.id
-        WHERE b.auction_id = ?
-        ORDER BY b.placed_at DESC
-        LIMIT 5
-    ''', (item_id,)).fetchall()
+    recent = bid_history_page(conn, item_id, limit=5)
+    leader_name = conn.execute('SELECT display_name FROM users WHERE id = ?', (leader_id,)).fetchone()[0]
 
     conn.close()
 
-    min_next = bid_amount + MIN_BID_INCREMENT
+    min_next = price + MIN_BID_INCREMENT
+    outbid = leader_id != current_user.id
+    if outbid:
+        message = "You were instantly outbid by another bidder's maximum bid."
+    elif is_proxy:
+        message = f"Maximum bid of ${bid_amount:.2f} set — we'll bid for you up to that amount."
+    else:
+        message = 'Bid Accepted!'
 
-    return jsonify({
+    response = {
         'success': True,
-        'new_price': f"${bid_amount:.2f}",
-        'bidder': current_user.display_name,
-        'message': 'Bid Accepted!',
+        'new_price': f"${price:.2f}",
+        'bidder': leader_name,
+        'message': message,
+        'outbid': outbid,
         'ends_at': new_ends_str,
         'min_next_bid': f"{min_next:.2f}",
-        'sniper_extended': time_remaining < 300,
+        'sniper_extended': new_ends_at != ends_at,
         'recent_bids': [{'bidder': r['bidder'], 'amount': f"{r['amount']:.2f}"} for r in recent]
-    })
+    }
+    if is_proxy:
+        response['your_max'] = f"{bid_amount:.2f}"
+    return jsonify(response)
 
 
 # =============================================
 # ADMIN ROUTES
 # =============================================
 
-@app.route('/admin')
+@bp.route('/admin')
 @admin_required
 def admin_dashboard():
     conn = get_db()
 
-    # Auto-end expired auctions + create payment records for winners
-    end_expired_auctions(conn)
+    # Expired auctions are settled by the job worker — just make sure a run is queued
+    request_settlement(conn)
 
     # Stats
     stats = {}
     stats['total_auctions'] = conn.execute('SELECT COUNT(*) FROM auctions').fetchone()[0]
     stats['live_auctions'] = conn.execute("SELECT COUNT(*) FROM auctions WHERE status = 'live'").fetchone()[0]
     stats['ended_auctions'] = conn.execute("SELECT COUNT(*) FROM auctions WHERE status = 'ended'").fetchone()[0]
-    stats['total_bids'] = conn.execute('SELECT COUNT(*) FROM bids').fetchone()[0]
+    stats['total_bids'] = conn.execute('SELECT COALESCE(SUM(bid_count), 0) FROM auctions').fetchone()[0]  # includes archived bids
     stats['total_users'] = conn.execute("SELECT COUNT(*) FROM users WHERE role = 'buyer'").fetchone()[0]
     stats['total_muses'] = conn.execute('SELECT COUNT(*) FROM muse_profiles').fetchone()[0]
     gmv_row = conn.execute("SELECT COALESCE(SUM(current_bid), 0) FROM auctions WHERE status = 'ended' AND current_bidder_id IS NOT NULL").fetchone()
@@ -743,12 +2717,13 @@ def admin_dashboard():
             a.created_at DESC
     ''').fetchall()
 
+    maintenance = maintenance_report(conn)
     conn.close()
     return render_template('admin/dashboard.html', stats=stats, auctions=auctions,
-                           actionable_orders=actionable_orders)
+                           actionable_orders=actionable_orders, maintenance=maintenance)
 
 
-@app.route('/admin/auction/new', methods=['GET', 'POST'])
+@bp.route('/admin/auction/new', methods=['GET', 'POST'])
 @admin_required
 def admin_auction_new():
     conn = get_db()
@@ -782,8 +2757,8 @@ def admin_auction_new():
             if file and file.filename and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower()
                 fname = f"{uuid.uuid4().hex}.{ext}"
-                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                file.save(os.path.join(UPLOAD_FOLDER, fname))
+                os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], fname))
                 image_filename = f"uploads/{fname}"  # Store with path prefix
 
         if not image_filename:
@@ -813,13 +2788,13 @@ def admin_auction_new():
         conn.close()
 
         flash(f'Auction "{title}" created successfully!', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     conn.close()
     return render_template('admin/auction_form.html', muses=muses, editing=False)
 
 
-@app.route('/admin/auction/<int:auction_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/auction/<int:auction_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def admin_auction_edit(auction_id):
     conn = get_db()
@@ -845,8 +2820,8 @@ def admin_auction_edit(auction_id):
             if file and file.filename and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower()
                 fname = f"{uuid.uuid4().hex}.{ext}"
-                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                file.save(os.path.join(UPLOAD_FOLDER, fname))
+                os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], fname))
                 image_filename = f"uploads/{fname}"  # Store with path prefix
 
         conn.execute('''
@@ -859,13 +2834,13 @@ def admin_auction_edit(auction_id):
         conn.close()
 
         flash(f'Auction "{title}" updated.', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     conn.close()
     return render_template('admin/auction_form.html', muses=muses, auction=dict(auction), editing=True)
 
 
-@app.route('/admin/auction/<int:auction_id>/extend', methods=['POST'])
+@bp.route('/admin/auction/<int:auction_id>/extend', methods=['POST'])
 @admin_required
 def admin_auction_extend(auction_id):
     minutes = request.form.get('minutes', 30, type=int)
@@ -879,10 +2854,10 @@ def admin_auction_extend(auction_id):
         conn.commit()
         flash(f'Auction extended by {minutes} minutes.', 'success')
     conn.close()
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('main.admin_dashboard'))
 
 
-@app.route('/admin/auction/<int:auction_id>/end', methods=['POST'])
+@bp.route('/admin/auction/<int:auction_id>/end', methods=['POST'])
 @admin_required
 def admin_auction_end(auction_id):
     conn = get_db()
@@ -898,10 +2873,10 @@ def admin_auction_end(auction_id):
         flash('Auction ended. Payment record created for winner.', 'success')
     else:
         flash('Auction ended (no winning bidder).', 'info')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('main.admin_dashboard'))
 
 
-@app.route('/admin/auction/<int:auction_id>/bids')
+@bp.route('/admin/auction/<int:auction_id>/bids')
 @admin_required
 def admin_auction_bids(auction_id):
     conn = get_db()
@@ -915,20 +2890,17 @@ def admin_auction_bids(auction_id):
         conn.close()
         abort(404)
 
-    bids = conn.execute('''
-        SELECT b.*, u.display_name as bidder_name, u.email as bidder_email
-        FROM bids b
-        JOIN users u ON b.user_id = u.id
-        WHERE b.auction_id = ?
-        ORDER BY b.placed_at DESC
-    ''', (auction_id,)).fetchall()
+    before = request.args.get('before', type=int)
+    bids = bid_history_page(conn, auction_id, before, detail=True, archived=auction['archived_at'])
     conn.close()
-    return render_template('admin/auction_bids.html', auction=auction, bids=bids)
+    next_cursor = bids[-1]['id'] if len(bids) == BID_PAGE_SIZE else None
+    return render_template('admin/auction_bids.html', auction=auction, bids=bids,
+                           before=before, next_cursor=next_cursor)
 
 
 # --- Admin: Muse Management ---
 
-@app.route('/admin/muses')
+@bp.route('/admin/muses')
 @admin_required
 def admin_muses():
     conn = get_db()
@@ -944,7 +2916,7 @@ def admin_muses():
     return render_template('admin/muses.html', muses=muses)
 
 
-@app.route('/admin/muse/new', methods=['GET', 'POST'])
+@bp.route('/admin/muse/new', methods=['GET', 'POST'])
 @admin_required
 def admin_muse_new():
     if request.method == 'POST':
@@ -962,8 +2934,8 @@ def admin_muse_new():
             if file and file.filename and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower()
                 avatar_url = f"uploads/{uuid.uuid4().hex}.{ext}"
-                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                file.save(os.path.join(UPLOAD_FOLDER, f"{avatar_url.split('/')[-1]}"))
+                os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], f"{avatar_url.split('/')[-1]}"))
 
         conn = get_db()
         conn.execute(
@@ -973,12 +2945,12 @@ def admin_muse_new():
         conn.commit()
         conn.close()
         flash(f'Muse "{display_name}" created.', 'success')
-        return redirect(url_for('admin_muses'))
+        return redirect(url_for('main.admin_muses'))
 
     return render_template('admin/muse_form.html', editing=False)
 
 
-@app.route('/admin/muse/<int:muse_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/muse/<int:muse_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def admin_muse_edit(muse_id):
     conn = get_db()
@@ -998,8 +2970,8 @@ def admin_muse_edit(muse_id):
             if file and file.filename and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower()
                 avatar_url = f"uploads/{uuid.uuid4().hex}.{ext}"
-                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                file.save(os.path.join(UPLOAD_FOLDER, f"{avatar_url.split('/')[-1]}"))
+                os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], f"{avatar_url.split('/')[-1]}"))
 
         conn.execute(
             'UPDATE muse_profiles SET display_name = ?, bio = ?, avatar_url = ?, verification = ? WHERE id = ?',
@@ -1008,17 +2980,247 @@ def admin_muse_edit(muse_id):
         conn.commit()
         conn.close()
         flash(f'Muse "{display_name}" updated.', 'success')
-        return redirect(url_for('admin_muses'))
+        return redirect(url_for('main.admin_muses'))
 
     conn.close()
     return render_template('admin/muse_form.html', muse=dict(muse), editing=True)
 
 
+# =============================================
+# AUCTION IMPORT (CSV manifest + ZIP of images)
+# =============================================
+# A drop is prepared offline as manifest.csv (one auction per row) plus a ZIP
+# holding the images the manifest names. Everything is validated first and
+# every error is reported by row; only a clean manifest is imported, in one
+# transaction. The ZIP is never read into memory: members are streamed
+# straight to the uploads folder by a small thread pool. Web: /admin/auctions/import.
+# CLI: flask --app app import-auctions manifest.csv images.zip
+
+IMPORT_COLUMNS = ('title', 'muse', 'starting_bid', 'duration_hours', 'image',
+                  'description', 'category', 'wear_duration', 'status')
+IMPORT_REQUIRED = ('title', 'muse', 'starting_bid', 'duration_hours', 'image')
+IMPORT_STATUSES = ('live', 'draft')
+IMPORT_CATEGORIES = ('panties', 'thong', 'set', 'bra', 'stockings', 'custom', 'other')  # as on the auction form
+IMPORT_MAX_ROWS = 500
+IMPORT_MAX_UPLOAD = 100 * 1024 * 1024    # whole request (Cloudflare's limit); use the CLI for more
+IMPORT_MAX_IMAGE = 16 * 1024 * 1024      # per image, same as the single-auction form
+IMPORT_IMAGE_WORKERS = 4
+
+IMAGE_SIGNATURES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+    'webp': (b'RIFF',),  # + 'WEBP' at offset 8, checked below
+}
+
+
+def _validate_import_rows(conn, manifest, archive):
+    """Parse the manifest and match it against the archive's directory.
+    Returns (rows ready to insert minus the image path, [(row number, error)])."""
+    muses = {}
+    for m in conn.execute("SELECT id, display_name FROM muse_profiles WHERE verification = 'verified'").fetchall():
+        muses[str(m['id'])] = m['id']
+        muses[m['display_name'].lower()] = m['id']
+    # Images may sit in a folder inside the ZIP; match on the file name
+    members = {}
+    for info in archive.infolist():
+        if not info.is_dir():
+            members.setdefault(os.path.basename(info.filename).lower(), info)
+
+    reader = csv.DictReader(manifest)
+    missing = [c for c in IMPORT_REQUIRED if c not in (reader.fieldnames or ())]
+    if missing:
+        return [], [(1, f'Missing column{"s" if len(missing) > 1 else ""}: {", ".join(missing)}.')]
+
+    rows, errors, images = [], [], set()
+    for lineno, raw in enumerate(reader, 2):
+        if lineno - 1 > IMPORT_MAX_ROWS:
+            errors.append((lineno, f'More than {IMPORT_MAX_ROWS} rows; split the drop.'))
+            break
+        row = {c: (raw.get(c) or '').strip() for c in IMPORT_COLUMNS}
+        if not any(row.values()):
+            continue
+        problems = []
+        if not row['title']:
+            problems.append('title is required')
+        muse_id = muses.get(row['muse'].lower())
+        if not muse_id:
+            problems.append(f'no verified muse "{row["muse"]}"')
+        category = row['category'].lower()
+        if category and category not in IMPORT_CATEGORIES:
+            problems.append(f'category must be one of {", ".join(IMPORT_CATEGORIES)}')
+        try:
+            starting_bid = float(row['starting_bid'])
+            if starting_bid < 1:
+                raise ValueError
+        except ValueError:
+            problems.append('starting_bid must be a number of at least 1')
+        try:
+            duration_hours = int(row['duration_hours'])
+            if duration_hours < 1:
+                raise ValueError
+        except ValueError:
+            problems.append('duration_hours must be a whole number of at least 1')
+        status = row['status'].lower() or 'live'
+        if status not in IMPORT_STATUSES:
+            problems.append(f'status must be one of {", ".join(IMPORT_STATUSES)}')
+        name = os.path.basename(row['image']).lower()
+        info = members.get(name)
+        if not allowed_file(name):
+            problems.append('image must be JPG, PNG, GIF or WebP')
+        elif not info:
+            problems.append(f'image "{row["image"]}" is not in the ZIP')
+        elif info.file_size > IMPORT_MAX_IMAGE:
+            problems.append(f'image "{row["image"]}" is larger than {IMPORT_MAX_IMAGE // (1024 * 1024)}MB')
+        elif name in images:
+            problems.append(f'image "{row["image"]}" is used by another row')
+        images.add(name)
+
+        if problems:
+            message = '; '.join(problems)
+            errors.append((lineno, message[0].upper() + message[1:] + '.'))
+        else:
+            rows.append(dict(row, lineno=lineno, muse_id=muse_id, category=category, starting_bid=starting_bid,
+                             duration_hours=duration_hours, status=status, member=info))
+    if not rows and not errors:
+        errors.append((1, 'The manifest has no rows.'))
+    return rows, errors
+
+
+def _extract_image(archive, info, dest):
+    """Stream one ZIP member to dest, checking it really is the image type its
+    name says. Returns an error string or None."""
+    ext = info.filename.rsplit('.', 1)[1].lower()
+    with archive.open(info) as src, open(dest, 'wb') as out:
+        head = src.read(12)
+        if not head.startswith(IMAGE_SIGNATURES[ext]) or (ext == 'webp' and head[8:12] != b'WEBP'):
+            return f'"{info.filename}" is not a valid {ext.upper()} image.'
+        out.write(head)
+        shutil.copyfileobj(src, out, 1024 * 1024)
+    return None
+
+
+def import_auctions(conn, manifest, archive_file, created_by, upload_folder):
+    """Import a drop: manifest is a text stream of CSV, archive_file a seekable
+    binary file holding the ZIP. Returns (number of auctions created,
+    [(row number, error)]); nothing is written unless there are no errors."""
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except zipfile.BadZipFile:
+        return 0, [(0, 'The images file is not a valid ZIP archive.')]
+    with archive:
+        rows, errors = _validate_import_rows(conn, manifest, archive)
+        if errors:
+            return 0, errors
+
+        now = datetime.now(timezone.utc)
+        os.makedirs(upload_folder, exist_ok=True)
+        for row in rows:
+            ext = row['member'].filename.rsplit('.', 1)[1].lower()
+            row['image_path'] = f"uploads/{uuid.uuid4().hex}.{ext}"
+            row['ends_at'] = (now + timedelta(hours=row['duration_hours'])).strftime('%Y-%m-%dT%H:%M:%SZ')
+        # zlib and file I/O release the GIL, so a few threads extract in parallel
+        with concurrent.futures.ThreadPoolExecutor(IMPORT_IMAGE_WORKERS) as pool:
+            results = pool.map(lambda r: _extract_image(archive, r['member'],
+                                                        os.path.join(upload_folder, os.path.basename(r['image_path']))),
+                               rows)
+            errors = [(row['lineno'], error) for row, error in zip(rows, results) if error]
+
+    def discard_images():
+        for row in rows:
+            try:
+                os.remove(os.path.join(upload_folder, os.path.basename(row['image_path'])))
+            except FileNotFoundError:
+                pass
+
+    if errors:
+        discard_images()
+        return 0, errors
+
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    try:
+        begin_write(conn)
+        conn.executemany('''
+            INSERT INTO auctions
+            (muse_id, title, description, category, wear_duration, image,
+             starting_bid, current_bid, status, starts_at, ends_at, original_end, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(r['muse_id'], r['title'], r['description'], r['category'], r['wear_duration'],
+               r['image_path'], r['starting_bid'], r['starting_bid'], r['status'], now_str,
+               r['ends_at'], r['ends_at'], created_by) for r in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        discard_images()
+        raise
+    return len(rows), []
+
+
+# Endpoints that accept more than MAX_CONTENT_LENGTH. The form is parsed (and
+# the cap enforced) in CSRFProtect's before_request hook, before any view
+# runs, so create_app() registers apply_upload_limit() ahead of it.
+UPLOAD_LIMITS = {'main.admin_auction_import': IMPORT_MAX_UPLOAD}
+
+
+def apply_upload_limit():
+    limit = UPLOAD_LIMITS.get(request.endpoint)
+    if limit:
+        request.max_content_length = limit
+
+
+@bp.route('/admin/auctions/import', methods=['GET', 'POST'])
+@admin_required
+def admin_auction_import():
+    errors, created = [], None
+    if request.method == 'POST':
+        manifest = request.files.get('manifest')
+        images = request.files.get('images')
+        if not manifest or not manifest.filename or not images or not images.filename:
+            flash('Please choose both the CSV manifest and the ZIP of images.', 'error')
+        else:
+            # Werkzeug spools large uploads to a temp file, so the ZIP is read from disk
+            text = io.TextIOWrapper(manifest.stream, encoding='utf-8-sig', newline='')
+            conn = get_db()
+            created, errors = import_auctions(conn, text, images.stream, current_user.id,
+                                              current_app.config['UPLOAD_FOLDER'])
+            conn.close()
+            if created:
+                flash(f'Imported {created} auction{"s" if created != 1 else ""}.', 'success')
+                return redirect(url_for('main.admin_dashboard'))
+            flash('Nothing was imported — fix the rows below and upload again.', 'error')
+    return render_template('admin/auction_import.html', errors=errors, columns=IMPORT_COLUMNS,
+                           required=IMPORT_REQUIRED, max_rows=IMPORT_MAX_ROWS)
+
+
+@bp.cli.command('import-auctions')
+@click.argument('manifest', type=click.File('r', encoding='utf-8-sig'))
+@click.argument('images', type=click.Path(exists=True, dir_okay=False))
+@click.option('--admin-email', default='admin@pantiesfan.com', show_default=True,
+              help='Admin recorded as the creator.')
+def import_auctions_command(manifest, images, admin_email):
+    """Import auctions from a CSV manifest and a ZIP of images."""
+    conn = get_db()
+    admin = conn.execute("SELECT id FROM users WHERE email = ? AND role = 'admin'", (admin_email,)).fetchone()
+    if not admin:
+        conn.close()
+        raise click.ClickException(f'No admin user with email {admin_email}.')
+    with open(images, 'rb') as archive_file:
+        created, errors = import_auctions(conn, manifest, archive_file, admin['id'],
+                                          current_app.config['UPLOAD_FOLDER'])
+    conn.close()
+    for lineno, error in errors:
+        click.echo(f'Row {lineno}: {error}' if lineno else error, err=True)
+    if errors:
+        raise click.ClickException(f'{len(errors)} error{"s" if len(errors) != 1 else ""}; nothing imported.')
+    click.echo(f'Imported {created} auctions.')
+
+
 # =============================================
 # PUBLIC: MUSE PROFILES
 # =============================================
 
-@app.route('/muse/<int:muse_id>')
+@bp.route('/muse/<int:muse_id>')
 def muse_profile(muse_id):
     conn = get_db()
     muse = conn.execute('SELECT * FROM muse_profiles WHERE id = ?', (muse_id,)).fetchone()
@@ -1052,7 +3254,7 @@ def muse_profile(muse_id):
 # PAYMENT FLOW
 # =============================================
 
-@app.route('/pay/<token>')
+@bp.route('/pay/<token>')
 @login_required
 def payment_page(token):
     conn = get_db()
@@ -1075,27 +3277,29 @@ def payment_page(token):
 
     # Check if buyer has a saved address
     address = conn.execute(
-        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1 ORDER BY created_at DESC LIMIT 1',
+        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1',
         (current_user.id,)
     ).fetchone()
 
     # Get shipment if exists
     shipment = conn.execute('SELECT * FROM shipments WHERE payment_id = ?', (payment['id'],)).fetchone()
 
-    # Calculate payment deadline
-    created = datetime.strptime(payment['created_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-    deadline = created + timedelta(hours=PAYMENT_WINDOW_HOURS)
-    now = datetime.now(timezone.utc)
-    expired = now >= deadline
+    # Payment deadline (the sweeper flips the status to 'expired' shortly after).
+    # Orders without one (created before deadlines existed) never time out.
+    deadline = payment['expires_at']
+    expired = payment['status'] == 'expired'
+    if deadline:
+        expired = expired or datetime.now(timezone.utc) >= \
+            datetime.strptime(deadline, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
 
     conn.close()
     return render_template('payment.html',
                            payment=payment, auction=auction, address=address,
-                           shipment=shipment, deadline=deadline.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                           shipment=shipment, deadline=deadline,
                            expired=expired, shipping_rates=SHIPPING_RATES)
 
 
-@app.route('/pay/<token>/address', methods=['POST'])
+@bp.route('/pay/<token>/address', methods=['POST'])
 @login_required
 def payment_save_address(token):
     conn = get_db()
@@ -1130,10 +3334,11 @@ def payment_save_address(token):
         for e in errors:
             flash(e, 'error')
         conn.close()
-        return redirect(url_for('payment_page', token=token))
+        return redirect(url_for('main.payment_page', token=token))
 
     # Clear old defaults
-    conn.execute('UPDATE shipping_addresses SET is_default = 0 WHERE user_id = ?', (current_user.id,))
+    conn.execute('UPDATE shipping_addresses SET is_default = 0 WHERE user_id = ? AND is_default = 1',
+                 (current_user.id,))
 
     conn.execute('''
         INSERT INTO shipping_addresses
@@ -1144,10 +3349,10 @@ def payment_save_address(token):
     conn.close()
 
     flash('Shipping address saved!', 'success')
-    return redirect(url_for('payment_page', token=token))
+    return redirect(url_for('main.payment_page', token=token))
 
 
-@app.route('/pay/<token>/confirm', methods=['POST'])
+@bp.route('/pay/<token>/confirm', methods=['POST'])
 @login_required
 def payment_confirm_method(token):
     """Buyer selects payment method — routes to appropriate checkout flow."""
@@ -1160,61 +3365,65 @@ def payment_confirm_method(token):
     if payment['status'] not in ('awaiting_payment',):
         flash('This payment has already been processed.', 'info')
         conn.close()
-        return redirect(url_for('payment_page', token=token))
+        return redirect(url_for('main.payment_page', token=token))
 
     # Check buyer has a shipping address
     address = conn.execute(
-        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1 ORDER BY created_at DESC LIMIT 1',
+        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1',
         (current_user.id,)
     ).fetchone()
     if not address:
         flash('Please add a shipping address first.', 'error')
         conn.close()
-        return redirect(url_for('payment_page', token=token))
+        return redirect(url_for('main.payment_page', token=token))
 
     method = request.form.get('method', 'card')
 
-    # Calculate shipping cost & ensure shipment record exists
+    # Calculate shipping cost & freeze the address onto the shipment. Until the
+    # payment goes through, confirming again re-snapshots the current address.
     shipping_cost = SHIPPING_RATES.get(address['country'], SHIPPING_RATES['DEFAULT'])
+    destination = f"{address['full_name']}, {address['address_line1']}, {address['city']}, {address['country']}"
+    snapshot = [address[c] for c in SHIPPING_ADDRESS_FIELDS]
     existing_shipment = conn.execute('SELECT id FROM shipments WHERE payment_id = ?', (payment['id'],)).fetchone()
-    if not existing_shipment:
-        destination = f"{address['full_name']}, {address['address_line1']}, {address['city']}, {address['country']}"
-        conn.execute('''
-            INSERT INTO shipments (payment_id, destination, status, shipping_cost)
-            VALUES (?, ?, 'awaiting_payment', ?)
-        ''', (payment['id'], destination, shipping_cost))
-        conn.commit()
+    if existing_shipment:
+        conn.execute(f'''
+            UPDATE shipments SET destination = ?, shipping_cost = ?,
+                {', '.join(c + ' = ?' for c in SHIPPING_ADDRESS_FIELDS)}
+            WHERE id = ?
+        ''', (destination, shipping_cost, *snapshot, existing_shipment['id']))
+    else:
+        conn.execute(f'''
+            INSERT INTO shipments (payment_id, destination, status, shipping_cost, {', '.join(SHIPPING_ADDRESS_FIELDS)})
+            VALUES (?, ?, 'awaiting_payment', ?, {', '.join('?' * len(SHIPPING_ADDRESS_FIELDS))})
+        ''', (payment['id'], destination, shipping_cost, *snapshot))
+    conn.commit()
 
     conn.close()
 
     if method == 'card':
         # Redirect to credit card checkout page
-        return redirect(url_for('checkout_card', token=token))
+        return redirect(url_for('main.checkout_card', token=token))
     else:
         # Crypto: set to pending (manual verification by admin)
         conn = get_db()
-        now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-        conn.execute('''
-            UPDATE payments SET status = 'pending', processor = 'crypto', completed_at = NULL
-            WHERE id = ?
-        ''', (payment['id'],))
-        conn.execute('''
-            INSERT INTO notifications (user_id, type, title, message, link, created_at)
-            VALUES (?, 'payment_pending', ?, ?, ?, ?)
-        ''', (
-            current_user.id,
-            'Crypto Payment Initiated',
-            'Your cryptocurrency payment is awaiting confirmation. You will be notified once verified.',
-            f'/pay/{token}',
-            now_str
-        ))
+        try:
+            transition_order(
+                conn, payment['id'], 'pay_crypto',
+                payment={'processor': 'crypto', 'completed_at': None},
+                notice=('payment_pending', 'Crypto Payment Initiated',
+                        'Your cryptocurrency payment is awaiting confirmation. You will be notified once verified.',
+                        f'/pay/{token}'))
+        except ValueError:
+            conn.close()
+            flash('This payment has already been processed.', 'info')
+            return redirect(url_for('main.payment_page', token=token))
         conn.commit()
         conn.close()
         flash('Crypto payment initiated! You will receive confirmation once the transaction is verified.', 'success')
-        return redirect(url_for('payment_page', token=token))
+        return redirect(url_for('main.payment_page', token=token))
 
 
-@app.route('/pay/<token>/checkout')
+@bp.route('/pay/<token>/checkout')
 @login_required
 def checkout_card(token):
     """Multi-step credit card checkout page."""
@@ -1226,7 +3435,7 @@ def checkout_card(token):
 
     if payment['status'] not in ('awaiting_payment',):
         conn.close()
-        return redirect(url_for('payment_page', token=token))
+        return redirect(url_for('main.payment_page', token=token))
 
     auction = conn.execute('''
         SELECT a.*, m.display_name as muse_name
@@ -1236,7 +3445,7 @@ def checkout_card(token):
     ''', (payment['auction_id'],)).fetchone()
 
     address = conn.execute(
-        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1 ORDER BY created_at DESC LIMIT 1',
+        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1',
         (current_user.id,)
     ).fetchone()
 
@@ -1251,8 +3460,9 @@ def checkout_card(token):
                            total=payment['amount'] + shipping_cost)
 
 
-@app.route('/pay/<token>/process-card', methods=['POST'])
+@bp.route('/pay/<token>/process-card', methods=['POST'])
 @login_required
+@idempotent
 def process_card_payment(token):
     """Process credit card payment (simulated — accepts any card)."""
     conn = get_db()
@@ -1298,29 +3508,17 @@ def process_card_payment(token):
     last_four = card_number[-4:]
 
     # Mark payment as paid (instant card processing)
-    conn.execute('''
-        UPDATE payments SET status = 'paid', processor = ?, processor_txn = ?, completed_at = ?
-        WHERE id = ?
-    ''', (f'card-{last_four}', txn_id, now_str, payment['id']))
-
-    # Update shipment to preparing
-    conn.execute("UPDATE shipments SET status = 'preparing' WHERE payment_id = ?", (payment['id'],))
-
-    # Update auction status
-    conn.execute("UPDATE auctions SET status = 'paid' WHERE id = ?", (payment['auction_id'],))
-
-    # Notify buyer
-    conn.execute('''
-        INSERT INTO notifications (user_id, type, title, message, link, created_at)
-        VALUES (?, 'payment_confirmed', ?, ?, ?, ?)
-    ''', (
-        current_user.id,
-        'Payment Confirmed!',
-        f'Your credit card payment (ending {last_four}) of ${payment["amount"]:.2f} has been confirmed. We are preparing your item for shipping.',
-        f'/pay/{token}',
-        now_str
-    ))
-
+    try:
+        transition_order(
+            conn, payment['id'], 'pay_card',
+            payment={'processor': f'card-{last_four}', 'processor_txn': txn_id, 'completed_at': now_str},
+            notice=('payment_confirmed', 'Payment Confirmed!',
+                    f'Your credit card payment (ending {last_four}) of ${payment["amount"]:.2f} has been confirmed. We are preparing your item for shipping.',
+                    f'/pay/{token}'))
+    except ValueError:
+        # Lost a race with another submit or the expiry sweeper
+        conn.close()
+        return jsonify({'success': False, 'message': 'This payment has already been processed.'}), 400
     conn.commit()
     conn.close()
 
@@ -1328,7 +3526,7 @@ def process_card_payment(token):
         'success': True,
         'message': 'Payment successful!',
         'txn_id': txn_id,
-        'redirect': url_for('payment_page', token=token)
+        'redirect': url_for('main.payment_page', token=token)
     })
 
 
@@ -1336,26 +3534,24 @@ def process_card_payment(token):
 # BUYER DASHBOARD
 # =============================================
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def buyer_dashboard():
     conn = get_db()
 
-    # Auto-end expired auctions
-    end_expired_auctions(conn)
+    # Expired auctions are settled by the job worker — just make sure a run is queued
+    request_settlement(conn)
 
-    # Active bids (on live auctions)
+    # Active bids: one summary row per live auction the user has bid on
     active_bids = conn.execute('''
-        SELECT b.amount, b.placed_at, b.is_winning,
+        SELECT s.max_bid as amount, s.last_bid_at as placed_at, s.is_winning,
                a.id as auction_id, a.title, a.current_bid, a.current_bidder_id,
                a.ends_at, a.status, a.image,
                m.display_name as muse_name
-        FROM bids b
-        JOIN auctions a ON b.auction_id = a.id
+        FROM user_auction_state s
+        JOIN auctions a ON a.id = s.auction_id
         LEFT JOIN muse_profiles m ON a.muse_id = m.id
-        WHERE b.user_id = ? AND a.status = 'live'
-        GROUP BY a.id
-        HAVING b.amount = MAX(b.amount)
+        WHERE s.user_id = ? AND s.is_live = 1
         ORDER BY a.ends_at ASC
     ''', (current_user.id,)).fetchall()
 
@@ -1365,24 +3561,25 @@ def buyer_dashboard():
                m.display_name as muse_name,
                p.id as payment_id, p.status as payment_status, p.payment_token,
                p.amount as payment_amount, p.created_at as payment_created,
-               s.status as shipment_status, s.tracking_number, s.carrier, s.shipping_cost
-        FROM auctions a
+               sh.status as shipment_status, sh.tracking_number, sh.carrier, sh.shipping_cost
+        FROM user_auction_state s
+        JOIN auctions a ON a.id = s.auction_id
         LEFT JOIN muse_profiles m ON a.muse_id = m.id
-        LEFT JOIN payments p ON p.auction_id = a.id AND p.buyer_id = ?
-        LEFT JOIN shipments s ON s.payment_id = p.id
-        WHERE a.current_bidder_id = ? AND a.status != 'live'
+        LEFT JOIN payments p ON p.auction_id = a.id AND p.buyer_id = s.user_id
+        LEFT JOIN shipments sh ON sh.payment_id = p.id
+        WHERE s.user_id = ? AND s.is_winning = 1 AND s.is_live = 0
         ORDER BY a.ends_at DESC
-    ''', (current_user.id, current_user.id)).fetchall()
+    ''', (current_user.id,)).fetchall()
 
-    # Recent bid history (all bids across all auctions)
+    # Bid history: the auctions bid on most recently, with the user's top bid on each
     bid_history = conn.execute('''
-        SELECT b.amount, b.placed_at, b.is_winning,
+        SELECT s.max_bid as amount, s.bid_count, s.last_bid_at as placed_at, s.is_winning,
                a.id as auction_id, a.title, a.status as auction_status,
                a.current_bid
-        FROM bids b
-        JOIN auctions a ON b.auction_id = a.id
-        WHERE b.user_id = ?
-        ORDER BY b.placed_at DESC
+        FROM user_auction_state s
+        JOIN auctions a ON a.id = s.auction_id
+        WHERE s.user_id = ?
+        ORDER BY s.last_bid_at DESC
         LIMIT 20
     ''', (current_user.id,)).fetchall()
 
@@ -1394,24 +3591,29 @@ def buyer_dashboard():
         LIMIT 10
     ''', (current_user.id,)).fetchall()
 
-    # Mark notifications as read
-    conn.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0', (current_user.id,))
-    conn.commit()
+    # Mark notifications as read (left for the next visit while writes are backed up)
+    if not shed_low_priority_writes():
+        conn.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0', (current_user.id,))
+        conn.commit()
 
     # Saved address
     address = conn.execute(
-        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1 ORDER BY created_at DESC LIMIT 1',
+        'SELECT * FROM shipping_addresses WHERE user_id = ? AND is_default = 1',
         (current_user.id,)
     ).fetchone()
 
+    digest_minutes = conn.execute('SELECT email_digest_minutes FROM users WHERE id = ?',
+                                  (current_user.id,)).fetchone()[0]
+
     conn.close()
     return render_template('dashboard.html',
                            active_bids=active_bids, won_auctions=won_auctions,
                            bid_history=bid_history, notifications=notifications,
-                           address=address)
+                           address=address, digest_minutes=digest_minutes,
+                           digest_choices=EMAIL_DIGEST_CHOICES)
 
 
-@app.route('/dashboard/address', methods=['POST'])
+@bp.route('/dashboard/address', methods=['POST'])
 @login_required
 def dashboard_save_address():
     """Save/update default shipping address from buyer dashboard."""
@@ -1429,10 +3631,11 @@ def dashboard_save_address():
     if not all([full_name, address_line1, city, postal_code, country]):
         flash('Please fill in all required address fields.', 'error')
         conn.close()
-        return redirect(url_for('buyer_dashboard'))
+        return redirect(url_for('main.buyer_dashboard'))
 
     # Clear old defaults
-    conn.execute('UPDATE shipping_addresses SET is_default = 0 WHERE user_id = ?', (current_user.id,))
+    conn.execute('UPDATE shipping_addresses SET is_default = 0 WHERE user_id = ? AND is_default = 1',
+                 (current_user.id,))
 
     conn.execute('''
         INSERT INTO shipping_addresses
@@ -1443,14 +3646,14 @@ def dashboard_save_address():
     conn.close()
 
     flash('Shipping address updated!', 'success')
-    return redirect(url_for('buyer_dashboard'))
+    return redirect(url_for('main.buyer_dashboard'))
 
 
 # =============================================
 # ADMIN: ORDER & PAYMENT MANAGEMENT
 # =============================================
 
-@app.route('/admin/orders')
+@bp.route('/admin/orders')
 @admin_required
 def admin_orders():
     conn = get_db()
@@ -1461,15 +3664,14 @@ def admin_orders():
                m.display_name as muse_name,
                s.id as shipment_id, s.status as shipment_status,
                s.tracking_number, s.carrier, s.shipping_cost,
-               sa.full_name as ship_name, sa.address_line1 as ship_addr,
-               sa.city as ship_city, sa.country as ship_country,
-               sa.postal_code as ship_zip
+               s.full_name as ship_name, s.address_line1 as ship_addr,
+               s.city as ship_city, s.country as ship_country,
+               s.postal_code as ship_zip
         FROM payments p
         JOIN auctions a ON p.auction_id = a.id
         JOIN users u ON p.buyer_id = u.id
         LEFT JOIN muse_profiles m ON a.muse_id = m.id
         LEFT JOIN shipments s ON s.payment_id = p.id
-        LEFT JOIN shipping_addresses sa ON sa.user_id = u.id AND sa.is_default = 1
         ORDER BY
             CASE p.status
                 WHEN 'pending' THEN 0
@@ -1495,143 +3697,179 @@ def admin_orders():
     return render_template('admin/orders.html', orders=orders, stats=stats)
 
 
-@app.route('/admin/order/<int:payment_id>/mark-paid', methods=['POST'])
+@bp.route('/admin/order/<int:payment_id>/mark-paid', methods=['POST'])
 @admin_required
 def admin_mark_paid(payment_id):
-    conn = get_db()
-    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    processor_txn = request.form.get('processor_txn', '').strip() or f"MANUAL-{secrets.token_hex(4).upper()}"
 
-    payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
+    conn = get_db()
+    try:
+        payment = transition_order(
+            conn, payment_id, 'mark_paid',
+            payment={'processor_txn': processor_txn},
+            notice=('payment_confirmed', 'Payment Confirmed!',
+                    'Your payment has been confirmed. We are preparing your item for shipping.',
+                    '/pay/{payment_token}'),
+            audit=('marked_paid', {'processor_txn': processor_txn}))
+    except ValueError as e:
+        conn.close()
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('main.admin_orders'))
     if not payment:
         conn.close()
         abort(404)
-
-    processor_txn = request.form.get('processor_txn', '').strip() or f"MANUAL-{secrets.token_hex(4).upper()}"
-
-    conn.execute('''
-        UPDATE payments SET status = 'paid', processor_txn = ?, completed_at = ?
-        WHERE id = ?
-    ''', (processor_txn, now_str, payment_id))
-
-    # Update shipment status
-    conn.execute("UPDATE shipments SET status = 'preparing' WHERE payment_id = ?", (payment_id,))
-
-    # Update auction status
-    conn.execute("UPDATE auctions SET status = 'paid' WHERE id = ?", (payment['auction_id'],))
-
-    # Notify buyer
-    conn.execute('''
-        INSERT INTO notifications (user_id, type, title, message, link, created_at)
-        VALUES (?, 'payment_confirmed', ?, ?, ?, ?)
-    ''', (
-        payment['buyer_id'],
-        'Payment Confirmed!',
-        'Your payment has been confirmed. We are preparing your item for shipping.',
-        f'/pay/{payment["payment_token"]}',
-        now_str
-    ))
-
-    log_audit(conn, 'order', payment_id, 'marked_paid',
-              {'processor_txn': processor_txn})
     conn.commit()
     conn.close()
     flash('Payment marked as paid. Buyer notified.', 'success')
-    return redirect(request.referrer or url_for('admin_orders'))
+    return redirect(request.referrer or url_for('main.admin_orders'))
 
 
-@app.route('/admin/order/<int:payment_id>/ship', methods=['POST'])
+@bp.route('/admin/order/<int:payment_id>/ship', methods=['POST'])
 @admin_required
 def admin_ship_order(payment_id):
-    conn = get_db()
-    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-
-    payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
-    if not payment:
-        conn.close()
-        abort(404)
-
     tracking_number = request.form.get('tracking_number', '').strip()
     carrier = request.form.get('carrier', 'DHL').strip()
 
     if not tracking_number:
         flash('Tracking number is required.', 'error')
-        conn.close()
-        return redirect(url_for('admin_orders'))
-
-    conn.execute('''
-        UPDATE shipments SET status = 'shipped', tracking_number = ?, carrier = ?, shipped_at = ?
-        WHERE payment_id = ?
-    ''', (tracking_number, carrier, now_str, payment_id))
-
-    conn.execute("UPDATE payments SET status = 'shipped' WHERE id = ?", (payment_id,))
-    conn.execute("UPDATE auctions SET status = 'shipped' WHERE id = ?", (payment['auction_id'],))
+        return redirect(url_for('main.admin_orders'))
 
-    # Notify buyer
-    conn.execute('''
-        INSERT INTO notifications (user_id, type, title, message, link, created_at)
-        VALUES (?, 'order_shipped', ?, ?, ?, ?)
-    ''', (
-        payment['buyer_id'],
-        'Your Order Has Shipped!',
-        f'Tracking: {tracking_number} via {carrier}. Check your dashboard for updates.',
-        f'/pay/{payment["payment_token"]}',
-        now_str
-    ))
-
-    log_audit(conn, 'order', payment_id, 'shipped',
-              {'tracking_number': tracking_number, 'carrier': carrier})
+    conn = get_db()
+    try:
+        payment = transition_order(
+            conn, payment_id, 'ship',
+            shipment={'tracking_number': tracking_number, 'carrier': carrier},
+            notice=('order_shipped', 'Your Order Has Shipped!',
+                    f'Tracking: {tracking_number} via {carrier}. Check your dashboard for updates.',
+                    '/pay/{payment_token}'),
+            audit=('shipped', {'tracking_number': tracking_number, 'carrier': carrier}))
+    except ValueError as e:
+        conn.close()
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('main.admin_orders'))
+    if not payment:
+        conn.close()
+        abort(404)
     conn.commit()
     conn.close()
     flash(f'Order shipped! Tracking: {tracking_number}. Buyer notified.', 'success')
-    return redirect(request.referrer or url_for('admin_orders'))
+    return redirect(request.referrer or url_for('main.admin_orders'))
 
 
-@app.route('/admin/order/<int:payment_id>/deliver', methods=['POST'])
+@bp.route('/admin/order/<int:payment_id>/deliver', methods=['POST'])
 @admin_required
 def admin_deliver_order(payment_id):
     conn = get_db()
-    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-
-    payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
+    try:
+        payment = transition_order(
+            conn, payment_id, 'deliver',
+            notice=('order_delivered', 'Order Delivered!',
+                    'Your order has been delivered. Enjoy! We hope to see you again soon.',
+                    '/dashboard'),
+            audit=('delivered', {}))
+    except ValueError as e:
+        conn.close()
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('main.admin_orders'))
     if not payment:
         conn.close()
         abort(404)
+    conn.commit()
+    conn.close()
+    flash('Order marked as delivered. Transaction complete!', 'success')
+    return redirect(request.referrer or url_for('main.admin_orders'))
 
-    conn.execute('''
-        UPDATE shipments SET status = 'delivered', delivered_at = ?
-        WHERE payment_id = ?
-    ''', (now_str, payment_id))
 
-    conn.execute("UPDATE auctions SET status = 'completed' WHERE id = ?", (payment['auction_id'],))
-    conn.execute("UPDATE payments SET status = 'completed' WHERE id = ?", (payment_id,))
+# --- Admin: Bulk fulfillment ---
+# Each bulk action is one transition_orders() call: one transaction, one
+# executemany per table, one audit batch. Orders that can't make the step are
+# skipped and listed in the flash message.
 
-    # Update muse sales count
-    auction = conn.execute('SELECT muse_id FROM auctions WHERE id = ?', (payment['auction_id'],)).fetchone()
-    if auction and auction['muse_id']:
-        conn.execute('UPDATE muse_profiles SET total_sales = total_sales + 1 WHERE id = ?', (auction['muse_id'],))
+def _flash_bulk_result(outcome, done, skipped):
+    if done:
+        flash(f'{len(done)} order{"s" if len(done) != 1 else ""} {outcome}. Buyers notified.', 'success')
+    if skipped:
+        reasons = [f'#{pid}: {reason or "no such order"}' for pid, reason in list(skipped.items())[:10]]
+        more = f' (+{len(skipped) - 10} more)' if len(skipped) > 10 else ''
+        flash(f'Skipped {len(skipped)}: ' + ' '.join(reasons) + more, 'error')
+    if not done and not skipped:
+        flash('No orders selected.', 'error')
 
-    # Notify buyer
-    conn.execute('''
-        INSERT INTO notifications (user_id, type, title, message, link, created_at)
-        VALUES (?, 'order_delivered', ?, ?, ?, ?)
-    ''', (
-        payment['buyer_id'],
-        'Order Delivered!',
-        'Your order has been delivered. Enjoy! We hope to see you again soon.',
-        '/dashboard',
-        now_str
-    ))
-
-    log_audit(conn, 'order', payment_id, 'delivered', {})
+
+@bp.route('/admin/orders/bulk/mark-paid', methods=['POST'])
+@admin_required
+def admin_bulk_mark_paid():
+    changes = []
+    for pid in request.form.getlist('payment_ids', type=int):
+        txn = f"MANUAL-{secrets.token_hex(4).upper()}"
+        changes.append((pid, {'processor_txn': txn}, None,
+                        ('payment_confirmed', 'Payment Confirmed!',
+                         'Your payment has been confirmed. We are preparing your item for shipping.',
+                         '/pay/{payment_token}'),
+                        ('marked_paid', {'processor_txn': txn, 'bulk': True})))
+    conn = get_db()
+    done, skipped = transition_orders(conn, 'mark_paid', changes)
     conn.commit()
     conn.close()
-    flash('Order marked as delivered. Transaction complete!', 'success')
-    return redirect(request.referrer or url_for('admin_orders'))
+    _flash_bulk_result('marked paid', done, skipped)
+    return redirect(url_for('main.admin_orders'))
+
+
+@bp.route('/admin/orders/bulk/ship', methods=['POST'])
+@admin_required
+def admin_bulk_ship():
+    """Ship from CSV lines `payment_id,tracking_number[,carrier]` (pasted or uploaded)."""
+    upload = request.files.get('csv_file')
+    text = upload.read().decode('utf-8-sig', errors='replace') if upload and upload.filename else \
+        request.form.get('shipments', '')
+    default_carrier = request.form.get('carrier', 'DHL').strip() or 'DHL'
+
+    changes, bad_lines = [], []
+    for lineno, row in enumerate(csv.reader(io.StringIO(text)), 1):
+        cells = [c.strip() for c in row]
+        if not any(cells):
+            continue
+        if not cells[0].lstrip('#').isdigit() or len(cells) < 2 or not cells[1]:
+            if lineno > 1 or cells[0].lstrip('#').isdigit():  # a header row is fine
+                bad_lines.append(lineno)
+            continue
+        pid, tracking = int(cells[0].lstrip('#')), cells[1]
+        carrier = cells[2] if len(cells) > 2 and cells[2] else default_carrier
+        changes.append((pid, None, {'tracking_number': tracking, 'carrier': carrier},
+                        ('order_shipped', 'Your Order Has Shipped!',
+                         f'Tracking: {tracking} via {carrier}. Check your dashboard for updates.',
+                         '/pay/{payment_token}'),
+                        ('shipped', {'tracking_number': tracking, 'carrier': carrier, 'bulk': True})))
+    if bad_lines:
+        flash(f'Ignored malformed line{"s" if len(bad_lines) != 1 else ""} '
+              f'{", ".join(map(str, bad_lines[:10]))} (expected: payment_id,tracking_number[,carrier]).', 'error')
+
+    conn = get_db()
+    done, skipped = transition_orders(conn, 'ship', changes)
+    conn.commit()
+    conn.close()
+    _flash_bulk_result('shipped', done, skipped)
+    return redirect(url_for('main.admin_orders'))
+
+
+@bp.route('/admin/orders/bulk/deliver', methods=['POST'])
+@admin_required
+def admin_bulk_deliver():
+    notice = ('order_delivered', 'Order Delivered!',
+              'Your order has been delivered. Enjoy! We hope to see you again soon.', '/dashboard')
+    changes = [(pid, None, None, notice, ('delivered', {'bulk': True}))
+               for pid in request.form.getlist('payment_ids', type=int)]
+    conn = get_db()
+    done, skipped = transition_orders(conn, 'deliver', changes)
+    conn.commit()
+    conn.close()
+    _flash_bulk_result('delivered', done, skipped)
+    return redirect(url_for('main.admin_orders'))
 
 
 # --- Admin: Order Detail + CRUD ---
 
-@app.route('/admin/order/<int:payment_id>')
+@bp.route('/admin/order/<int:payment_id>')
 @admin_required
 def admin_order_detail(payment_id):
     """Full order detail page with timeline and actions."""
@@ -1640,21 +3878,20 @@ def admin_order_detail(payment_id):
     order = conn.execute('''
         SELECT p.*, a.id as auction_id, a.title as auction_title,
                a.image as auction_image, a.status as auction_status,
-               a.category, a.wear_duration, a.current_bid,
+               a.category, a.wear_duration, a.current_bid, a.archived_at,
                u.id as buyer_id, u.display_name as buyer_name,
                u.email as buyer_email, u.created_at as buyer_since,
                m.display_name as muse_name,
                s.id as shipment_id, s.status as shipment_status,
                s.tracking_number, s.carrier, s.shipped_at,
                s.delivered_at, s.shipping_cost, s.destination,
-               sa.full_name as ship_name, sa.address_line1, sa.address_line2,
-               sa.city, sa.state, sa.postal_code, sa.country, sa.phone
+               s.full_name as ship_name, s.address_line1, s.address_line2,
+               s.city, s.state, s.postal_code, s.country, s.phone
         FROM payments p
         JOIN auctions a ON p.auction_id = a.id
         JOIN users u ON p.buyer_id = u.id
         LEFT JOIN muse_profiles m ON a.muse_id = m.id
         LEFT JOIN shipments s ON s.payment_id = p.id
-        LEFT JOIN shipping_addresses sa ON sa.user_id = u.id AND sa.is_default = 1
         WHERE p.id = ?
     ''', (payment_id,)).fetchone()
 
@@ -1662,31 +3899,25 @@ def admin_order_detail(payment_id):
         conn.close()
         abort(404)
 
-    # Audit timeline
+    # Audit timeline (old entries may live in the archive)
+    attach_archive(conn)
     timeline = conn.execute('''
         SELECT al.*, u.display_name as admin_name
-        FROM audit_log al
+        FROM history_audit_log al
         LEFT JOIN users u ON al.admin_id = u.id
         WHERE al.entity_type = 'order' AND al.entity_id = ?
         ORDER BY al.created_at DESC
     ''', (payment_id,)).fetchall()
 
     # Recent bids for this auction
-    bids = conn.execute('''
-        SELECT b.amount, b.placed_at, b.is_winning, u.display_name as bidder_name
-        FROM bids b
-        JOIN users u ON b.user_id = u.id
-        WHERE b.auction_id = ?
-        ORDER BY b.placed_at DESC
-        LIMIT 10
-    ''', (order['auction_id'],)).fetchall()
+    bids = bid_history_page(conn, order['auction_id'], limit=10, archived=order['archived_at'])
 
     conn.close()
     return render_template('admin/order_detail.html',
                            order=dict(order), timeline=timeline, bids=bids)
 
 
-@app.route('/admin/order/<int:payment_id>/edit', methods=['POST'])
+@bp.route('/admin/order/<int:payment_id>/edit', methods=['POST'])
 @admin_required
 def admin_order_edit(payment_id):
     """Edit order details: status, tracking, carrier, notes."""
@@ -1703,16 +3934,15 @@ def admin_order_edit(payment_id):
 
     changes = {}
 
-    # Update payment status if changed
+    # Status override goes through the state machine so shipment/auction follow
     if new_status != payment['status']:
+        try:
+            transition_order(conn, payment_id, 'override', status=new_status)
+        except ValueError as e:
+            conn.close()
+            flash(str(e), 'error')
+            return redirect(url_for('main.admin_order_detail', payment_id=payment_id))
         changes['status'] = {'from': payment['status'], 'to': new_status}
-        now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-        conn.execute('UPDATE payments SET status = ? WHERE id = ?', (new_status, payment_id))
-        if new_status == 'paid' and not payment['completed_at']:
-            conn.execute('UPDATE payments SET completed_at = ? WHERE id = ?', (now_str, payment_id))
-        # Sync auction status
-        conn.execute('UPDATE auctions SET status = ? WHERE id = ?',
-                     (new_status, payment['auction_id']))
 
     # Update admin notes
     conn.execute('UPDATE payments SET admin_notes = ? WHERE id = ?', (admin_notes, payment_id))
@@ -1735,10 +3965,10 @@ def admin_order_edit(payment_id):
     conn.commit()
     conn.close()
     flash('Order updated successfully.', 'success')
-    return redirect(url_for('admin_order_detail', payment_id=payment_id))
+    return redirect(url_for('main.admin_order_detail', payment_id=payment_id))
 
 
-@app.route('/admin/order/<int:payment_id>/delete', methods=['POST'])
+@bp.route('/admin/order/<int:payment_id>/delete', methods=['POST'])
 @admin_required
 def admin_order_delete(payment_id):
     """Delete an order (only awaiting_payment orders)."""
@@ -1753,24 +3983,23 @@ def admin_order_delete(payment_id):
         flash(f'Cannot delete orders with status "{payment["status"]}". '
               f'Only awaiting_payment orders can be deleted.', 'error')
         conn.close()
-        return redirect(url_for('admin_order_detail', payment_id=payment_id))
+        return redirect(url_for('main.admin_order_detail', payment_id=payment_id))
 
     log_audit(conn, 'order', payment_id, 'deleted',
               {'auction_id': payment['auction_id'], 'amount': payment['amount'],
                'status': payment['status']})
 
-    conn.execute('DELETE FROM notifications WHERE link LIKE ?',
-                 (f'%{payment["payment_token"]}%',))
+    conn.execute('DELETE FROM notifications WHERE payment_id = ?', (payment_id,))
     conn.execute('DELETE FROM shipments WHERE payment_id = ?', (payment_id,))
     conn.execute('DELETE FROM payments WHERE id = ?', (payment_id,))
     conn.commit()
     conn.close()
 
     flash('Order deleted.', 'success')
-    return redirect(url_for('admin_orders'))
+    return redirect(url_for('main.admin_orders'))
 
 
-@app.route('/admin/order/new', methods=['GET', 'POST'])
+@bp.route('/admin/order/new', methods=['GET', 'POST'])
 @admin_required
 def admin_order_new():
     """Create a manual order."""
@@ -1803,16 +4032,18 @@ def admin_order_new():
                                    buyers=buyers, editing=False)
 
         token = secrets.token_urlsafe(32)
-        now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        now = datetime.now(timezone.utc)
+        now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+        expires_str = (now + timedelta(hours=PAYMENT_WINDOW_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-        conn.execute('''
+        new_id = conn.execute('''
             INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token,
-                                  admin_notes, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (auction_id, buyer_id, amount, status, token, admin_notes, now_str))
+                                  admin_notes, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id
+        ''', (auction_id, buyer_id, amount, status, token, admin_notes, now_str, expires_str)).fetchone()[0]
         conn.commit()
 
-        new_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
         log_audit(conn, 'order', new_id, 'created',
                   {'auction_id': auction_id, 'buyer_id': buyer_id,
                    'amount': amount, 'manual': True})
@@ -1820,7 +4051,7 @@ def admin_order_new():
         conn.close()
 
         flash('Manual order created.', 'success')
-        return redirect(url_for('admin_order_detail', payment_id=new_id))
+        return redirect(url_for('main.admin_order_detail', payment_id=new_id))
 
     auctions = conn.execute("SELECT id, title FROM auctions ORDER BY title").fetchall()
     buyers = conn.execute(
@@ -1833,7 +4064,7 @@ def admin_order_new():
 
 # --- Admin: User Management ---
 
-@app.route('/admin/users')
+@bp.route('/admin/users')
 @admin_required
 def admin_users():
     """List all users with search/filter."""
@@ -1844,7 +4075,7 @@ def admin_users():
 
     query = '''
         SELECT u.*,
-            (SELECT COUNT(*) FROM bids b WHERE b.user_id = u.id) as bid_count,
+            (SELECT COALESCE(SUM(s.bid_count), 0) FROM user_auction_state s WHERE s.user_id = u.id) as bid_count,
             (SELECT COUNT(*) FROM payments p WHERE p.buyer_id = u.id) as order_count,
             (SELECT COALESCE(SUM(p.amount), 0) FROM payments p
              WHERE p.buyer_id = u.id AND p.status IN ('paid', 'shipped', 'completed')) as total_spent
@@ -1854,7 +4085,7 @@ def admin_users():
     params = []
 
     if search:
-        query += ' AND (u.display_name LIKE ? OR u.email LIKE ?)'
+        query += ' AND (LOWER(u.display_name) LIKE LOWER(?) OR LOWER(u.email) LIKE LOWER(?))'
         params.extend([f'%{search}%', f'%{search}%'])
     if role_filter:
         query += ' AND u.role = ?'
@@ -1881,7 +4112,7 @@ def admin_users():
                            status_filter=status_filter)
 
 
-@app.route('/admin/user/new', methods=['GET', 'POST'])
+@bp.route('/admin/user/new', methods=['GET', 'POST'])
 @admin_required
 def admin_user_new():
     """Create a new user."""
@@ -1916,12 +4147,12 @@ def admin_user_new():
         conn = get_db()
         password_hash = generate_password_hash(password)
         now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-        conn.execute('''
+        new_id = conn.execute('''
             INSERT INTO users (email, password_hash, display_name, role, age_verified, created_at)
             VALUES (?, ?, ?, ?, 1, ?)
-        ''', (email, password_hash, display_name, role, now_str))
+            RETURNING id
+        ''', (email, password_hash, display_name, role, now_str)).fetchone()[0]
         conn.commit()
-        new_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
 
         log_audit(conn, 'user', new_id, 'created',
                   {'email': email, 'role': role, 'created_by_admin': True})
@@ -1929,12 +4160,12 @@ def admin_user_new():
         conn.close()
 
         flash(f'User "{display_name}" created.', 'success')
-        return redirect(url_for('admin_users'))
+        return redirect(url_for('main.admin_users'))
 
     return render_template('admin/user_form.html', editing=False)
 
 
-@app.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/user/<int:user_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def admin_user_edit(user_id):
     """Edit user profile."""
@@ -1975,6 +4206,7 @@ def admin_user_edit(user_id):
 
         conn.execute('UPDATE users SET display_name = ?, email = ?, role = ? WHERE id = ?',
                      (display_name, email, role, user_id))
+        invalidate(conn, 'user', user_id)
 
         if changes:
             log_audit(conn, 'user', user_id, 'edited', changes)
@@ -1982,13 +4214,13 @@ def admin_user_edit(user_id):
         conn.commit()
         conn.close()
         flash(f'User "{display_name}" updated.', 'success')
-        return redirect(url_for('admin_users'))
+        return redirect(url_for('main.admin_users'))
 
     conn.close()
     return render_template('admin/user_form.html', user=dict(user), editing=True)
 
 
-@app.route('/admin/user/<int:user_id>/toggle-active', methods=['POST'])
+@bp.route('/admin/user/<int:user_id>/toggle-active', methods=['POST'])
 @admin_required
 def admin_user_toggle_active(user_id):
     """Activate or deactivate a user."""
@@ -2001,10 +4233,11 @@ def admin_user_toggle_active(user_id):
     if user_id == current_user.id:
         flash('You cannot deactivate your own account.', 'error')
         conn.close()
-        return redirect(url_for('admin_users'))
+        return redirect(url_for('main.admin_users'))
 
     new_status = 0 if user['is_active'] else 1
     conn.execute('UPDATE users SET is_active = ? WHERE id = ?', (new_status, user_id))
+    invalidate(conn, 'user', user_id)
     log_audit(conn, 'user', user_id, 'toggled_active',
               {'is_active': {'from': user['is_active'], 'to': new_status}})
     conn.commit()
@@ -2012,10 +4245,10 @@ def admin_user_toggle_active(user_id):
 
     action = 'activated' if new_status else 'deactivated'
     flash(f'User "{user["display_name"]}" {action}.', 'success')
-    return redirect(url_for('admin_users'))
+    return redirect(url_for('main.admin_users'))
 
 
-@app.route('/admin/user/<int:user_id>/reset-password', methods=['POST'])
+@bp.route('/admin/user/<int:user_id>/reset-password', methods=['POST'])
 @admin_required
 def admin_user_reset_password(user_id):
     """Reset a user's password."""
@@ -2029,7 +4262,7 @@ def admin_user_reset_password(user_id):
     if len(new_password) < 8:
         flash('Password must be at least 8 characters.', 'error')
         conn.close()
-        return redirect(url_for('admin_user_edit', user_id=user_id))
+        return redirect(url_for('main.admin_user_edit', user_id=user_id))
 
     password_hash = generate_password_hash(new_password)
     conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
@@ -2038,14 +4271,150 @@ def admin_user_reset_password(user_id):
     conn.close()
 
     flash(f'Password reset for "{user["display_name"]}".', 'success')
-    return redirect(url_for('admin_user_edit', user_id=user_id))
+    return redirect(url_for('main.admin_user_edit', user_id=user_id))
+
+
+# =============================================
+# ADMIN: EXPORTS (streaming CSV / NDJSON)
+# =============================================
+# Full-table exports for accounting. Rows are read in keyset chunks by id, and
+# each chunk is its own short query. Memory stays flat and no read snapshot is
+# held open while a slow client downloads, so WAL checkpoints are not held up.
+# The output is encoded (and gzipped) chunk by chunk as the response streams.
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# dataset: (date column for ?from=/?to=, query with {where}; must select the keyset `id` first).
+# bids and audit read the history_* views, so archived rows are included.
+EXPORTS = {
+    'orders': ('p.created_at', '''
+        SELECT p.id, p.auction_id, a.title as auction_title, p.buyer_id, u.email as buyer_email,
+               p.amount, p.processor, p.processor_txn, p.status, p.created_at, p.completed_at,
+               s.status as shipment_status, s.carrier, s.tracking_number, s.shipped_at, s.delivered_at,
+               s.shipping_cost, s.country as ship_country
+        FROM payments p
+        LEFT JOIN auctions a ON a.id = p.auction_id
+        LEFT JOIN users u ON u.id = p.buyer_id
+        LEFT JOIN shipments s ON s.payment_id = p.id
+        WHERE {where}
+        ORDER BY p.id
+        LIMIT ?
+    '''),
+    'bids': ('b.placed_at', '''
+        SELECT b.id, b.auction_id, a.title as auction_title, b.user_id, u.email as bidder_email,
+               b.amount, b.placed_at, b.is_winning, b.ip_address
+        FROM history_bids b
+        LEFT JOIN auctions a ON a.id = b.auction_id
+        LEFT JOIN users u ON u.id = b.user_id
+        WHERE {where}
+        ORDER BY b.id
+        LIMIT ?
+    '''),
+    'audit': ('l.created_at', '''
+        SELECT l.id, l.entity_type, l.entity_id, l.action, l.details, l.admin_id,
+               u.email as admin_email, l.created_at
+        FROM history_audit_log l
+        LEFT JOIN users u ON u.id = l.admin_id
+        WHERE {where}
+        ORDER BY l.id
+        LIMIT ?
+    '''),
+}
+
+
+def iter_export(conn, dataset, start=None, end=None, chunk=EXPORT_CHUNK_ROWS):
+    """Yield lists of rows for an export, oldest first. start/end are
+    'YYYY-MM-DD' strings (end inclusive). Timestamps are stored both as
+    '...T..Z' and as SQLite's 'YYYY-MM-DD HH:MM:SS', and both compare
+    correctly against a bare date."""
+    date_column, query = EXPORTS[dataset]
+    id_column = date_column.split('.')[0] + '.id'
+    where, params = [f'{id_column} > ?'], []
+    if start:
+        where.append(f'{date_column} >= ?')
+        params.append(start)
+    if end:
+        where.append(f'{date_column} < ?')
+        params.append((datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+    sql = query.format(where=' AND '.join(where))
+    last_id = 0
+    while True:
+        rows = conn.execute(sql, (last_id, *params, chunk)).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk:
+            return
+        last_id = rows[-1]['id']
+
+
+def stream_export(conn, dataset, fmt, start=None, end=None, compress=False):
+    """Generator of encoded export bytes; closes conn when done or abandoned."""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+
+    def encode(text):
+        data = text.encode()
+        return gz.compress(data) if gz else data
+
+    try:
+        attach_archive(conn)
+        if fmt == 'csv':
+            # Header from the query itself, so an empty export still has its columns
+            columns = [d[0] for d in conn.execute(EXPORTS[dataset][1].format(where='1 = 0'), (0,)).description]
+            buf = io.StringIO()
+            csv.writer(buf).writerow(columns)
+            yield encode(buf.getvalue())
+        for rows in iter_export(conn, dataset, start, end):
+            buf = io.StringIO()
+            if fmt == 'csv':
+                csv.writer(buf).writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps(dict(row), separators=(',', ':')))
+                    buf.write('\n')
+            yield encode(buf.getvalue())
+        if gz:
+            yield gz.flush()
+    finally:
+        conn.close()
+
+
+@bp.route('/admin/export/<dataset>')
+@admin_required
+def admin_export(dataset):
+    """Stream a full export: /admin/export/orders|bids|audit
+    ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&gzip=1"""
+    if dataset not in EXPORTS:
+        abort(404)
+    fmt = request.args.get('format', 'csv')
+    start = request.args.get('from', '').strip() or None
+    end = request.args.get('to', '').strip() or None
+    compress = request.args.get('gzip') in ('1', 'on', 'true')
+    try:
+        for day in (start, end):
+            if day:
+                datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        flash('Export dates must be YYYY-MM-DD.', 'error')
+        return redirect(url_for('main.admin_orders'))
+    if fmt not in EXPORT_FORMATS:
+        flash('Export format must be CSV or NDJSON.', 'error')
+        return redirect(url_for('main.admin_orders'))
+
+    filename = '-'.join([dataset] + [d for d in (start, end) if d]) + f'.{fmt}' + ('.gz' if compress else '')
+    resp = current_app.response_class(stream_export(get_db(), dataset, fmt, start, end, compress),
+                                       mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt])
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
 
 # =============================================
 # NOTIFICATIONS API
 # =============================================
 
-@app.route('/api/notifications/count')
+@bp.route('/api/notifications/count')
 @login_required
 def notification_count():
     conn = get_db()
@@ -2062,7 +4431,7 @@ def notification_count():
 # We re-add CSRF via custom header check instead
 # =============================================
 
-@app.after_request
+@bp.after_app_request
 def add_security_headers(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -2076,11 +4445,1178 @@ csrf.exempt(notification_count)
 csrf.exempt(process_card_payment)
 
 
+# =============================================
+# BACKGROUND JOBS
+# =============================================
+# Durable queue in the `jobs` table. Request handlers enqueue() inside their own
+# transaction and return; `flask jobs-worker` (panties_fan_worker.service) claims
+# jobs under a lease, runs them and retries failures with exponential backoff.
+# While a handler runs, a heartbeat thread keeps renewing its lease, so a slow
+# job is never claimed a second time while it is still running. A worker that
+# dies mid-job stops renewing, loses its lease and the job is picked up again.
+
+JOB_TASKS = {}
+JOB_PRIORITY_HIGH = 10
+JOB_PRIORITY_NORMAL = 50
+JOB_PRIORITY_LOW = 90
+JOB_LEASE_SECONDS = 120
+JOB_HEARTBEAT_SECONDS = 30  # lease renewal interval while a job runs
+JOB_RETRY_BASE_SECONDS = 30
+JOB_DONE_RETENTION_DAYS = 7
+NOTIFICATION_RETENTION_DAYS = 30  # read notifications; unread ones are kept until seen
+NOTIFICATION_PRUNE_BATCH = 5000
+
+# (task, interval in seconds) — enqueued by the worker itself
+PERIODIC_JOBS = [
+    ('settle_auctions', 15),
+    ('expire_payments', 60),
+    ('send_emails', 60),  # digests + retries; immediate mail also enqueues a run
+    ('prune_jobs', 3600),
+    ('archive_history', 24 * 3600),
+    ('checkpoint_wal', 60),
+    ('backup_database', 24 * 3600),
+]
+
+
+def job_task(name):
+    """Decorator: register a function as a background task. Tasks receive an open
+    connection and the decoded payload; the worker commits after they return."""
+    def decorator(f):
+        JOB_TASKS[name] = f
+        return f
+    return decorator
+
+
+def enqueue(conn, task, payload=None, priority=JOB_PRIORITY_NORMAL, run_at=None,
+            max_attempts=5, dedupe_key=None):
+    """Queue a background job in the caller's transaction (commit to publish it).
+    With a dedupe_key, a job already queued under that key absorbs this one."""
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    run_at_str = run_at.strftime('%Y-%m-%dT%H:%M:%SZ') if run_at else now_str
+    conn.execute('''
+        INSERT INTO jobs (task, payload, priority, run_at, max_attempts, dedupe_key, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+    ''', (task, json.dumps(payload) if payload is not None else None, priority,
+          run_at_str, max_attempts, dedupe_key, now_str))
+
+
+def request_settlement(conn):
+    """Queue a settlement run if a live auction has passed its end time.
+    Read-only (no write lock) in the common case where nothing has expired."""
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    if conn.execute("SELECT 1 FROM auctions WHERE status = 'live' AND ends_at <= ? LIMIT 1",
+                    (now_str,)).fetchone():
+        enqueue(conn, 'settle_auctions', priority=JOB_PRIORITY_HIGH, dedupe_key='settle_auctions')
+        conn.commit()
+
+
+def claim_job(conn, worker_id):
+    """Atomically lease the next runnable job. Returns the job row or None.
+    While writes are backed up (shed_low_priority_writes) LOW-priority jobs
+    stay queued until the lock frees up."""
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    lease_str = (now + timedelta(seconds=JOB_LEASE_SECONDS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    max_priority = JOB_PRIORITY_LOW - 1 if shed_low_priority_writes() else JOB_PRIORITY_LOW
+
+    begin_write(conn)
+    # Recover jobs whose worker died while holding the lease
+    conn.execute('''
+        UPDATE jobs SET status = 'queued', locked_by = NULL, locked_until = NULL
+        WHERE status = 'running' AND locked_until <= ?
+    ''', (now_str,))
+    job = conn.execute('''
+        SELECT * FROM jobs
+        WHERE status = 'queued' AND run_at <= ? AND priority <= ?
+        ORDER BY priority, run_at, id
+        LIMIT 1
+    ''', (now_str, max_priority)).fetchone()
+    if job:
+        conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                            locked_by = ?, locked_until = ?
+            WHERE id = ?
+        ''', (worker_id, lease_str, job['id']))
+    conn.commit()
+    return job
+
+
+@contextmanager
+def lease_heartbeat(job_id, worker_id):
+    """Renew a claimed job's lease every JOB_HEARTBEAT_SECONDS from a background
+    thread (with its own connection) until the block exits. A renewal that
+    can't get the write lock is retried on the next beat."""
+    flask_app = current_app._get_current_object()
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            lease_str = (datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)
+                         ).strftime('%Y-%m-%dT%H:%M:%SZ')
+            with flask_app.app_context():
+                conn = get_db()
+                try:
+                    begin_write(conn)
+                    conn.execute('''
+                        UPDATE jobs SET locked_until = ?
+                        WHERE id = ? AND locked_by = ? AND status = 'running'
+                    ''', (lease_str, job_id, worker_id))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    flask_app.logger.warning('Could not renew the lease on job %s: %s', job_id, e)
+                finally:
+                    conn.close()
+
+    thread = threading.Thread(target=beat, name=f'job-{job_id}-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def execute_job(job, worker_id):
+    """Run one claimed job and record the outcome (done / retry / failed)."""
+    conn = get_db()
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    attempts = job['attempts'] + 1
+    try:
+        handler = JOB_TASKS.get(job['task'])
+        if handler is None:
+            raise LookupError(f"Unknown task '{job['task']}'")
+        with lease_heartbeat(job['id'], worker_id):
+            handler(conn, json.loads(job['payload']) if job['payload'] else {})
+        conn.execute('''
+            UPDATE jobs SET status = 'done', finished_at = ?, locked_by = NULL, locked_until = NULL
+            WHERE id = ? AND locked_by = ?
+        ''', (now_str, job['id'], worker_id))
+        conn.commit()
+        ok = True
+    except Exception as e:
+        conn.rollback()
+        error = f'{type(e).__name__}: {e}'[:1000]
+        if attempts >= job['max_attempts']:
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', last_error = ?, finished_at = ?,
+                                locked_by = NULL, locked_until = NULL
+                WHERE id = ? AND locked_by = ?
+            ''', (error, now_str, job['id'], worker_id))
+        else:
+            retry_at = now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            conn.execute('''
+                UPDATE jobs SET status = 'queued', last_error = ?, run_at = ?,
+                                locked_by = NULL, locked_until = NULL
+                WHERE id = ? AND locked_by = ?
+            ''', (error, retry_at.strftime('%Y-%m-%dT%H:%M:%SZ'), job['id'], worker_id))
+        conn.commit()
+        current_app.logger.warning('Job %s (%s) attempt %s failed: %s', job['id'], job['task'], attempts, error)
+        ok = False
+    conn.close()
+    return ok
+
+
+def run_worker(app, worker_id, burst=False, poll_interval=1.0, install_signals=True):
+    """Job worker loop. burst=True drains the queue once and returns (no periodic jobs)."""
+    stopping = []
+    if install_signals:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stopping.append(True))
+
+    next_run = {task: 0.0 for task, _ in PERIODIC_JOBS}
+    processed = 0
+    while not stopping:
+        with app.app_context():
+            cache_bus.poll(app.config['DATABASE'])
+            conn = get_db()
+            if not burst:
+                now_mono = time.monotonic()
+                for task, every in PERIODIC_JOBS:
+                    if now_mono >= next_run[task]:
+                        enqueue(conn, task, priority=JOB_PRIORITY_HIGH, dedupe_key=task)
+                        next_run[task] = now_mono + every
+                conn.commit()
+            job = claim_job(conn, worker_id)
+            conn.close()
+            if job:
+                execute_job(job, worker_id)
+                processed += 1
+                continue
+        if burst:
+            break
+        time.sleep(poll_interval)
+    return processed
+
+
+def job_queue_stats(conn):
+    """Queue depth / failure counters for the admin jobs page."""
+    stats = dict.fromkeys(('queued', 'running', 'failed', 'done'), 0)
+    for row in conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'):
+        stats[row[0]] = row[1]
+    now = datetime.now(timezone.utc)
+    row = conn.execute(
+        "SELECT COUNT(*), MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?",
+        (now.strftime('%Y-%m-%dT%H:%M:%SZ'),)
+    ).fetchone()
+    stats['due'] = row[0]
+    stats['lag_seconds'] = 0
+    if row[1]:
+        oldest = datetime.strptime(row[1], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        stats['lag_seconds'] = int((now - oldest).total_seconds())
+    return stats
+
+
+# --- Tasks ---
+
+@job_task('settle_auctions')
+def task_settle_auctions(conn, payload):
+    end_expired_auctions(conn)
+
+
+@job_task('expire_payments')
+def task_expire_payments(conn, payload):
+    # Drain everything overdue, one transaction per batch
+    while expire_overdue_payments(conn) == PAYMENT_EXPIRY_BATCH:
+        pass
+
+
+@job_task('notify_outbid')
+def task_notify_outbid(conn, payload):
+    auction = conn.execute('SELECT title, current_bidder_id FROM auctions WHERE id = ?',
+                           (payload['auction_id'],)).fetchone()
+    # Skip if the auction is gone or the user has since retaken the lead
+    if not auction or auction['current_bidder_id'] == payload['user_id']:
+        return
+    notify(conn, payload['user_id'], 'outbid',
+           'You have been outbid',
+           f'Someone bid ${payload["amount"]:.2f} on "{auction["title"]}". Bid again before it ends!',
+           f'/#card-{payload["auction_id"]}', auction_id=payload['auction_id'])
+
+
+def prune_notifications(conn, days=NOTIFICATION_RETENTION_DAYS, batch=NOTIFICATION_PRUNE_BATCH):
+    """Delete read notifications older than `days`, a batch per transaction.
+    Each batch is a range scan on the partial index idx_notifications_read.
+    Returns the number deleted."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    deleted = 0
+    while True:
+        n = conn.execute('''
+            DELETE FROM notifications WHERE id IN (
+                SELECT id FROM notifications WHERE is_read = 1 AND created_at < ? LIMIT ?)
+        ''', (cutoff, batch)).rowcount
+        conn.commit()
+        deleted += n
+        if n < batch:
+            return deleted
+
+
+@job_task('prune_jobs')
+def task_prune_jobs(conn, payload):
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=JOB_DONE_RETENTION_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    conn.execute("DELETE FROM jobs WHERE status IN ('done', 'superseded') AND finished_at < ?", (cutoff,))
+    conn.execute("DELETE FROM email_outbox WHERE status = 'sent' AND sent_at < ?", (cutoff,))
+    idem_cutoff = (datetime.now(timezone.utc) - timedelta(hours=IDEMPOTENCY_TTL_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (idem_cutoff,))
+    events_cutoff = (datetime.now(timezone.utc) - timedelta(minutes=CACHE_EVENT_RETENTION_MINUTES)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    conn.execute('DELETE FROM cache_events WHERE created_at < ?', (events_cutoff,))
+    conn.execute("DELETE FROM auction_trending WHERE auction_id IN (SELECT id FROM auctions WHERE status != 'live')")
+    conn.commit()
+    prune_notifications(conn)
+
+
+@bp.cli.command('jobs-worker')
+@click.option('--burst', is_flag=True, help='Drain the queue once and exit.')
+@click.option('--poll', default=1.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+def jobs_worker_command(burst, poll):
+    """Run the background job worker (alongside Gunicorn)."""
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    click.echo(f'Job worker {worker_id} started ({len(JOB_TASKS)} tasks registered).')
+    processed = run_worker(current_app._get_current_object(), worker_id, burst=burst, poll_interval=poll)
+    click.echo(f'Job worker stopped after {processed} jobs.')
+
+
+# --- Admin: Job Queue ---
+
+@bp.route('/admin/jobs')
+@admin_required
+def admin_jobs():
+    conn = get_db()
+    stats = job_queue_stats(conn)
+    by_task = conn.execute('''
+        SELECT task,
+               COUNT(*) FILTER (WHERE status = 'queued') as queued,
+               COUNT(*) FILTER (WHERE status = 'running') as running,
+               COUNT(*) FILTER (WHERE status = 'failed') as failed,
+               COUNT(*) FILTER (WHERE status = 'done') as done
+        FROM jobs
+        GROUP BY task
+        ORDER BY task
+    ''').fetchall()
+    failed = conn.execute('''
+        SELECT * FROM jobs WHERE status = 'failed'
+        ORDER BY finished_at DESC LIMIT 50
+    ''').fetchall()
+    upcoming = conn.execute('''
+        SELECT * FROM jobs WHERE status IN ('queued', 'running')
+        ORDER BY priority, run_at, id LIMIT 50
+    ''').fetchall()
+    conn.close()
+    return render_template('admin/jobs.html', stats=stats, by_task=by_task,
+                           failed=failed, upcoming=upcoming)
+
+
+@bp.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+@admin_required
+def admin_job_retry(job_id):
+    conn = get_db()
+    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not job:
+        conn.close()
+        abort(404)
+    if job['status'] != 'failed':
+        flash('Only failed jobs can be retried.', 'error')
+        conn.close()
+        return redirect(url_for('main.admin_jobs'))
+
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    begin_write(conn)
+    twin = None
+    if job['dedupe_key'] is not None:
+        # idx_jobs_dedupe allows one queued job per key; that one does the same work
+        twin = conn.execute("SELECT id FROM jobs WHERE status = 'queued' AND dedupe_key = ?",
+                            (job['dedupe_key'],)).fetchone()
+    if twin:
+        conn.execute("UPDATE jobs SET status = 'superseded', finished_at = ? WHERE id = ?", (now_str, job_id))
+        log_audit(conn, 'job', job_id, 'superseded', {'task': job['task'], 'queued_job': twin['id']})
+        conn.commit()
+        conn.close()
+        flash(f'Job #{twin["id"]} ({job["task"]}) is already queued and will do the same work; '
+              f'#{job_id} was marked superseded.', 'info')
+        return redirect(url_for('main.admin_jobs'))
+
+    conn.execute('''
+        UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, finished_at = NULL
+        WHERE id = ?
+    ''', (now_str, job_id))
+    log_audit(conn, 'job', job_id, 'retried', {'task': job['task']})
+    conn.commit()
+    conn.close()
+    flash(f'Job #{job_id} ({job["task"]}) re-queued.', 'success')
+    return redirect(url_for('main.admin_jobs'))
+
+
+# =============================================
+# EMAIL (outbox + batched delivery)
+# =============================================
+# notify() drops an email into `email_outbox`; the send_emails job delivers due
+# messages over one SMTP connection per batch. Low-priority types are held for
+# the user's digest window and go out as one combined email. Nothing here runs
+# on the request path. Local testing:
+#   python -m aiosmtpd -n -l localhost:1025
+#   MAIL_SERVER=localhost MAIL_PORT=1025 flask --app app jobs-worker
+
+EMAIL_DIGEST_TYPES = {'outbid'}
+EMAIL_DIGEST_CHOICES = {0: 'Immediately', 60: 'Hourly digest', 1440: 'Daily digest'}
+EMAIL_BATCH_SIZE = 100
+EMAIL_DIGEST_RESERVE = 10  # batch slots kept for digests, so a backlog of immediate mail can't starve them
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 60
+
+
+def queue_email(conn, user_id, kind, subject, message, link=None):
+    """Add an email to the outbox (caller commits). No-op when mail isn't configured."""
+    if not (current_app if has_app_context() else app).config.get('MAIL_ENABLED'):
+        return
+    user = conn.execute('SELECT email, email_digest_minutes, is_active FROM users WHERE id = ?',
+                        (user_id,)).fetchone()
+    if not user or not user['is_active']:
+        return
+
+    now = datetime.now(timezone.utc)
+    digest = kind in EMAIL_DIGEST_TYPES and user['email_digest_minutes'] > 0
+    send_after = now + timedelta(minutes=user['email_digest_minutes']) if digest else now
+    conn.execute('''
+        INSERT INTO email_outbox (user_id, to_addr, kind, subject, message, link, digest, send_after, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, user['email'], kind, subject, message, link, int(digest),
+          send_after.strftime('%Y-%m-%dT%H:%M:%SZ'), now.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    if not digest:
+        enqueue(conn, 'send_emails', dedupe_key='send_emails')
+
+
+def _render_email(kind, **context):
+    context['site_url'] = current_app.config['SITE_URL']
+    template = current_app.jinja_env.select_template([f'email/{kind}.txt', 'email/notification.txt'])
+    return template.render(**context)
+
+
+def _due_email_batches(conn, now_str):
+    """Yield (outbox ids, to_addr, subject, body) for everything due, capped at
+    EMAIL_BATCH_SIZE. Immediate mail fills the batch except for
+    EMAIL_DIGEST_RESERVE slots; slots the digests don't need go back to it."""
+    cap = EMAIL_BATCH_SIZE - EMAIL_DIGEST_RESERVE
+    rows = conn.execute('''
+        SELECT * FROM email_outbox
+        WHERE status = 'queued' AND digest = 0 AND send_after <= ?
+        ORDER BY id LIMIT ?
+    ''', (now_str, cap)).fetchall()
+    for row in rows:
+        body = _render_email(row['kind'], subject=row['subject'], message=row['message'], link=row['link'])
+        yield [row['id']], row['to_addr'], row['subject'], body
+
+    # One digest per user whose window has closed; it sweeps up every queued
+    # digest item for that user, including ones whose own window is still open.
+    users = conn.execute('''
+        SELECT DISTINCT user_id FROM email_outbox
+        WHERE status = 'queued' AND digest = 1 AND send_after <= ?
+        LIMIT ?
+    ''', (now_str, max(EMAIL_BATCH_SIZE - len(rows), 0))).fetchall()
+    for u in users:
+        items = conn.execute('''
+            SELECT * FROM email_outbox
+            WHERE status = 'queued' AND digest = 1 AND user_id = ?
+            ORDER BY id
+        ''', (u['user_id'],)).fetchall()
+        subject = items[0]['subject'] if len(items) == 1 else f'{len(items)} updates from PantiesFan'
+        body = _render_email('digest', subject=subject, items=items)
+        yield [i['id'] for i in items], items[-1]['to_addr'], subject, body
+
+    room = EMAIL_BATCH_SIZE - len(rows) - len(users)
+    if room > 0 and len(rows) == cap:
+        for row in conn.execute('''
+            SELECT * FROM email_outbox
+            WHERE status = 'queued' AND digest = 0 AND send_after <= ? AND id > ?
+            ORDER BY id LIMIT ?
+        ''', (now_str, rows[-1]['id'], room)).fetchall():
+            body = _render_email(row['kind'], subject=row['subject'], message=row['message'], link=row['link'])
+            yield [row['id']], row['to_addr'], row['subject'], body
+
+
+def _smtp_connection_lost(exc):
+    """True when the SMTP connection itself is unusable, as opposed to one
+    message being refused. (SMTPException subclasses OSError.)"""
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code == 421  # service closing the channel
+    return isinstance(exc, (smtplib.SMTPServerDisconnected, OSError)) and \
+        not isinstance(exc, smtplib.SMTPRecipientsRefused)
+
+
+@job_task('send_emails')
+def task_send_emails(conn, payload):
+    if not current_app.config.get('MAIL_ENABLED'):
+        return
+    now = datetime.now(timezone.utc)
+    now_str = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    batches = list(_due_email_batches(conn, now_str))
+    if not batches:
+        return
+
+    # A refused message is retried on its own outbox row. An error that means
+    # the connection is gone ends the batch instead: the remaining messages
+    # stay queued without using up attempts, and the job itself is retried
+    # with backoff (which reconnects).
+    lost = None
+    try:
+        with mail.connect() as smtp:
+            for ids, to_addr, subject, body in batches:
+                marks = ','.join('?' * len(ids))
+                try:
+                    smtp.send(Message(subject=subject, recipients=[to_addr], body=body))
+                    conn.execute(f"UPDATE email_outbox SET status = 'sent', sent_at = ? WHERE id IN ({marks})",
+                                 (now_str, *ids))
+                except Exception as e:
+                    if _smtp_connection_lost(e):
+                        lost = e
+                        break
+                    attempts = conn.execute(f'SELECT MAX(attempts) FROM email_outbox WHERE id IN ({marks})',
+                                            ids).fetchone()[0] + 1
+                    retry_at = now + timedelta(seconds=EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+                    conn.execute(f'''
+                        UPDATE email_outbox
+                        SET attempts = ?, last_error = ?, send_after = ?,
+                            status = CASE WHEN ? >= ? THEN 'failed' ELSE 'queued' END
+                        WHERE id IN ({marks})
+                    ''', (attempts, f'{type(e).__name__}: {e}'[:1000], retry_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                          attempts, EMAIL_MAX_ATTEMPTS, *ids))
+                # Commit per message so a crash mid-batch doesn't re-send what already went out
+                conn.commit()
+    except OSError:
+        # QUIT on a dead connection fails as well; report the error that ended the batch
+        if lost is None:
+            raise
+    if lost is not None:
+        raise lost
+
+    if len(batches) >= EMAIL_BATCH_SIZE:
+        enqueue(conn, 'send_emails', dedupe_key='send_emails')
+
+
+@bp.route('/dashboard/email', methods=['POST'])
+@login_required
+def dashboard_save_email_prefs():
+    """Save how often low-priority emails (outbid alerts) are sent."""
+    try:
+        minutes = int(request.form.get('email_digest_minutes', ''))
+    except ValueError:
+        minutes = None
+    if minutes not in EMAIL_DIGEST_CHOICES:
+        flash('Please choose a valid email frequency.', 'error')
+        return redirect(url_for('main.buyer_dashboard'))
+
+    conn = get_db()
+    conn.execute('UPDATE users SET email_digest_minutes = ? WHERE id = ?', (minutes, current_user.id))
+    conn.commit()
+    conn.close()
+    flash('Email preferences updated!', 'success')
+    return redirect(url_for('main.buyer_dashboard'))
+
+
+# =============================================
+# COLD ARCHIVE (settled history)
+# =============================================
+# Bids of settled auctions and old audit rows move to a separate database
+# file that is ATTACHed as `archive` only when history is needed. That keeps
+# the hot database small enough to stay in the page cache. Views that show
+# history (admin bids/orders, exports) read both databases through the temp
+# views history_bids / history_audit_log. Archived auctions carry
+# auctions.archived_at, so their bid lists are read straight from the archive.
+# Read notifications are not archived; they expire (NOTIFICATION_RETENTION_DAYS).
+# CLI: flask --app app archive-history [--days N] [--convert]
+
+ARCHIVE_BATCH_AUCTIONS = 200   # auctions (and all their bids) per transaction
+ARCHIVE_BATCH_ROWS = 5000      # audit rows per transaction
+ARCHIVE_AUCTION_STATUSES = ('completed', 'unsold')
+
+# Columns are listed rather than SELECT * so the hot schema can grow new columns
+ARCHIVE_TABLES = {
+    'bids': 'id, auction_id, user_id, amount, placed_at, is_winning, ip_address',
+    'audit_log': 'id, entity_type, entity_id, action, details, admin_id, created_at',
+}
+
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS archive.bids (
+        id INTEGER PRIMARY KEY, auction_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        amount REAL NOT NULL, placed_at TEXT, is_winning INTEGER DEFAULT 0, ip_address TEXT)''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_bids_auction_id ON bids(auction_id, id DESC)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_bids_user ON bids(user_id)',
+    '''CREATE TABLE IF NOT EXISTS archive.audit_log (
+        id INTEGER PRIMARY KEY, entity_type TEXT NOT NULL, entity_id INTEGER NOT NULL,
+        action TEXT NOT NULL, details TEXT, admin_id INTEGER, created_at TEXT)''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_audit_entity ON audit_log(entity_type, entity_id)',
+]
+
+
+def archive_path_for(path):
+    """Default archive location next to the hot database: panties_fan.db ->
+    panties_fan-archive.db (memory URIs get a sibling memory database)."""
+    base, sep, query = path.partition('?')
+    root, ext = os.path.splitext(base)
+    return f'{root}-archive{ext or ".db"}{sep}{query}'
+
+
+def attach_archive(conn):
+    """ATTACH the archive as `archive` (creating it on first use) and define
+    the history_* temp views over both databases. Must be called outside a
+    transaction; cheap to call again on the same connection. PostgreSQL has
+    no archive: there the history_* views are permanent and read the live tables."""
+    if is_postgres(conn) or conn.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'").fetchone():
+        return conn
+    path = (current_app if has_app_context() else app).config['ARCHIVE_DATABASE']
+    if is_memory_database(path) and path not in _memory_keepalive:
+        _memory_keepalive[path] = sqlite3.connect(path, uri=True)
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    conn.execute('PRAGMA archive.journal_mode=WAL')
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    for table, columns in ARCHIVE_TABLES.items():
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS history_{table} AS
+            SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM archive.{table}
+        ''')
+    return conn
+
+
+def _archive_move(conn, table, where, params):
+    """Move the rows of one table matching `where` into the archive.
+
+    Two transactions: copy, then delete. Main runs in WAL mode, and SQLite does
+    not commit atomically across WAL databases. Committing the copy first means
+    a crash can only leave a row in both databases, never in neither. INSERT OR
+    IGNORE makes the re-run after such a crash harmless."""
+    columns = ARCHIVE_TABLES[table]
+    conn.execute('BEGIN')
+    conn.execute(f'INSERT OR IGNORE INTO archive.{table} ({columns}) '
+                 f'SELECT {columns} FROM main.{table} WHERE {where}', params)
+    conn.commit()
+    begin_write(conn)
+    moved = conn.execute(f'DELETE FROM main.{table} WHERE {where}', params).rowcount
+    return moved  # the caller commits, together with any bookkeeping
+
+
+def archive_history(conn, older_than_days=None):
+    """Move settled history older than the cutoff into the archive database,
+    then hand the freed pages back to the filesystem. Each step runs in bounded
+    batches so bidders never wait long on the write lock. Returns
+    {table: rows moved} plus the number of auctions archived (all zero on
+    PostgreSQL, which keeps its history in place)."""
+    counts = dict.fromkeys(('auctions', *ARCHIVE_TABLES), 0)
+    if is_postgres(conn):
+        return counts
+    if older_than_days is None:
+        older_than_days = (current_app if has_app_context() else app).config['ARCHIVE_AFTER_DAYS']
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    attach_archive(conn)
+    statuses = json.dumps(ARCHIVE_AUCTION_STATUSES)
+
+    while True:
+        ids = [row[0] for row in conn.execute(f'''
+            SELECT id FROM auctions
+            WHERE archived_at IS NULL AND ends_at < ?
+              AND status IN (SELECT value FROM json_each(?))
+            ORDER BY id LIMIT ?
+        ''', (cutoff, statuses, ARCHIVE_BATCH_AUCTIONS))]
+        if not ids:
+            break
+        batch = json.dumps(ids)
+        counts['bids'] += _archive_move(conn, 'bids', 'auction_id IN (SELECT value FROM json_each(?))', (batch,))
+        conn.execute('UPDATE auctions SET archived_at = ? WHERE id IN (SELECT value FROM json_each(?))',
+                     (now_str, batch))
+        conn.commit()
+        counts['auctions'] += len(ids)
+
+    # Audit rows go by age alone (the table is append-only)
+    while True:
+        last = conn.execute('SELECT MAX(id) FROM (SELECT id FROM main.audit_log WHERE created_at < ? '
+                            'ORDER BY id LIMIT ?)', (cutoff, ARCHIVE_BATCH_ROWS)).fetchone()[0]
+        if last is None:
+            break
+        counts['audit_log'] += _archive_move(conn, 'audit_log', 'created_at < ? AND id <= ?', (cutoff, last))
+        conn.commit()
+
+    # Return freed pages to the OS (only possible once auto_vacuum is incremental)
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] == 2:
+        # executescript steps the pragma to completion; execute() frees a single page
+        conn.executescript('PRAGMA main.incremental_vacuum')
+    return counts
+
+
+@job_task('archive_history')
+def task_archive_history(conn, payload):
+    counts = archive_history(conn)
+    if any(counts.values()):
+        current_app.logger.info('Archived %s', counts)
+
+
+@bp.cli.command('archive-history')
+@click.option('--days', type=int, default=None, help='Archive history older than this (default ARCHIVE_AFTER_DAYS).')
+@click.option('--convert', is_flag=True,
+              help='One-off: switch an existing database to incremental auto-vacuum (runs VACUUM, locks the DB).')
+def archive_history_command(days, convert):
+    """Move settled bids and old audit rows to the archive database."""
+    conn = get_db()
+    if is_postgres(conn):
+        conn.close()
+        click.echo('PostgreSQL database: history stays in place, nothing to archive.')
+        return
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        if convert:
+            click.echo('Rebuilding the database with auto_vacuum=INCREMENTAL...')
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        else:
+            click.echo('Note: this database predates incremental auto-vacuum, so freed pages are only '
+                       'reused, not returned to the OS. Run once with --convert during a quiet period.')
+    counts = archive_history(conn, days)
+    size = conn.execute('SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()').fetchone()[0]
+    conn.close()
+    click.echo(f"Archived {counts['auctions']} auctions: " +
+               ', '.join(f'{n} {table}' for table, n in counts.items() if table != 'auctions') +
+               f'. Hot database is now {size / 1024 / 1024:.1f}MB.')
+
+
+# =============================================
+# DATABASE MAINTENANCE (WAL checkpoints + online backups)
+# =============================================
+# Every commit is appended to panties_fan.db-wal. A checkpoint copies those
+# pages back into the main file. SQLite's automatic checkpoint is PASSIVE, and
+# it cannot get past a reader that is still on an old snapshot, so under steady
+# traffic the WAL only grows. The job worker therefore checkpoints every minute:
+#   PASSIVE  - always first; copies what it can without taking the write lock
+#   TRUNCATE - only while writes are quiet (write_health); with no busy wait it
+#              gives up at once if a writer or reader is in the way, otherwise
+#              it resets the WAL file to zero bytes
+#
+# Backups use the SQLite backup API, a few hundred pages per step. The source
+# connection holds one read transaction over the main and archive databases
+# for the whole copy, so the pair is consistent and the copy never restarts
+# when someone commits. In WAL mode that read transaction does not block writers.
+
+CHECKPOINT_QUIET_WAIT_MS = 5      # average lock wait (see write_health) that still counts as quiet
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005         # seconds between steps, to leave disk bandwidth for requests
+BACKUP_KEEP = 7                   # newest backups kept in BACKUP_DIR
+
+
+def wal_size(path):
+    try:
+        return os.path.getsize(f'{path}-wal')
+    except FileNotFoundError:
+        return 0
+
+
+def set_maintenance_state(conn, name, state):
+    conn.execute('''
+        INSERT INTO maintenance_state (name, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    ''', (name, json.dumps(state), datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')))
+    conn.commit()
+
+
+def checkpoint_wal(conn, truncate=None):
+    """Checkpoint the main database's WAL: PASSIVE, then TRUNCATE when
+    truncate is true (None: when writes are quiet). Returns the outcome, or
+    None for a memory or PostgreSQL database."""
+    path = (current_app if has_app_context() else app).config['DATABASE']
+    if is_memory_database(path) or is_postgres_url(path):
+        return None
+    if conn.in_transaction:
+        conn.commit()
+    if truncate is None:
+        health = write_health().snapshot()
+        truncate = health['waiting'] == 0 and health['avg_wait_ms'] < CHECKPOINT_QUIET_WAIT_MS
+    busy, frames, done = conn.execute('PRAGMA main.wal_checkpoint(PASSIVE)').fetchone()
+    mode = 'PASSIVE'
+    if truncate:
+        # TRUNCATE holds the write lock while it waits for readers — so don't wait
+        conn.execute('PRAGMA busy_timeout = 0')
+        try:
+            busy, frames, done = conn.execute('PRAGMA main.wal_checkpoint(TRUNCATE)').fetchone()
+            mode = 'TRUNCATE'
+        except sqlite3.OperationalError:  # a writer got there first; try again next run
+            pass
+        finally:
+            conn.execute('PRAGMA busy_timeout = 5000')
+    now_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    previous = conn.execute("SELECT state FROM maintenance_state WHERE name = 'checkpoint'").fetchone()
+    result = {'mode': mode, 'busy': bool(busy), 'wal_frames': frames, 'checkpointed': done,
+              'lag_frames': max(0, frames - done),
+              'complete_at': (now_str if not busy and frames == done
+                              else previous and json.loads(previous['state']).get('complete_at'))}
+    set_maintenance_state(conn, 'checkpoint', result)
+    return result
+
+
+def backup_database(conn, dest_dir=None, keep=BACKUP_KEEP):
+    """Copy the main and archive databases into a new timestamped directory
+    under dest_dir (default BACKUP_DIR) and delete all but the newest `keep`.
+    Returns {'path', 'bytes', 'seconds'}, or None for a memory or PostgreSQL
+    database (back those up with pg_dump)."""
+    config = (current_app if has_app_context() else app).config
+    if is_memory_database(config['DATABASE']) or is_postgres_url(config['DATABASE']):
+        return None
+    dest_dir = dest_dir or config['BACKUP_DIR']
+    started = time.monotonic()
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    target = os.path.join(dest_dir, stamp)
+    suffix = 1
+    while os.path.exists(target):  # a second backup within the same second
+        suffix += 1
+        target = os.path.join(dest_dir, f'{stamp}-{suffix}')
+    partial = f'{target}.partial'
+    os.makedirs(partial, exist_ok=True)
+
+    if conn.in_transaction:
+        conn.commit()
+    attach_archive(conn)
+    conn.execute('BEGIN')
+    # Read from both files so the snapshot is pinned before the first step
+    conn.execute('SELECT (SELECT COUNT(*) FROM main.sqlite_master), (SELECT COUNT(*) FROM archive.sqlite_master)')
+    try:
+        for schema, path in (('main', config['DATABASE']), ('archive', config['ARCHIVE_DATABASE'])):
+            dest = sqlite3.connect(os.path.join(partial, os.path.basename(path)))
+            try:
+                conn.backup(dest, name=schema, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+                # The copy is a standalone file: no -wal alongside it
+                dest.execute('PRAGMA journal_mode=DELETE')
+                if dest.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError(f'Backup of {schema} failed quick_check')
+            finally:
+                dest.close()
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    finally:
+        conn.rollback()
+    os.replace(partial, target)
+
+    backups = sorted(name for name in os.listdir(dest_dir)
+                     if os.path.isdir(os.path.join(dest_dir, name)) and not name.endswith('.partial'))
+    if keep:
+        for name in backups[:-keep]:
+            shutil.rmtree(os.path.join(dest_dir, name), ignore_errors=True)
+
+    result = {'path': target, 'seconds': round(time.monotonic() - started, 2),
+              'bytes': sum(os.path.getsize(os.path.join(target, name)) for name in os.listdir(target))}
+    set_maintenance_state(conn, 'backup', result)
+    return result
+
+
+def maintenance_report(conn):
+    """WAL size now, plus the last checkpoint and backup, for the admin page."""
+    path = (current_app if has_app_context() else app).config['DATABASE']
+    now = datetime.now(timezone.utc)
+    report = {'wal_bytes': wal_size(path), 'checkpoint': None, 'backup': None}
+    for row in conn.execute('SELECT * FROM maintenance_state'):
+        state = json.loads(row['state'])
+        state['ran_at'] = row['updated_at']
+        report[row['name']] = state
+    checkpoint, backup = report['checkpoint'], report['backup']
+    if checkpoint and checkpoint.get('complete_at'):
+        # How long the WAL has held pages that are not in the main file yet
+        checkpoint['lag_seconds'] = int((now - datetime.strptime(
+            checkpoint['complete_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)).total_seconds())
+    if backup:
+        backup['age_seconds'] = int((now - datetime.strptime(
+            backup['ran_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)).total_seconds())
+    return report
+
+
+@job_task('checkpoint_wal')
+def task_checkpoint_wal(conn, payload):
+    checkpoint_wal(conn)
+
+
+@job_task('backup_database')
+def task_backup_database(conn, payload):
+    result = backup_database(conn)
+    if result:
+        current_app.logger.info('Backed up %s bytes to %s in %ss', result['bytes'], result['path'], result['seconds'])
+
+
+@bp.route('/admin/metrics/maintenance')
+@admin_required
+def admin_maintenance_metrics():
+    """WAL size, checkpoint lag and last backup as JSON."""
+    conn = get_db()
+    report = maintenance_report(conn)
+    conn.close()
+    return jsonify(report)
+
+
+@bp.cli.command('checkpoint-wal')
+@click.option('--truncate/--passive', default=None,
+              help='Force or skip the TRUNCATE step (default: only when writes are quiet).')
+def checkpoint_wal_command(truncate):
+    """Checkpoint the WAL into the main database file."""
+    conn = get_db()
+    result = checkpoint_wal(conn, truncate)
+    conn.close()
+    if result is None:
+        click.echo('Memory or PostgreSQL database: nothing to checkpoint.')
+        return
+    click.echo(f"{result['mode']}: {result['checkpointed']}/{result['wal_frames']} frames checkpointed"
+               + (' (busy: readers or writers in the way)' if result['busy'] else ''))
+
+
+@bp.cli.command('backup-db')
+@click.option('--dest', default=None, help='Backup directory (default BACKUP_DIR).')
+@click.option('--keep', type=int, default=BACKUP_KEEP, show_default=True, help='Newest backups to keep; 0 keeps all.')
+def backup_db_command(dest, keep):
+    """Take an online snapshot of the main and archive databases."""
+    conn = get_db()
+    result = backup_database(conn, dest, keep)
+    conn.close()
+    if result is None:
+        click.echo('Memory or PostgreSQL database: nothing to back up (use pg_dump for PostgreSQL).')
+        return
+    click.echo(f"Backed up {result['bytes'] / 1024 / 1024:.1f}MB to {result['path']} in {result['seconds']}s.")
+
+
+# =============================================
+# SCALE SEEDING (dev / benchmarks only)
+# =============================================
+
+SCALE_STATUS_MIX = [
+    # (auction status, share of auctions, payment status or None)
+    ('draft', 0.05, None),
+    ('live', 0.20, None),
+    ('ended', 0.10, 'awaiting_payment'),
+    ('ended', 0.05, 'pending'),
+    ('paid', 0.10, 'paid'),
+    ('shipped', 0.10, 'shipped'),
+    ('completed', 0.40, 'completed'),
+]
+
+
+def seed_scale(conn, users=10000, muses=200, auctions=20000, bids=1000000, seed=1):
+    """Bulk-generate a large, deterministic synthetic dataset on top of whatever is
+    already in the database. Bid volume per auction and per bidder follows a power
+    law so a handful of hot auctions / heavy bidders dominate, like real traffic.
+    Everything is written with executemany inside a single transaction."""
+    rng = random.Random(seed)
+    fmt = '%Y-%m-%dT%H:%M:%SZ'
+    bid_fmt = '%Y-%m-%d %H:%M:%S'  # matches bids.placed_at default (datetime('now'))
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    now_ts = int(now.timestamp())
+    counts = {}
+
+    def ts(epoch, f=fmt):
+        return datetime.fromtimestamp(epoch, timezone.utc).strftime(f)
+
+    def next_id(table):
+        return conn.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}').fetchone()[0]
+
+    # --- Users (one shared hash: scrypt per row would take hours) ---
+    pw_hash = generate_password_hash('seedpass123')
+    first_user = next_id('users')
+    user_ids = list(range(first_user, first_user + users))
+    conn.executemany(
+        'INSERT INTO users (id, email, password_hash, display_name, role, age_verified, created_at) '
+        "VALUES (?, ?, ?, ?, 'buyer', 1, ?)",
+        ((uid, f'user{uid}@seed.test', pw_hash, f'Collector{uid}',
+          ts(now_ts - rng.randint(0, 365 * 86400))) for uid in user_ids)
+    )
+    counts['users'] = users
+
+    # --- Muses ---
+    first_muse = next_id('muse_profiles')
+    muse_ids = list(range(first_muse, first_muse + muses))
+    conn.executemany(
+        "INSERT INTO muse_profiles (id, display_name, bio, verification) VALUES (?, ?, ?, 'verified')",
+        ((mid, f'Muse_{mid}', 'Synthetic muse profile.') for mid in muse_ids)
+    )
+    counts['muses'] = muses
+
+    # --- Auctions across every status ---
+    first_auction = next_id('auctions')
+    images = ['girls (1).jpg', 'girls (2).jpg', 'girls (3).jpg', 'girls (4).jpg']
+    categories = ['panties', 'thong', 'set', 'custom']
+    statuses = rng.choices(SCALE_STATUS_MIX, weights=[s[1] for s in SCALE_STATUS_MIX], k=auctions)
+    auction_rows = []
+    meta = {}  # auction_id -> (status, payment_status, start_ts, end_ts, starting_bid, muse_id)
+    for i, (status, _, pay_status) in enumerate(statuses):
+        aid = first_auction + i
+        if status in ('draft', 'live'):
+            start_ts = now_ts - rng.randint(0, 3 * 86400)
+            end_ts = now_ts + rng.randint(600, 7 * 86400)
+        else:
+            end_ts = now_ts - rng.randint(3600, 180 * 86400)
+            start_ts = end_ts - rng.randint(86400, 7 * 86400)
+        starting = float(rng.randrange(20, 300, 5))
+        muse_id = rng.choice(muse_ids)
+        meta[aid] = (status, pay_status, start_ts, end_ts, starting, muse_id)
+        auction_rows.append((aid, muse_id, f'Lot #{aid}', 'Synthetic auction item.', rng.choice(categories),
+                             '1 day', rng.choice(images), starting, starting, status,
+                             ts(start_ts), ts(end_ts), ts(end_ts), ts(start_ts)))
+    conn.executemany('''
+        INSERT INTO auctions (id, muse_id, title, description, category, wear_duration, image,
+                              starting_bid, current_bid, status, starts_at, ends_at, original_end,
+                              created_at, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', auction_rows)
+    counts['auctions'] = auctions
+
+    # --- Bids: power-law over auctions and over bidders ---
+    biddable = [aid for aid, m in meta.items() if m[0] != 'draft']
+    per_auction = dict.fromkeys(biddable, 0)
+    if biddable and bids:
+        auction_weights = [rng.paretovariate(1.2) for _ in biddable]
+        for aid in rng.choices(biddable, weights=auction_weights, k=bids):
+            per_auction[aid] += 1
+    bidder_cum, total = [], 0.0
+    for _ in user_ids:
+        total += rng.paretovariate(1.5)
+        bidder_cum.append(total)
+
+    outcome = {}  # auction_id -> (final amount, winner, bid_count)
+
+    def bid_rows():
+        for aid, n in per_auction.items():
+            if not n:
+                continue
+            _, _, start_ts, end_ts, amount, _ = meta[aid]
+            end_ts = min(end_ts, now_ts)
+            bidders = rng.choices(user_ids, cum_weights=bidder_cum, k=n)
+            times = sorted(rng.randint(start_ts, max(start_ts, end_ts)) for _ in range(n))
+            for k, (uid, t) in enumerate(zip(bidders, times)):
+                amount += MIN_BID_INCREMENT * rng.randint(1, 4)
+                yield aid, uid, amount, ts(t, bid_fmt), 1 if k == n - 1 else 0
+            outcome[aid] = (amount, bidders[-1], n)
+
+    conn.executemany(
+        'INSERT INTO bids (auction_id, user_id, amount, placed_at, is_winning) VALUES (?, ?, ?, ?, ?)',
+        bid_rows()
+    )
+    conn.executemany(
+        'UPDATE auctions SET current_bid = ?, current_bidder_id = ?, bid_count = ? WHERE id = ?',
+        ((amount, winner, n, aid) for aid, (amount, winner, n) in outcome.items())
+    )
+    counts['bids'] = bids
+
+    # --- Payments, shipments, notifications and audit trail for sold auctions ---
+    first_payment = next_id('payments')
+    payment_rows, shipment_rows, notif_rows, audit_rows = [], [], [], []
+    sales = collections.Counter()
+    pid = first_payment
+    countries = list(SHIPPING_RATES) + ['TH', 'SG']
+    for aid, (amount, winner, _) in outcome.items():
+        status, pay_status, _, end_ts, _, muse_id = meta[aid]
+        if not pay_status:
+            continue
+        token = f'seed-{aid}-{rng.getrandbits(64):016x}'
+        created = ts(end_ts)
+        paid_at = ts(end_ts + rng.randint(600, 2 * 86400)) if pay_status in ('paid', 'shipped', 'completed') else None
+        processor = 'crypto' if pay_status == 'pending' or rng.random() < 0.3 else f'card-{rng.randint(1000, 9999)}'
+        payment_rows.append((pid, aid, winner, amount, processor if pay_status != 'awaiting_payment' else None,
+                             f'CCB-{rng.getrandbits(24):06X}' if paid_at else None,
+                             pay_status, token, created, paid_at, ts(end_ts + PAYMENT_WINDOW_HOURS * 3600)))
+        link = f'/pay/{token}'
+        notif_rows.append((winner, 'auction_won', 'You won an auction!', f'You won "Lot #{aid}" for ${amount:.2f}.',
+                           link, 1, created, pid, aid))
+
+        if pay_status != 'awaiting_payment':
+            country = rng.choice(countries)
+            ship_status = {'pending': 'awaiting_payment', 'paid': 'preparing',
+                           'shipped': 'shipped', 'completed': 'delivered'}[pay_status]
+            shipped_at = ts(end_ts + 3 * 86400) if pay_status in ('shipped', 'completed') else None
+            delivered_at = ts(end_ts + 10 * 86400) if pay_status == 'completed' else None
+            shipment_rows.append((pid, f'DHL-{rng.getrandbits(32):08X}' if shipped_at else None,
+                                  f'Collector{winner}, 1 Synthetic St, City, {country}', ship_status,
+                                  shipped_at, delivered_at, SHIPPING_RATES.get(country, SHIPPING_RATES['DEFAULT']),
+                                  f'Collector{winner}', '1 Synthetic St', 'City', '10000', country))
+            if paid_at:
+                notif_rows.append((winner, 'payment_confirmed', 'Payment Confirmed!',
+                                   'Your payment has been confirmed.', link, 1, paid_at, pid, aid))
+                audit_rows.append(('order', pid, 'marked_paid', None, 1, paid_at))
+            if shipped_at:
+                notif_rows.append((winner, 'order_shipped', 'Your Order Has Shipped!',
+                                   'Check your dashboard for updates.', link, 1, shipped_at, pid, aid))
+                audit_rows.append(('order', pid, 'shipped', None, 1, shipped_at))
+            if delivered_at:
+                notif_rows.append((winner, 'order_delivered', 'Order Delivered!',
+                                   'Your order has been delivered.', '/dashboard', 0, delivered_at, pid, aid))
+                audit_rows.append(('order', pid, 'delivered', '{}', 1, delivered_at))
+                sales[muse_id] += 1
+        pid += 1
+
+    conn.executemany('''
+        INSERT INTO payments (id, auction_id, buyer_id, amount, processor, processor_txn,
+                              status, payment_token, created_at, completed_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', payment_rows)
+    conn.executemany('''
+        INSERT INTO shipments (payment_id, tracking_number, destination, status,
+                               shipped_at, delivered_at, shipping_cost,
+                               full_name, address_line1, city, postal_code, country)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', shipment_rows)
+    conn.executemany('''
+        INSERT INTO notifications (user_id, type, title, message, link, is_read, created_at, payment_id, auction_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', notif_rows)
+    conn.executemany('''
+        INSERT INTO audit_log (entity_type, entity_id, action, details, admin_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', audit_rows)
+    conn.executemany('UPDATE muse_profiles SET total_sales = total_sales + ? WHERE id = ?',
+                     ((n, mid) for mid, n in sales.items()))
+    counts.update(payments=len(payment_rows), shipments=len(shipment_rows),
+                  notifications=len(notif_rows), audit_log=len(audit_rows))
+
+    if is_postgres(conn):
+        # Rows went in with explicit ids; move the identity sequences past them
+        for table in ('users', 'muse_profiles', 'auctions', 'payments'):
+            conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    conn.commit()
+    return counts
+
+
+@bp.cli.command('seed-scale')
+@click.option('--users', default=10000, show_default=True, help='Buyer accounts to create.')
+@click.option('--muses', default=200, show_default=True, help='Muse profiles to create.')
+@click.option('--auctions', default=20000, show_default=True, help='Auctions to create (all statuses).')
+@click.option('--bids', default=1000000, show_default=True, help='Bids to create (power-law distributed).')
+@click.option('--seed', default=1, show_default=True, help='RNG seed; same seed = same dataset.')
+def seed_scale_command(users, muses, auctions, bids, seed):
+    """Generate a large synthetic dataset for performance work (never run in production)."""
+    started = time.perf_counter()
+    conn = get_db()
+    counts = seed_scale(conn, users=users, muses=muses, auctions=auctions, bids=bids, seed=seed)
+    conn.close()
+    summary = ', '.join(f'{v} {k}' for k, v in counts.items())
+    click.echo(f'Seeded {summary} in {time.perf_counter() - started:.1f}s into {current_app.config["DATABASE"]}.')
+    click.echo('All synthetic users share the password "seedpass123".')
+
+
 # =============================================
 # INIT & RUN
 # =============================================
 
-init_db()
+def create_app(config=None):
+    """Application factory.
+
+    Under `gunicorn --preload` this runs once in the master: the schema check
+    and template/blueprint setup happen before fork, and workers inherit the
+    ready app copy-on-write (see gunicorn.conf.py)."""
+    app = Flask(__name__, static_folder='Static')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+
+    # Database + uploads are per-instance so tests/benchmarks never touch the dev data.
+    # PANTIESFAN_DB may be a file path, a sqlite "file:" URI, "memory" for a
+    # shared-cache in-memory database, or a postgresql:// URL.
+    app.config['DATABASE'] = os.environ.get('PANTIESFAN_DB', DB_NAME)
+    app.config['UPLOAD_FOLDER'] = os.environ.get('PANTIESFAN_UPLOADS', UPLOAD_FOLDER)
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    app.config['STORAGE_PROFILE'] = os.environ.get('PANTIESFAN_STORAGE_PROFILE', DEFAULT_STORAGE_PROFILE)
+    app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('PANTIESFAN_DB_POOL', DEFAULT_POOL_SIZE))
+
+    # Outbound email (sent only by the job worker). Leave MAIL_SERVER unset to disable.
+    app.config['SITE_URL'] = os.environ.get('SITE_URL', 'https://pantiesfan.com')
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', '')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'PantiesFan <noreply@pantiesfan.com>')
+    if config:
+        app.config.update(config)
+    app.config.setdefault('MAIL_ENABLED', bool(app.config['MAIL_SERVER']))
+    if app.config['STORAGE_PROFILE'] not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown STORAGE_PROFILE {app.config['STORAGE_PROFILE']!r}; "
+                         f"choose from {', '.join(STORAGE_PROFILES)}")
+    if app.config['DATABASE'] == 'memory':
+        app.config['DATABASE'] = memory_database_uri(f'panties_fan_{os.getpid()}_{id(app)}')
+    # Cold history (see archive_history); defaults to a file next to the database
+    app.config.setdefault('ARCHIVE_DATABASE', os.environ.get('PANTIESFAN_ARCHIVE_DB')
+                          or archive_path_for(app.config['DATABASE']))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', int(os.environ.get('PANTIESFAN_ARCHIVE_DAYS', 90)))
+    # Online snapshots (see backup_database); defaults to backups/ next to the database
+    app.config.setdefault('BACKUP_DIR', os.environ.get('PANTIESFAN_BACKUP_DIR')
+                          or os.path.join(os.path.dirname(os.path.abspath(app.config['DATABASE'].partition('?')[0])), 'backups'))
+
+    app.before_request(apply_upload_limit)  # must run before CSRFProtect reads the form
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    mail.init_app(app)
+    app.register_blueprint(bp)
+
+    if is_postgres_url(app.config['DATABASE']):
+        init_postgres(app.config['DATABASE'])
+    else:
+        init_db(app.config['DATABASE'], app.config['STORAGE_PROFILE'])
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
+    # Dev server: run the job worker in-process so auctions settle without a second terminal
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Thread(target=run_worker, args=(app, 'dev'), kwargs={'install_signals': False},
+                         daemon=True).start()
     app.run(host='0.0.0.0', port=8005, debug=True)
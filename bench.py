@@ -0,0 +1,591 @@
+"""Load-generation benchmark for PantiesFan auction traffic.
+
+Seeds a throwaway database, then drives a weighted mix of realistic traffic
+against the app in-process (Flask test client, one client per virtual user):
+
+    browse    — anonymous landing page + muse profile views
+    poll      — logged-in buyers polling /api/notifications/count
+    bid_storm — last-minute bidding war on a single hot auction
+    proxy_war — the same war fought with hidden maximum bids (one request per raise)
+    checkout  — winner pays: payment page -> confirm -> checkout -> card
+    admin     — admin dashboard + order management pages
+
+Reports throughput and p50/p95/p99 latency per endpoint. Results can be saved
+as JSON and compared against the committed baseline (bench_baseline.json) so
+performance regressions show up in review.
+
+Usage:
+    python bench.py                                  # default mix, 20s
+    python bench.py --duration 60 --workers 16
+    python bench.py --mix bid_storm=80,poll=20
+    python bench.py --mix proxy_war=80,poll=20      # compare bids written vs bid_storm
+    python bench.py --save bench_baseline.json       # refresh the baseline
+    python bench.py --compare bench_baseline.json    # exit 1 on regression
+    python bench.py --profile server                 # run under another STORAGE_PROFILE
+    python bench.py --database postgresql://localhost/pf_bench   # against PostgreSQL (empty database)
+    python bench.py --profiles safe,pi,server --workdir /mnt/sd --repeat 3 --save bench_profiles.json
+                                                     # bid throughput + listing latency per profile
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import sqlite3
+import statistics
+import tempfile
+import subprocess
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = 'browse=50,poll=30,bid_storm=10,checkout=5,admin=5'
+PROFILE_MIX = 'bid_storm=50,browse=40,poll=10'  # --profiles: writes vs listing reads
+BUYER_PASSWORD = 'benchpass123'
+MIN_SAMPLES = 20  # endpoints with fewer samples are reported but never flagged as regressions
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description='PantiesFan load benchmark')
+    p.add_argument('--duration', type=float, default=20, help='seconds of load per run (default 20)')
+    p.add_argument('--workers', type=int, default=8, help='concurrent virtual users (default 8)')
+    p.add_argument('--mix', default=None,
+                   help=f'scenario weights (default "{DEFAULT_MIX}", or "{PROFILE_MIX}" with --profiles)')
+    p.add_argument('--users', type=int, default=200, help='buyer accounts to seed')
+    p.add_argument('--muses', type=int, default=20, help='muse profiles to seed')
+    p.add_argument('--auctions', type=int, default=200, help='live auctions to seed')
+    p.add_argument('--ended', type=int, default=100, help='ended auctions awaiting payment to seed')
+    p.add_argument('--bids', type=int, default=5000, help='historical bids to seed')
+    p.add_argument('--seed', type=int, default=42, help='RNG seed for the dataset and traffic')
+    p.add_argument('--save', metavar='PATH', help='write results as JSON')
+    p.add_argument('--compare', metavar='PATH', help='compare against a saved baseline')
+    p.add_argument('--tolerance', type=float, default=0.25,
+                   help='allowed p95 slowdown vs baseline before failing (default 0.25 = 25%%)')
+    p.add_argument('--keep-db', action='store_true', help='keep the temporary database directory')
+    p.add_argument('--workdir', metavar='DIR',
+                   help='create the scratch database under DIR, e.g. on the SD card (default: system temp)')
+    p.add_argument('--profile', help='STORAGE_PROFILE for the app (default: the app default)')
+    p.add_argument('--database', metavar='URL',
+                   help='run against this database instead of a scratch SQLite file, e.g. an empty '
+                        'postgresql:// database (it is seeded, and left behind)')
+    p.add_argument('--profiles', metavar='A,B,...',
+                   help='run once per storage profile, each on a fresh database, and compare them')
+    p.add_argument('--repeat', type=int, default=1,
+                   help='with --profiles: runs per profile, interleaved; reports the median and spread')
+    p.add_argument('--rate-limit', action='store_true',
+                   help='keep the bid rate limiter on (off by default: virtual users bid far faster than people)')
+    return p.parse_args(argv)
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario "{name}". Choose from: {", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# =============================================
+# DATASET
+# =============================================
+
+def seed_dataset(conn, args, rng):
+    """Bulk-insert a benchmark dataset on top of the app's default seed data.
+    Returns the ids the traffic generator needs (buyers, hot auction, payments)."""
+    from werkzeug.security import generate_password_hash
+
+    now = datetime.now(timezone.utc)
+    fmt = '%Y-%m-%dT%H:%M:%SZ'
+    now_str = now.strftime(fmt)
+    # One hash shared by every bench buyer — hashing per user would dominate seeding
+    pw_hash = generate_password_hash(BUYER_PASSWORD)
+
+    first_user = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+    conn.executemany(
+        'INSERT INTO users (email, password_hash, display_name, role, age_verified, created_at) '
+        'VALUES (?, ?, ?, ?, 1, ?)',
+        [(f'bench{i}@bench.test', pw_hash, f'Bencher{i}', 'buyer', now_str) for i in range(args.users)]
+    )
+    buyer_ids = list(range(first_user, first_user + args.users))
+
+    first_muse = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM muse_profiles').fetchone()[0]
+    conn.executemany(
+        "INSERT INTO muse_profiles (display_name, bio, verification) VALUES (?, ?, 'verified')",
+        [(f'BenchMuse_{i}', 'Benchmark muse.') for i in range(args.muses)]
+    )
+    muse_ids = list(range(first_muse, first_muse + args.muses))
+
+    # Live auctions (ending 1-72h from now)
+    images = ['girls (1).jpg', 'girls (2).jpg', 'girls (3).jpg', 'girls (4).jpg']
+    first_auction = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM auctions').fetchone()[0]
+    rows = []
+    for i in range(args.auctions):
+        start = float(rng.randint(20, 300))
+        ends = (now + timedelta(minutes=rng.randint(60, 72 * 60))).strftime(fmt)
+        rows.append((rng.choice(muse_ids), f'Bench Lot #{i}', 'Benchmark item.', 'panties', '1 day',
+                     rng.choice(images), start, start, 'live', now_str, ends, ends))
+    conn.executemany('''
+        INSERT INTO auctions (muse_id, title, description, category, wear_duration, image,
+                              starting_bid, current_bid, status, starts_at, ends_at, original_end, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', rows)
+    live_ids = list(range(first_auction, first_auction + args.auctions))
+
+    # Historical bids: a few auctions attract most of the action
+    state = {aid: [conn.execute('SELECT current_bid FROM auctions WHERE id = ?', (aid,)).fetchone()[0], None, 0]
+             for aid in live_ids}
+    bid_rows = []
+    weights = [1.0 / (rank + 1) for rank in range(len(live_ids))]
+    for aid in rng.choices(live_ids, weights=weights, k=args.bids):
+        price, _, count = state[aid]
+        uid = rng.choice(buyer_ids)
+        price += 5 + rng.randint(0, 3) * 5
+        placed = (now - timedelta(seconds=rng.randint(0, 86400))).strftime('%Y-%m-%d %H:%M:%S')
+        bid_rows.append((aid, uid, price, placed))
+        state[aid] = [price, uid, count + 1]
+    conn.executemany('INSERT INTO bids (auction_id, user_id, amount, placed_at) VALUES (?, ?, ?, ?)', bid_rows)
+    conn.executemany('UPDATE auctions SET current_bid = ?, current_bidder_id = ?, bid_count = ? WHERE id = ?',
+                     [(p, u, c, aid) for aid, (p, u, c) in state.items() if c])
+
+    # Hot auction for the bid storm: inside the sniper window
+    hot_id = live_ids[0]
+    hot_end = (now + timedelta(minutes=3)).strftime(fmt)
+    conn.execute('UPDATE auctions SET ends_at = ? WHERE id = ?', (hot_end, hot_id))
+    hot_price = state[hot_id][0]
+
+    # Ended auctions with an awaiting_payment order, owned by the first buyers
+    payments = defaultdict(list)
+    first_ended = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM auctions').fetchone()[0]
+    ended_rows, pay_rows = [], []
+    past = (now - timedelta(hours=1)).strftime(fmt)
+    payers = buyer_ids[:max(1, min(len(buyer_ids), args.workers * 2))]
+    for i in range(args.ended):
+        aid = first_ended + i
+        uid = payers[i % len(payers)]
+        price = float(rng.randint(60, 400))
+        token = f'bench-{i}-{rng.getrandbits(48):x}'
+        ended_rows.append((rng.choice(muse_ids), f'Bench Sold #{i}', 'Benchmark sold item.', 'set', '2 days',
+                           rng.choice(images), price, price, uid, 'ended', past, past, past))
+        pay_rows.append((aid, uid, price, token, now_str, (now + timedelta(hours=48)).strftime(fmt)))
+        payments[uid].append(token)
+    conn.executemany('''
+        INSERT INTO auctions (muse_id, title, description, category, wear_duration, image,
+                              starting_bid, current_bid, current_bidder_id, status, starts_at, ends_at,
+                              original_end, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ''', ended_rows)
+    conn.executemany('''
+        INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+        VALUES (?, ?, ?, 'awaiting_payment', ?, ?, ?)
+    ''', pay_rows)
+    conn.executemany('''
+        INSERT INTO shipping_addresses (user_id, full_name, address_line1, city, postal_code, country)
+        VALUES (?, ?, '1 Bench Road', 'Bangkok', '10110', ?)
+    ''', [(uid, f'Bencher {uid}', rng.choice(['US', 'GB', 'DE', 'JP', 'TH'])) for uid in payers])
+
+    # A little unread notification backlog for pollers
+    conn.executemany('''
+        INSERT INTO notifications (user_id, type, title, message, created_at)
+        VALUES (?, 'outbid', 'You were outbid', 'Someone outbid you.', ?)
+    ''', [(rng.choice(buyer_ids), now_str) for _ in range(args.users * 3)])
+
+    conn.commit()
+    return {'buyers': buyer_ids, 'muses': muse_ids, 'live': live_ids, 'hot': hot_id, 'hot_price': hot_price,
+            'payments': payments}
+
+
+# =============================================
+# TRAFFIC
+# =============================================
+
+class Recorder:
+    """Thread-safe latency sink keyed by endpoint label."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.status = defaultdict(lambda: defaultdict(int))
+
+    def timed(self, label, fn):
+        start = time.perf_counter()
+        try:
+            resp = fn()
+            code = resp.status_code
+        except Exception:
+            resp, code = None, 599
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.samples[label].append(elapsed)
+            self.status[label][code // 100] += 1
+        return resp
+
+
+class VirtualUser:
+    def __init__(self, app, buyer_id, data, rec, rng, hot):
+        self.app = app
+        self.buyer_id = buyer_id
+        self.data = data
+        self.rec = rec
+        self.rng = rng
+        self.hot = hot
+        self.anon = app.test_client()
+        self.buyer = app.test_client()
+        self.buyer.post('/auth/login', data={'email': f'bench{buyer_id - data["buyers"][0]}@bench.test',
+                                             'password': BUYER_PASSWORD})
+        self._admin = None
+        self.tokens = list(data['payments'].get(buyer_id, []))
+
+    @property
+    def admin(self):
+        if self._admin is None:
+            self._admin = self.app.test_client()
+            self._admin.post('/auth/login', data={'email': 'admin@pantiesfan.com', 'password': 'admin123'})
+        return self._admin
+
+    def browse(self):
+        self.rec.timed('GET /', lambda: self.anon.get('/'))
+        muse = self.rng.choice(self.data['muses'])
+        self.rec.timed('GET /muse/<id>', lambda: self.anon.get(f'/muse/{muse}'))
+
+    def poll(self):
+        self.rec.timed('GET /api/notifications/count', lambda: self.buyer.get('/api/notifications/count'))
+
+    def bid_storm(self):
+        with self.hot['lock']:
+            amount = self.hot['min_next'] + self.rng.choice([0, 0, 5])
+        resp = self.rec.timed('POST /api/bid/<id>', lambda: self.buyer.post(
+            f'/api/bid/{self.hot["id"]}', json={'amount': amount}))
+        if resp is not None and resp.status_code == 200:
+            nxt = float(resp.get_json()['min_next_bid'])
+            with self.hot['lock']:
+                self.hot['min_next'] = max(self.hot['min_next'], nxt)
+        elif resp is not None and resp.status_code == 400:
+            # Outbid by a concurrent bidder — catch up like a real user would
+            with self.hot['lock']:
+                self.hot['min_next'] += 5
+
+    def proxy_war(self):
+        with self.hot['lock']:
+            ceiling = self.hot['min_next'] + self.rng.choice([5, 25, 100])
+        resp = self.rec.timed('POST /api/bid/<id> (max)', lambda: self.buyer.post(
+            f'/api/bid/{self.hot["id"]}', json={'max_amount': ceiling}))
+        if resp is not None and resp.status_code == 200:
+            nxt = float(resp.get_json()['min_next_bid'])
+            with self.hot['lock']:
+                self.hot['min_next'] = max(self.hot['min_next'], nxt)
+        elif resp is not None and resp.status_code == 400:
+            with self.hot['lock']:
+                self.hot['min_next'] += 5
+
+    def checkout(self):
+        if not self.tokens:
+            # Nothing left to pay for — the winner re-checks an order instead
+            token = next(iter(self.data['payments'].get(self.buyer_id, [])), None)
+            if token:
+                self.rec.timed('GET /pay/<token>', lambda: self.buyer.get(f'/pay/{token}'))
+            else:
+                self.poll()
+            return
+        token = self.tokens.pop()
+        self.rec.timed('GET /pay/<token>', lambda: self.buyer.get(f'/pay/{token}'))
+        self.rec.timed('POST /pay/<token>/confirm', lambda: self.buyer.post(
+            f'/pay/{token}/confirm', data={'method': 'card'}))
+        self.rec.timed('GET /pay/<token>/checkout', lambda: self.buyer.get(f'/pay/{token}/checkout'))
+        self.rec.timed('POST /pay/<token>/process-card', lambda: self.buyer.post(
+            f'/pay/{token}/process-card', json={'card_number': '4242424242424242', 'card_name': 'Bench User',
+                                                'card_expiry': '12/30', 'card_cvv': '123'}))
+
+    def admin_pages(self):
+        self.rec.timed('GET /admin', lambda: self.admin.get('/admin'))
+        self.rec.timed('GET /admin/orders', lambda: self.admin.get('/admin/orders'))
+
+
+SCENARIOS = {
+    'browse': VirtualUser.browse,
+    'poll': VirtualUser.poll,
+    'bid_storm': VirtualUser.bid_storm,
+    'proxy_war': VirtualUser.proxy_war,
+    'checkout': VirtualUser.checkout,
+    'admin': VirtualUser.admin_pages,
+}
+
+
+def run_load(app, data, args, mix):
+    rec = Recorder()
+    hot = {'id': data['hot'], 'min_next': data['hot_price'] + 5, 'lock': threading.Lock()}
+
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    payers = sorted(data['payments'])
+    users = []
+    for i in range(args.workers):
+        buyer_id = payers[i % len(payers)] if i < len(payers) else data['buyers'][i]
+        users.append(VirtualUser(app, buyer_id, data, rec, random.Random(args.seed + i), hot))
+
+    deadline = time.perf_counter() + args.duration
+
+    def worker(vu):
+        while time.perf_counter() < deadline:
+            SCENARIOS[vu.rng.choices(names, weights=weights)[0]](vu)
+
+    threads = [threading.Thread(target=worker, args=(vu,)) for vu in users]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return rec, time.perf_counter() - started
+
+
+# =============================================
+# REPORTING
+# =============================================
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    k = max(0, min(len(sorted_samples) - 1, int(round(pct / 100.0 * len(sorted_samples))) - 1))
+    return sorted_samples[k]
+
+
+def summarize(rec, elapsed):
+    endpoints = {}
+    for label, samples in sorted(rec.samples.items()):
+        s = sorted(samples)
+        codes = rec.status[label]
+        endpoints[label] = {
+            'count': len(s),
+            'rps': round(len(s) / elapsed, 2),
+            'p50_ms': round(percentile(s, 50), 2),
+            'p95_ms': round(percentile(s, 95), 2),
+            'p99_ms': round(percentile(s, 99), 2),
+            'client_errors': codes.get(4, 0),
+            'server_errors': codes.get(5, 0),
+        }
+    total = sum(e['count'] for e in endpoints.values())
+    return {'elapsed_s': round(elapsed, 2), 'total_requests': total,
+            'total_rps': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+def print_report(summary):
+    print(f"\n{'Endpoint':<34}{'n':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'4xx':>6}{'5xx':>6}")
+    print('-' * 89)
+    for label, e in summary['endpoints'].items():
+        print(f"{label:<34}{e['count']:>7}{e['rps']:>9.1f}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+              f"{e['p99_ms']:>9.1f}{e['client_errors']:>6}{e['server_errors']:>6}")
+    print('-' * 89)
+    print(f"{'TOTAL':<34}{summary['total_requests']:>7}{summary['total_rps']:>9.1f}"
+          f"   (latencies in ms, {summary['elapsed_s']}s)")
+
+
+def compare(summary, baseline_path, tolerance):
+    """Print per-endpoint p95 deltas vs baseline. Returns the list of regressed endpoints."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nComparison vs {baseline_path} (p95, tolerance {tolerance:.0%})")
+    print('-' * 70)
+    for label, e in summary['endpoints'].items():
+        base = baseline['endpoints'].get(label)
+        if not base or not base['p95_ms']:
+            print(f"  {label:<34} new endpoint")
+            continue
+        delta = e['p95_ms'] / base['p95_ms'] - 1
+        enough = min(e['count'], base['count']) >= MIN_SAMPLES
+        regressed = enough and delta > tolerance
+        flag = 'REGRESSION' if regressed else ('faster' if delta < -tolerance else 'ok')
+        if not enough:
+            flag += ' (few samples)'
+        print(f"  {label:<34}{base['p95_ms']:>9.1f} -> {e['p95_ms']:>8.1f}  {delta:>+7.0%}  {flag}")
+        if regressed:
+            regressions.append(label)
+    return regressions
+
+
+def probe_commits(app_module, n=300):
+    """Latency of n one-row write transactions straight through get_db(), i.e.
+    what the storage profile costs every bid once Flask is out of the way."""
+    conn = app_module.get_db()
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("INSERT INTO maintenance_state (name, state, updated_at) VALUES ('bench', ?, '') "
+                     "ON CONFLICT (name) DO UPDATE SET state = excluded.state", (str(i),))
+        conn.commit()
+        samples.append((time.perf_counter() - start) * 1000)
+    conn.execute("DELETE FROM maintenance_state WHERE name = 'bench'")
+    conn.commit()
+    conn.close()
+    samples.sort()
+    return {'commit_p50_ms': round(percentile(samples, 50), 3), 'commit_p95_ms': round(percentile(samples, 95), 3)}
+
+
+def profile_row(summary):
+    """Bid throughput and listing latency: the two numbers the storage profile trades off."""
+    eps = summary['endpoints']
+    bids = eps.get('POST /api/bid/<id>', {})
+    listing = eps.get('GET /', {})
+    return {'seed_s': summary['seed_s'], **summary['storage'],
+            'bids_per_s': bids.get('rps', 0.0), 'bid_p95_ms': bids.get('p95_ms', 0.0),
+            'listing_p50_ms': listing.get('p50_ms', 0.0), 'listing_p95_ms': listing.get('p95_ms', 0.0),
+            'total_rps': summary['total_rps'], 'server_errors': sum(e['server_errors'] for e in eps.values())}
+
+
+SPREAD_KEYS = ('bids_per_s', 'bid_p95_ms', 'listing_p50_ms', 'total_rps')
+
+
+def summarize_runs(rows):
+    """Median of each metric over repeated runs of one profile, plus the
+    standard deviation of the headline ones (0 for a single run)."""
+    out = {key: round(statistics.median(r[key] for r in rows), 3) for key in rows[0]}
+    out['server_errors'] = sum(r['server_errors'] for r in rows)
+    for key in SPREAD_KEYS:
+        out[f'{key}_stdev'] = round(statistics.stdev(r[key] for r in rows), 3) if len(rows) > 1 else 0.0
+    out['runs'] = len(rows)
+    return out
+
+
+def run_profiles(args):
+    """Run the benchmark --repeat times per storage profile, each run in a fresh
+    process and database, and print them side by side. Runs are interleaved
+    (safe, pi, server, safe, ...) so drift on the machine hits every profile
+    alike. Returns the comparison dict."""
+    runs = defaultdict(list)
+    passthrough = ['--duration', str(args.duration), '--workers', str(args.workers), '--mix', args.mix,
+                   '--users', str(args.users), '--muses', str(args.muses), '--auctions', str(args.auctions),
+                   '--ended', str(args.ended), '--bids', str(args.bids), '--seed', str(args.seed)]
+    if args.workdir:
+        passthrough += ['--workdir', args.workdir]
+    if args.rate_limit:
+        passthrough.append('--rate-limit')
+    for round_no in range(1, args.repeat + 1):
+        for name in args.profiles.split(','):
+            print(f"\n=== profile {name} (run {round_no}/{args.repeat}) ===")
+            fd, out = tempfile.mkstemp(suffix='.json', prefix='pf_profile_')
+            os.close(fd)
+            try:
+                subprocess.run([sys.executable, os.path.abspath(__file__), *passthrough,
+                                '--profile', name, '--save', out], check=True)
+                with open(out) as f:
+                    runs[name].append(profile_row(json.load(f)))
+            finally:
+                os.remove(out)
+    results = {name: summarize_runs(rows) for name, rows in runs.items()}
+
+    print(f"\n{'Profile':<10}{'seed s':>8}{'commit':>9}{'c p95':>8}{'bids/s':>14}{'bid p95':>10}"
+          f"{'list p50':>15}{'list p95':>10}{'req/s':>14}{'5xx':>6}")
+    print('-' * 104)
+    for name, r in results.items():
+        print(f"{name:<10}{r['seed_s']:>8.1f}{r['commit_p50_ms']:>9.3f}{r['commit_p95_ms']:>8.3f}"
+              f"{r['bids_per_s']:>8.1f} ±{r['bids_per_s_stdev']:>4.1f}{r['bid_p95_ms']:>10.1f}"
+              f"{r['listing_p50_ms']:>8.1f} ±{r['listing_p50_ms_stdev']:>5.1f}{r['listing_p95_ms']:>10.1f}"
+              f"{r['total_rps']:>8.1f} ±{r['total_rps_stdev']:>4.1f}{r['server_errors']:>6}")
+    print('-' * 104)
+    print(f'(median of {args.repeat} run(s), ± one standard deviation; latencies in ms; '
+          'commit = one-row write transaction via get_db(); listing = GET /)')
+    return {'profiles': results, 'meta': {
+        'generated_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'args': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'keep_db', 'profile')},
+    }}
+
+
+# =============================================
+# MAIN
+# =============================================
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.mix = args.mix or (PROFILE_MIX if args.profiles else DEFAULT_MIX)
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+
+    if args.repeat < 1:
+        raise SystemExit('--repeat must be at least 1')
+    if args.profiles:
+        comparison = run_profiles(args)
+        if args.save:
+            path = os.path.join(ROOT, args.save) if not os.path.isabs(args.save) else args.save
+            with open(path, 'w') as f:
+                json.dump(comparison, f, indent=2, sort_keys=True)
+                f.write('\n')
+            print(f"\nResults saved to {path}")
+        return 0
+
+    # Point the app at a scratch database so the dev database is never touched
+    workdir = tempfile.mkdtemp(prefix='pf_bench_', dir=args.workdir)
+    os.environ['PANTIESFAN_DB'] = args.database or os.path.join(workdir, 'panties_fan.db')
+    os.environ['PANTIESFAN_UPLOADS'] = os.path.join(workdir, 'uploads')
+    if args.profile:
+        os.environ['PANTIESFAN_STORAGE_PROFILE'] = args.profile
+    sys.path.insert(0, ROOT)
+
+    try:
+        import app as app_module
+        app = app_module.app
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['RATE_LIMIT_ENABLED'] = args.rate_limit
+
+        t0 = time.perf_counter()
+        conn = app_module.get_db()
+        data = seed_dataset(conn, args, rng)
+        conn.close()
+        seed_s = time.perf_counter() - t0
+        print(f"Seeded {args.users} buyers, {args.muses} muses, {args.auctions} live + {args.ended} ended "
+              f"auctions, {args.bids} bids in {seed_s:.1f}s")
+        storage = app_module.storage()
+        print(f"Running mix {mix} with {args.workers} workers for {args.duration:.0f}s "
+              f"({storage.name}" + (f", storage profile {app.config['STORAGE_PROFILE']})..."
+                                    if storage.name == 'sqlite' else ')...'))
+
+        rec, elapsed = run_load(app, data, args, mix)
+        summary = summarize(rec, elapsed)
+        print_report(summary)
+        summary['seed_s'] = round(seed_s, 2)
+        summary['storage'] = probe_commits(app_module)
+        print(f"Write transaction: p50 {summary['storage']['commit_p50_ms']}ms, "
+              f"p95 {summary['storage']['commit_p95_ms']}ms")
+
+        summary['meta'] = {
+            'generated_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'backend': storage.name,
+            'args': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'keep_db')},
+        }
+        if args.save:
+            path = os.path.join(ROOT, args.save) if not os.path.isabs(args.save) else args.save
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+                f.write('\n')
+            print(f"\nResults saved to {path}")
+
+        if args.compare:
+            path = os.path.join(ROOT, args.compare) if not os.path.isabs(args.compare) else args.compare
+            if compare(summary, path, args.tolerance):
+                return 1
+        return 0
+    finally:
+        if args.keep_db:
+            print(f"Database kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
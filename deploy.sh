@@ -75,6 +75,9 @@ tar czf "$LOCAL_ARCHIVE" \
     --exclude='__pycache__' \
     --exclude='*.pyc' \
     --exclude='panties_fan.db' \
+    --exclude='panties_fan-archive.db*' \
+    --exclude='panties_fan.db-*' \
+    --exclude='backups' \
     --exclude='deploy.tar.gz' \
     --exclude='deploy_pantiesfan.tar.gz' \
     --exclude='cookies.txt' \
@@ -92,9 +95,11 @@ tar czf "$LOCAL_ARCHIVE" \
     --exclude='Static/uploads/*' \
     -C "$SCRIPT_DIR" \
     app.py \
+    gunicorn.conf.py \
     requirements.txt \
     .env \
     panties_fan.service \
+    panties_fan_worker.service \
     config.yml \
     CLAUDE.md \
     DEPLOY.md \
@@ -126,10 +131,24 @@ ARCHIVE="/tmp/deploy_pantiesfan.tar.gz"
 echo "[REMOTE] Starting deployment on $(hostname)..."
 
 # --- Backup existing DB if present ---
+# Take a consistent online snapshot (WAL included); a plain cp of a live WAL
+# database can miss committed data. This runs before the new code is
+# extracted, so the installed release may predate `flask backup-db`: check for
+# the command first and fall back to sqlite3's .backup, then to cp.
 if [ -f "${REMOTE_DIR}/panties_fan.db" ]; then
-    BACKUP_NAME="panties_fan_$(date +%Y%m%d_%H%M%S).db"
-    cp "${REMOTE_DIR}/panties_fan.db" "/tmp/${BACKUP_NAME}"
-    echo "[REMOTE] Database backed up to /tmp/${BACKUP_NAME}"
+    if [ -x "${REMOTE_DIR}/venv/bin/flask" ] && \
+       (cd "${REMOTE_DIR}" && venv/bin/flask --app app backup-db --help >/dev/null 2>&1); then
+        (cd "${REMOTE_DIR}" && venv/bin/flask --app app backup-db)
+        echo "[REMOTE] Database snapshot saved under ${REMOTE_DIR}/backups"
+    elif command -v sqlite3 >/dev/null 2>&1; then
+        SNAPSHOT="/tmp/panties_fan_$(date +%Y%m%d_%H%M%S).db"
+        sqlite3 "${REMOTE_DIR}/panties_fan.db" ".backup '${SNAPSHOT}'"
+        echo "[REMOTE] Database snapshot saved to ${SNAPSHOT}"
+    else
+        BACKUP_NAME="panties_fan_$(date +%Y%m%d_%H%M%S).db"
+        cp "${REMOTE_DIR}/panties_fan.db" "/tmp/${BACKUP_NAME}"
+        echo "[REMOTE] Database backed up to /tmp/${BACKUP_NAME}"
+    fi
 fi
 
 # --- Create directory structure ---
@@ -175,12 +194,15 @@ fi
 # --- Install systemd service ---
 echo "[REMOTE] Configuring systemd service..."
 sudo cp "${REMOTE_DIR}/panties_fan.service" /etc/systemd/system/${SERVICE_NAME}.service
+sudo cp "${REMOTE_DIR}/panties_fan_worker.service" /etc/systemd/system/${SERVICE_NAME}_worker.service
 sudo systemctl daemon-reload
 sudo systemctl enable ${SERVICE_NAME}.service
+sudo systemctl enable ${SERVICE_NAME}_worker.service
 
 # --- Restart service ---
 echo "[REMOTE] Restarting service..."
 sudo systemctl restart ${SERVICE_NAME}.service
+sudo systemctl restart ${SERVICE_NAME}_worker.service
 sleep 2
 
 # --- Verify ---
@@ -191,6 +213,12 @@ else
     sudo journalctl -u ${SERVICE_NAME}.service --no-pager -n 20
     exit 1
 fi
+if sudo systemctl is-active --quiet ${SERVICE_NAME}_worker.service; then
+    echo "[REMOTE] ✅ Job worker is RUNNING"
+else
+    echo "[REMOTE] ⚠️  Job worker FAILED to start!"
+    sudo journalctl -u ${SERVICE_NAME}_worker.service --no-pager -n 20
+fi
 
 # --- Test HTTP ---
 HTTP_CODE=$(curl -s -o /dev/null -w "%{http_code}" http://localhost:8005/ 2>/dev/null || echo "000")
@@ -0,0 +1,22 @@
+"""Gunicorn settings for pantiesfan.com (used by panties_fan.service).
+
+preload_app builds the app (create_app + schema check) once in the master.
+Workers are forked from that ready process, so a (re)start doesn't repeat
+the import, Jinja setup or database init per worker.
+"""
+
+import gc
+
+bind = '127.0.0.1:8005'
+workers = 2
+timeout = 120
+accesslog = '-'
+errorlog = '-'
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything imported by the master into the permanent generation so
+    # the workers' garbage collector never writes to (and un-shares) those pages.
+    gc.freeze()
+
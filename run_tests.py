@@ -0,0 +1,62 @@
+"""Run every test_*.py script in parallel, one process per script.
+
+Each script clones its own database from the golden copy (see testdb.py), so
+they don't interfere with each other or with panties_fan.db.
+
+Usage:
+    python run_tests.py                    # all scripts, one per core
+    python run_tests.py test_batch3.py     # just one
+    python run_tests.py --memory           # in-memory database clones
+"""
+
+import os
+import sys
+import glob
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import testdb
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_script(script, env):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, script], cwd=ROOT, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return script, proc.returncode, proc.stdout, time.perf_counter() - start
+
+
+def main(argv):
+    memory = '--memory' in argv
+    scripts = [a for a in argv if not a.startswith('--')] or sorted(
+        os.path.basename(p) for p in glob.glob(os.path.join(ROOT, 'test_*.py')))
+
+    # Build the golden DB once up front instead of racing inside every script
+    testdb.ensure_golden()
+
+    env = dict(os.environ)
+    if memory:
+        env['PANTIESFAN_TEST_DB'] = 'memory'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as pool:
+        results = list(pool.map(lambda s: run_script(s, env), scripts))
+
+    failed = []
+    for script, code, output, elapsed in results:
+        print(f"\n##### {script} ({elapsed:.1f}s) #####")
+        print(output.rstrip())
+        if code != 0:
+            failed.append(script)
+
+    print(f"\n{len(scripts) - len(failed)}/{len(scripts)} scripts passed "
+          f"in {time.perf_counter() - started:.1f}s")
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -6,6 +6,10 @@ import sys
 # Setup
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
+# Fresh private copy of the seeded DB (never touches panties_fan.db)
+import testdb
+testdb.use_fresh_database()
+
 from app import app, get_db
 
 app.config['TESTING'] = True
@@ -193,3 +197,5 @@ if passed == total:
 else:
     print(f"FAILED: {total - passed} tests")
 print(f"{'='*50}\n")
+
+sys.exit(0 if passed == total else 1)
@@ -6,9 +6,9 @@ from datetime import datetime, timedelta, timezone
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-# Remove existing DB for fresh start
-if os.path.exists('panties_fan.db'):
-    os.remove('panties_fan.db')
+# Fresh private copy of the seeded DB (never touches panties_fan.db)
+import testdb
+testdb.use_fresh_database()
 
 from app import app, get_db, create_payment_for_winner, end_expired_auctions
 
@@ -284,7 +284,8 @@ print("\n13. Notifications API")
 
 # Mark all as read first by visiting dashboard, then create a new one
 conn = get_db()
-conn.execute("INSERT INTO notifications (user_id, type, title, message, created_at) VALUES (2, 'test', 'Test', 'Test msg', datetime('now'))")
+conn.execute("INSERT INTO notifications (user_id, type, title, message, created_at) VALUES (2, 'test', 'Test', 'Test msg', ?)",
+             (datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),))
 conn.commit()
 conn.close()
 
@@ -300,8 +301,8 @@ conn = get_db()
 # Create a dummy payment for another user
 conn.execute('''
     INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at)
-    VALUES (2, 1, 100, 'pending', 'other-token-123', datetime('now'))
-''')
+    VALUES (2, 1, 100, 'pending', 'other-token-123', ?)
+''', (datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),))
 conn.commit()
 conn.close()
 
@@ -341,3 +342,5 @@ if passed == total:
 else:
     print(f"FAILED: {total - passed} tests")
 print(f"{'='*50}\n")
+
+sys.exit(0 if passed == total else 1)
@@ -0,0 +1,746 @@
+"""Focused checks for the background subsystems: jobs, bids, limits, orders, exports, archive, caches"""
+
+import os
+import sys
+import json
+import gc
+import time
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Fresh private copy of the seeded DB (never touches panties_fan.db)
+import testdb
+testdb.use_fresh_database()
+
+import app as appmod
+from app import app, get_db
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+client = app.test_client()
+
+def test(name, response, expected_code=200, check_text=None):
+    passed = response.status_code == expected_code
+    if check_text and passed:
+        passed = check_text.encode() in response.data
+    status = "PASS" if passed else "FAIL"
+    detail = f"got {response.status_code}"
+    if check_text and not (check_text.encode() in response.data):
+        detail += f", text '{check_text}' NOT found"
+    print(f"  [{status}] {name} ({detail})")
+    if not passed:
+        snippet = response.data[:300].decode(errors='replace')
+        print(f"         Response snippet: {snippet[:200]}...")
+    return passed
+
+def test_bool(name, condition):
+    status = "PASS" if condition else "FAIL"
+    print(f"  [{status}] {name}")
+    return condition
+
+def now_str(delta=timedelta()):
+    return (datetime.now(timezone.utc) + delta).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+results = []
+
+print("\n=== SUBSYSTEM TESTS ===\n")
+
+client.post('/auth/login', data={'email': 'admin@pantiesfan.com', 'password': 'admin123'})
+
+# --- 1. Job retry ---
+print("1. Job retry")
+
+conn = get_db()
+failed_twin = conn.execute('''
+    INSERT INTO jobs (task, status, attempts, run_at, dedupe_key, last_error, created_at, finished_at)
+    VALUES ('settle_auctions', 'failed', 5, ?, 'settle_auctions', 'boom', ?, ?) RETURNING id
+''', (now_str(), now_str(), now_str())).fetchone()[0]
+appmod.enqueue(conn, 'settle_auctions', dedupe_key='settle_auctions')
+failed_alone = conn.execute('''
+    INSERT INTO jobs (task, status, attempts, run_at, dedupe_key, last_error, created_at, finished_at)
+    VALUES ('prune_jobs', 'failed', 5, ?, 'prune_jobs', 'boom', ?, ?) RETURNING id
+''', (now_str(), now_str(), now_str())).fetchone()[0]
+conn.commit()
+conn.close()
+
+r = client.post(f'/admin/jobs/{failed_twin}/retry', follow_redirects=True)
+results.append(test("Retry with a queued twin doesn't crash", r, 200, "superseded"))
+r = client.post(f'/admin/jobs/{failed_alone}/retry', follow_redirects=True)
+results.append(test("Retry without a twin re-queues", r, 200, "re-queued"))
+conn = get_db()
+statuses = dict(conn.execute('SELECT id, status FROM jobs WHERE id IN (?, ?)', (failed_twin, failed_alone)).fetchall())
+queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND dedupe_key = 'settle_auctions'").fetchone()[0]
+conn.close()
+results.append(test_bool("Failed twin marked superseded", statuses[failed_twin] == 'superseded'))
+results.append(test_bool("Lone failed job queued again", statuses[failed_alone] == 'queued'))
+results.append(test_bool("Still one queued settle_auctions job", queued == 1))
+
+# --- 2. Payment deadlines ---
+print("\n2. Payment deadlines")
+
+from werkzeug.security import generate_password_hash
+conn = get_db()
+buyer_id = conn.execute('''
+    INSERT INTO users (email, password_hash, display_name, role, age_verified, created_at)
+    VALUES ('sub@test.com', ?, 'SubBuyer', 'buyer', 1, ?) RETURNING id
+''', (generate_password_hash('subpass123'), now_str())).fetchone()[0]
+legacy_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at)
+    VALUES (3, ?, 120, 'awaiting_payment', 'legacy-token', ?) RETURNING id
+''', (buyer_id, now_str())).fetchone()[0]
+lapsed_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+    VALUES (4, ?, 90, 'pending', 'lapsed-token', ?, ?) RETURNING id
+''', (buyer_id, now_str(-timedelta(days=3)), now_str(-timedelta(days=1)))).fetchone()[0]
+conn.commit()
+conn.close()
+
+r = client.post(f'/admin/order/{lapsed_id}/edit', data={'status': 'awaiting_payment'}, follow_redirects=True)
+results.append(test("Admin sets a lapsed order back to awaiting payment", r, 200))
+conn = get_db()
+reopened = conn.execute('SELECT status, expires_at FROM payments WHERE id = ?', (lapsed_id,)).fetchone()
+conn.close()
+results.append(test_bool("Reopened order gets a fresh window",
+                         reopened['status'] == 'awaiting_payment' and reopened['expires_at'] > now_str()))
+
+buyer = app.test_client()
+buyer.post('/auth/login', data={'email': 'sub@test.com', 'password': 'subpass123'})
+r = buyer.get('/pay/legacy-token')
+results.append(test("Payment page without a deadline loads", r, 200))
+
+# --- 3. Proxy bidding ---
+print("\n3. Proxy bidding")
+
+conn = get_db()
+conn.execute("UPDATE auctions SET ends_at = ? WHERE status = 'live'", (now_str(timedelta(hours=3)),))
+conn.execute('''
+    INSERT INTO users (email, password_hash, display_name, role, age_verified, created_at)
+    VALUES ('rival@test.com', ?, 'SubRival', 'buyer', 1, ?)
+''', (generate_password_hash('subpass123'), now_str()))
+conn.commit()
+conn.close()
+rival = app.test_client()
+rival.post('/auth/login', data={'email': 'rival@test.com', 'password': 'subpass123'})
+
+def bid(c, auction_id, **body):
+    return c.post(f'/api/bid/{auction_id}', json=body).get_json()
+
+d = bid(buyer, 1, max_amount=300)
+results.append(test_bool("Lone maximum opens at the minimum increment", d['new_price'] == '$150.00' and not d['outbid']))
+d = bid(rival, 1, amount=200)
+results.append(test_bool("Direct bid is answered by the standing maximum",
+                         d['outbid'] and d['bidder'] == 'SubBuyer' and d['new_price'] == '$205.00'))
+d = bid(rival, 1, max_amount=400)
+results.append(test_bool("Higher maximum wins one increment above the other",
+                         d['bidder'] == 'SubRival' and d['new_price'] == '$305.00'))
+d = bid(buyer, 1, max_amount=400)
+results.append(test_bool("Equal maximum: the earlier one keeps the lead",
+                         d['outbid'] and d['bidder'] == 'SubRival' and d['new_price'] == '$400.00'))
+conn = get_db()
+winning = conn.execute('SELECT COUNT(*) FROM bids WHERE auction_id = 1 AND is_winning = 1').fetchone()[0]
+conn.close()
+results.append(test_bool("Exactly one winning bid", winning == 1))
+results.append(test_bool("Maxima war records at most two bids",
+                         len(appmod.resolve_proxy_bids(100, None, [(1, 500), (2, 900), (3, 700)])[2]) <= 2))
+
+# --- 4. Idempotent bids ---
+print("\n4. Idempotency-Key")
+
+def bid_count(auction_id):
+    conn = get_db()
+    n = conn.execute('SELECT COUNT(*) FROM bids WHERE auction_id = ?', (auction_id,)).fetchone()[0]
+    conn.close()
+    return n
+
+before = bid_count(3)
+headers = {'Idempotency-Key': 'sub-key-1'}
+r1 = rival.post('/api/bid/3', json={'amount': 300}, headers=headers)
+r2 = rival.post('/api/bid/3', json={'amount': 300}, headers=headers)
+results.append(test_bool("Retry gets the stored answer back",
+                         r2.status_code == 200 and r2.headers.get('Idempotent-Replayed') == 'true'
+                         and r2.get_data() == r1.get_data()))
+results.append(test_bool("Retry places no second bid", bid_count(3) == before + 1))
+r = rival.post('/api/bid/3', json={'amount': 350}, headers=headers)
+results.append(test("Same key with another body is refused", r, 422))
+r = buyer.post('/api/bid/3', json={'amount': 300}, headers=headers)
+results.append(test_bool("Keys are scoped per user", r.status_code == 400 and bid_count(3) == before + 1))
+
+# --- 5. Bid rate limits ---
+print("\n5. Bid rate limits")
+
+conn = get_db()
+conn.execute('''
+    INSERT INTO users (email, password_hash, display_name, role, age_verified, created_at)
+    VALUES ('hasty@test.com', ?, 'SubHasty', 'buyer', 1, ?), ('calm@test.com', ?, 'SubCalm', 'buyer', 1, ?)
+''', (generate_password_hash('subpass123'), now_str()) * 2)
+conn.commit()
+conn.close()
+hasty, calm = app.test_client(), app.test_client()
+hasty.post('/auth/login', data={'email': 'hasty@test.com', 'password': 'subpass123'})
+calm.post('/auth/login', data={'email': 'calm@test.com', 'password': 'subpass123'})
+burst = appmod.BID_LIMIT_PER_USER[0]
+codes = [hasty.post('/api/bid/2', json={'amount': 1}).status_code for _ in range(burst + 1)]
+results.append(test_bool("Burst of bids is let through", codes[:burst] == [400] * burst))
+r = hasty.post('/api/bid/2', json={'amount': 1})
+results.append(test_bool("Next bid is refused with Retry-After",
+                         codes[burst] == 429 and r.status_code == 429 and int(r.headers['Retry-After']) >= 1))
+r = calm.post('/api/bid/2', json={'amount': 1})
+results.append(test_bool("Other users are not limited", r.status_code == 400))
+
+first = calm.post('/api/bid/2', json={'amount': 1}, headers={'Idempotency-Key': 'calm-1'})
+while calm.post('/api/bid/2', json={'amount': 1}).status_code != 429:
+    pass
+r = calm.post('/api/bid/2', json={'amount': 1}, headers={'Idempotency-Key': 'calm-1'})
+results.append(test_bool("A replay is answered even with the bucket empty",
+                         r.status_code == first.status_code and r.headers.get('Idempotent-Replayed') == 'true'))
+r = calm.post('/api/bid/2', json={'amount': 1}, headers={'Idempotency-Key': 'calm-2'})
+conn = get_db()
+kept = conn.execute("SELECT COUNT(*) FROM idempotency_keys WHERE idem_key = 'calm-2'").fetchone()[0]
+conn.close()
+results.append(test_bool("A rate-limited answer is not stored for replay", r.status_code == 429 and kept == 0))
+
+limiter = appmod.TokenBucketLimiter(slots=16)
+results.append(test_bool("Per-item bucket runs dry for everyone",
+                         [limiter.hit([('item', 'i:1', 2, 0.001)])[1] for _ in range(3)] == [None, None, 'item']))
+pid = os.fork()
+if pid == 0:
+    with limiter._locked():
+        os._exit(0)  # dies holding the lock, like a worker killed mid-request
+os.waitpid(pid, 0)
+import signal
+signal.alarm(5)  # a lock left behind by the dead child would hang here
+results.append(test_bool("A dead holder doesn't block the limiter", limiter.hit([('user', 'u:1', 1, 1)]) == (0, None)))
+signal.alarm(0)
+
+# --- 6. Order transitions ---
+print("\n6. Order transitions")
+
+conn = get_db()
+order_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+    VALUES (2, ?, 150, 'awaiting_payment', 'flow-token', ?, ?) RETURNING id
+''', (buyer_id, now_str(), now_str(timedelta(hours=48)))).fetchone()[0]
+conn.commit()
+
+def refused(action):
+    try:
+        appmod.transition_order(conn, order_id, action)
+    except ValueError:
+        conn.rollback()
+        return True
+    conn.rollback()
+    return False
+
+with app.test_request_context():
+    results.append(test_bool("Can't ship an unpaid order", refused('ship')))
+    before = appmod.transition_order(conn, order_id, 'mark_paid')
+    conn.commit()
+    order = conn.execute('''
+        SELECT p.status, p.completed_at, s.status AS shipment_status, a.status AS auction_status
+        FROM payments p JOIN shipments s ON s.payment_id = p.id JOIN auctions a ON a.id = p.auction_id
+        WHERE p.id = ?
+    ''', (order_id,)).fetchone()
+    results.append(test_bool("Mark paid returns the order as it was", before['status'] == 'awaiting_payment'))
+    results.append(test_bool("Paid order moves shipment and auction along",
+                             (order['status'], order['shipment_status'], order['auction_status']) == ('paid', 'preparing', 'paid')
+                             and order['completed_at'] is not None))
+    results.append(test_bool("Can't deliver before shipping", refused('deliver')))
+    results.append(test_bool("Can't mark a paid order paid again", refused('mark_paid')))
+    appmod.transition_order(conn, order_id, 'ship', shipment={'tracking_number': 'TRK1'})
+    conn.commit()
+    shipment = conn.execute('SELECT status, tracking_number, shipped_at FROM shipments WHERE payment_id = ?',
+                            (order_id,)).fetchone()
+    results.append(test_bool("Ship stamps shipped_at and keeps tracking",
+                             shipment['status'] == 'shipped' and shipment['tracking_number'] == 'TRK1'
+                             and shipment['shipped_at'] is not None))
+    results.append(test_bool("Unknown order is reported as missing",
+                             appmod.transition_order(conn, 999999, 'ship') is None))
+    conn.rollback()
+conn.close()
+
+# --- 7. Bulk order actions ---
+print("\n7. Bulk order actions")
+
+conn = get_db()
+bulk_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+    VALUES (4, ?, 95, 'paid', 'bulk-token', ?, ?) RETURNING id
+''', (buyer_id, now_str(), now_str(timedelta(hours=48)))).fetchone()[0]
+conn.commit()
+conn.close()
+r = client.post('/admin/orders/bulk/ship', data={'shipments': f'{bulk_id},TRK2\n{bulk_id},TRK3\n999999,TRK4'},
+                follow_redirects=True)
+results.append(test("Bulk ship applies a repeated id once", r, 200, "1 order shipped"))
+results.append(test("Repeated id is reported", r, 200, f"#{bulk_id}: Listed more than once"))
+results.append(test("Unknown id is reported", r, 200, "#999999: no such order"))
+conn = get_db()
+tracking = conn.execute('SELECT tracking_number FROM shipments WHERE payment_id = ?', (bulk_id,)).fetchone()[0]
+conn.close()
+results.append(test_bool("First line's tracking number is kept", tracking == 'TRK2'))
+
+# --- 8. Import upload limit ---
+print("\n8. Import upload limit")
+
+import re
+from io import BytesIO
+app.config['WTF_CSRF_ENABLED'] = True
+page = client.get('/admin/auctions/import').get_data(as_text=True)
+token = re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+big = BytesIO(b'\0' * (app.config['MAX_CONTENT_LENGTH'] + 1024 * 1024))
+r = client.post('/admin/auctions/import', data={
+    'csrf_token': token,
+    'manifest': (BytesIO(b'title,muse,starting_bid,duration_hours,image\n'), 'manifest.csv'),
+    'images': (big, 'images.zip'),
+}, content_type='multipart/form-data')
+results.append(test_bool("Drop over MAX_CONTENT_LENGTH reaches the importer with CSRF on", r.status_code == 200))
+r = client.post('/admin/auction/new', data={'csrf_token': token, 'photo': (BytesIO(b'\0' * (app.config['MAX_CONTENT_LENGTH'] + 1)), 'x.jpg')},
+                content_type='multipart/form-data')
+results.append(test("Other forms keep the default cap", r, 413))
+app.config['WTF_CSRF_ENABLED'] = False
+
+# --- 9. Exports ---
+print("\n9. Exports")
+
+import gzip
+conn = get_db()
+appmod.attach_archive(conn)
+total = conn.execute('SELECT COUNT(*) FROM history_bids').fetchone()[0]
+chunks = list(appmod.iter_export(conn, 'bids', chunk=2))
+ids = [row['id'] for rows in chunks for row in rows]
+results.append(test_bool("Keyset chunks cover every row once, in order",
+                         all(len(rows) <= 2 for rows in chunks) and len(ids) == total and ids == sorted(set(ids))))
+conn.executemany("INSERT INTO audit_log (entity_type, entity_id, action, created_at) VALUES ('order', 1, ?, ?)",
+                 [('export-before', '2020-01-01T23:59:59Z'), ('export-in', '2020-01-02T00:00:00Z'),
+                  ('export-in', '2020-01-02 23:59:59'), ('export-after', '2020-01-03T00:00:00Z')])
+conn.commit()
+conn.close()
+r = client.get('/admin/export/audit?format=ndjson&from=2020-01-02&to=2020-01-02')
+lines = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+results.append(test_bool("Date filter keeps whole days, both timestamp styles",
+                         r.status_code == 200 and [l['action'] for l in lines] == ['export-in', 'export-in']))
+conn = get_db()
+total_orders = conn.execute('SELECT COUNT(*) FROM payments').fetchone()[0]
+conn.close()
+r = client.get('/admin/export/orders?gzip=1')
+rows = gzip.decompress(r.get_data()).decode().splitlines()
+results.append(test_bool("Gzipped CSV has the header and every order",
+                         rows[0].startswith('id,auction_id,auction_title') and len(rows) - 1 == total_orders))
+r = client.get('/admin/export/orders?from=2020-13-01')
+results.append(test("Bad date is refused", r, 302))
+
+# --- 10. Cold archive ---
+print("\n10. Cold archive")
+
+conn = get_db()
+if appmod.is_postgres(conn):
+    print("  (skipped: PostgreSQL keeps history in place)")
+else:
+    before_ids = [row['id'] for row in appmod.bid_history_page(conn, 1, limit=100)]
+    conn.execute("UPDATE auctions SET status = 'completed', ends_at = '2020-01-05T00:00:00Z' WHERE id = 1")
+    conn.commit()
+    counts = appmod.archive_history(conn, older_than_days=30)
+    results.append(test_bool("Settled auction and old audit rows are archived",
+                             counts['auctions'] == 1 and counts['bids'] == len(before_ids) > 0
+                             and counts['audit_log'] >= 4))
+    archived_at = conn.execute('SELECT archived_at FROM auctions WHERE id = 1').fetchone()[0]
+    hot = conn.execute('SELECT COUNT(*) FROM main.bids WHERE auction_id = 1').fetchone()[0]
+    cold = [row['id'] for row in appmod.bid_history_page(conn, 1, limit=100, archived=archived_at)]
+    results.append(test_bool("Bids leave the hot database and read back from the archive",
+                             archived_at is not None and hot == 0 and cold == before_ids))
+    api_ids = [b[0] for b in client.get('/api/auction/1/bids').get_json()['bids']]
+    results.append(test_bool("Bid history API reads archived bids", api_ids and api_ids == before_ids[:len(api_ids)]))
+    r = client.get('/admin/export/audit?format=ndjson&from=2020-01-02&to=2020-01-02')
+    results.append(test_bool("Exports still include archived audit rows", r.get_data(as_text=True).count('export-in') == 2))
+    results.append(test_bool("Archiving again moves nothing",
+                             appmod.archive_history(conn, older_than_days=30) == dict.fromkeys(counts, 0)))
+conn.close()
+
+# --- 11. Cross-process cache invalidation ---
+print("\n11. Cache invalidation")
+
+path = app.config['DATABASE']
+loads = []
+def loader(key):
+    loads.append(key)
+    return f'{key}-{len(loads)}'
+
+probe = appmod.LocalCache('probe')
+with app.app_context():
+    appmod.cache_bus.poll(path)
+    first = probe.get('a', loader), probe.get('b', loader)
+    probe.get('a', loader)
+    results.append(test_bool("Second read is served from the cache", loads == ['a', 'b']))
+
+    other = get_db()  # stands in for another worker or the job worker
+    appmod.invalidate(other, 'probe', 'a')
+    other.commit()
+    appmod.cache_bus.poll(path)
+    results.append(test_bool("Only the invalidated key is reloaded",
+                             probe.get('a', loader) != first[0] and probe.get('b', loader) == first[1]))
+    appmod.invalidate(other, 'probe')
+    other.commit()
+    appmod.cache_bus.poll(path)
+    probe.get('b', loader)
+    results.append(test_bool("Invalidating a kind drops all its keys", loads[-1] == 'b' and len(loads) == 4))
+    try:
+        appmod.invalidate(other, 'no-such-kind')
+        unknown_refused = False
+    except ValueError:
+        unknown_refused = True
+    other.rollback()
+    results.append(test_bool("Unknown cache kinds are refused", unknown_refused))
+
+    calm_id = other.execute("SELECT id FROM users WHERE email = 'calm@test.com'").fetchone()[0]
+    results.append(test_bool("User is cached", appmod.User.get_by_id(calm_id).display_name == 'SubCalm'))
+    other.execute("UPDATE users SET display_name = 'SubRenamed' WHERE id = ?", (calm_id,))
+    appmod.invalidate(other, 'user', calm_id)
+    other.commit()
+    other.close()
+r = calm.get('/dashboard')
+results.append(test("Next request sees the committed change", r, 200, "Welcome back, SubRenamed"))
+
+# --- 12. Write health ---
+print("\n12. Write health")
+
+class Interrupted:
+    def execute(self, *args):
+        raise SystemExit(1)
+
+with tempfile.TemporaryDirectory() as tmp:
+    health = appmod.WriteHealth(os.path.join(tmp, 'db-writehealth'))
+    saved = appmod._write_health.get(app.config['DATABASE'])
+    appmod._write_health[app.config['DATABASE']] = health
+    try:
+        with app.app_context():
+            appmod.begin_write(Interrupted())
+    except SystemExit:
+        pass
+    finally:
+        appmod._write_health[app.config['DATABASE']] = saved
+    results.append(test_bool("A writer interrupted mid-wait leaves the queue", health.snapshot()['waiting'] == 0))
+
+    pid = os.fork()
+    if pid == 0:
+        for _ in range(appmod.WRITE_READ_ONLY_QUEUE):
+            appmod.WriteHealth(os.path.join(tmp, 'db-writehealth')).enter()
+        os._exit(0)  # killed while "waiting": no leave()
+    os.waitpid(pid, 0)
+    results.append(test_bool("Waiters of a dead process are not counted",
+                             health.snapshot()['level'] == 'ok'))
+
+    slots = [health.enter() for _ in range(appmod.WRITE_READ_ONLY_QUEUE)]
+    results.append(test_bool("Live waiters are counted", health.snapshot()['level'] == 'read_only'))
+    health.force_read_only(False)
+    results.append(test_bool("The admin switch clears the queue", health.snapshot()['waiting'] == 0))
+
+# --- 13. Trending flush ---
+print("\n13. Trending flush")
+
+class FailingUpsert:
+    """A connection whose auction_trending upsert fails (e.g. a lock timeout)."""
+    def __init__(self, conn):
+        self.conn = conn
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+    def executemany(self, *args):
+        raise appmod.sqlite3.OperationalError('database is locked')
+
+board = appmod.trending_board(app.config['DATABASE'])
+conn = get_db()
+live = conn.execute("SELECT id, current_bid FROM auctions WHERE status = 'live' ORDER BY id LIMIT 1").fetchone()
+conn.close()
+board.pending.clear()
+board.record(live[0], 2, time.time(), now_str(timedelta(hours=3)))
+conn = get_db()
+try:
+    board.flush(FailingUpsert(conn))
+    flush_failed = False
+except appmod.sqlite3.OperationalError:
+    flush_failed = True
+conn.close()
+results.append(test_bool("A failed flush keeps its bids for the next one",
+                         flush_failed and live[0] in board.pending))
+
+board.flushed_at = 0.0  # due now
+d = bid(buyer, live[0], amount=float(live[1]) + 50)
+conn = get_db()
+stored = conn.execute('SELECT score FROM auction_trending WHERE auction_id = ?', (live[0],)).fetchone()
+conn.close()
+results.append(test_bool("A bid flushes the board after it commits",
+                         d['success'] and stored is not None and not board.pending))
+
+def broken_enqueue(*args, **kwargs):
+    raise RuntimeError('queue unavailable')
+
+score_before = board.scores.get(live[0])
+real_enqueue, appmod.enqueue = appmod.enqueue, broken_enqueue
+app.config['RATE_LIMIT_ENABLED'] = False
+try:
+    bid(rival, live[0], amount=float(live[1]) + 100)  # outbid notice fails before the commit
+    rolled_back = False
+except RuntimeError:
+    rolled_back = True
+finally:
+    appmod.enqueue = real_enqueue
+    app.config['RATE_LIMIT_ENABLED'] = True
+gc.collect()  # the failed view's connection, still holding the write lock
+results.append(test_bool("A bid that never commits isn't counted as trending",
+                         rolled_back and board.scores.get(live[0]) == score_before and not board.pending))
+
+# --- 14. Notifications by key ---
+print("\n14. Notification keys")
+
+conn = get_db()
+if appmod.is_postgres(conn):
+    print("  (skipped legacy migration: PostgreSQL schemas start with the keys)")
+else:
+    legacy_path = os.path.join(os.path.dirname(app.config['DATABASE']), 'legacy-notifications.db')
+    legacy = sqlite3.connect(legacy_path)
+    conn.backup(legacy)
+    token, payment_id, auction_id = legacy.execute(
+        'SELECT payment_token, id, auction_id FROM payments WHERE payment_token IS NOT NULL LIMIT 1').fetchone()
+    legacy.executescript('''
+        DROP TABLE notifications;
+        CREATE TABLE notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            message TEXT,
+            link TEXT,
+            is_read INTEGER DEFAULT 0,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        PRAGMA user_version = 0;
+    ''')
+    legacy.execute("INSERT INTO notifications (user_id, type, title, link) VALUES (1, 'won', 'Pay', ?)", (f'/pay/{token}',))
+    legacy.execute("INSERT INTO notifications (user_id, type, title, link) VALUES (1, 'outbid', 'Bid', ?)", (f'/#card-{auction_id}',))
+    legacy.commit()
+    legacy.close()
+    appmod.init_db(legacy_path)
+    legacy = sqlite3.connect(legacy_path)
+    keys = legacy.execute('SELECT title, payment_id, auction_id FROM notifications ORDER BY id').fetchall()
+    legacy.close()
+    results.append(test_bool("Legacy /pay/<token> link is backfilled with its order",
+                             keys[0] == ('Pay', payment_id, auction_id)))
+    results.append(test_bool("Legacy /#card-<id> link is backfilled with its auction",
+                             keys[1] == ('Bid', None, auction_id)))
+
+doomed_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+    VALUES (3, ?, 75, 'awaiting_payment', 'doomed-token', ?, ?) RETURNING id
+''', (buyer_id, now_str(), now_str(timedelta(days=2)))).fetchone()[0]
+appmod.notify(conn, buyer_id, 'won', 'Doomed order', 'Pay up', '/pay/doomed-token', payment_id=doomed_id)
+appmod.notify(conn, buyer_id, 'won', 'Kept order', 'Pay up', '/pay/legacy-token', payment_id=legacy_id)
+conn.commit()
+conn.close()
+r = client.post(f'/admin/order/{doomed_id}/delete', follow_redirects=True)
+conn = get_db()
+left = [row[0] for row in conn.execute(
+    "SELECT title FROM notifications WHERE title IN ('Doomed order', 'Kept order')").fetchall()]
+results.append(test_bool("Deleting an order removes its notifications by payment_id",
+                         r.status_code == 200 and left == ['Kept order']))
+
+for title, is_read, age in (('Old read', 1, 40), ('Old unread', 0, 40), ('Recent read', 1, 1)):
+    appmod.notify(conn, buyer_id, 'info', title, None, created_at=now_str(-timedelta(days=age)))
+    conn.execute('UPDATE notifications SET is_read = ? WHERE title = ?', (is_read, title))
+conn.commit()
+deleted = appmod.prune_notifications(conn)
+left = {row[0] for row in conn.execute(
+    "SELECT title FROM notifications WHERE title IN ('Old read', 'Old unread', 'Recent read')").fetchall()}
+conn.close()
+results.append(test_bool("Pruning drops old read notifications, keeps unread and recent ones",
+                         deleted >= 1 and left == {'Old unread', 'Recent read'}))
+
+# --- 15. Checkpoints and backups ---
+print("\n15. Checkpoints and backups")
+
+conn = get_db()
+if appmod.is_postgres(conn):
+    print("  (skipped: PostgreSQL is backed up with pg_dump)")
+else:
+    with tempfile.TemporaryDirectory() as tmp:
+        first = appmod.backup_database(conn, tmp, keep=1)
+        second = appmod.backup_database(conn, tmp, keep=1)
+        snapshots = os.listdir(tmp)
+        results.append(test_bool("Rotation keeps only the newest snapshot",
+                                 snapshots == [os.path.basename(second['path'])] and first['path'] != second['path']))
+        checks = []
+        for name in sorted(os.listdir(second['path'])):
+            copy = sqlite3.connect(os.path.join(second['path'], name))
+            checks.append(copy.execute('PRAGMA quick_check').fetchone()[0])
+            copy.close()
+        results.append(test_bool("Main and archive copies both pass quick_check", checks == ['ok', 'ok']))
+        report = appmod.maintenance_report(conn)
+        results.append(test_bool("Maintenance report shows the backup",
+                                 report['backup'] and report['backup']['path'] == second['path']
+                                 and report['backup']['age_seconds'] >= 0))
+    result = appmod.checkpoint_wal(conn, truncate=True)
+    results.append(test_bool("Idle database checkpoints with TRUNCATE",
+                             result['mode'] == 'TRUNCATE' and not result['busy'] and result['lag_frames'] == 0))
+conn.close()
+
+# --- 16. Per-user bid summaries ---
+print("\n16. Bid summaries")
+
+def summaries(auction_id):
+    conn = get_db()
+    derived = conn.execute('''
+        SELECT b.user_id, MAX(b.amount), COUNT(*), MAX(b.placed_at),
+               CASE WHEN a.current_bidder_id = b.user_id THEN 1 ELSE 0 END,
+               CASE WHEN a.status = 'live' THEN 1 ELSE 0 END
+        FROM bids b JOIN auctions a ON a.id = b.auction_id
+        WHERE b.auction_id = ?
+        GROUP BY b.user_id, a.current_bidder_id, a.status
+    ''', (auction_id,)).fetchall()
+    stored = conn.execute('''
+        SELECT user_id, max_bid, bid_count, last_bid_at, is_winning, is_live
+        FROM user_auction_state WHERE auction_id = ?
+    ''', (auction_id,)).fetchall()
+    conn.close()
+    norm = lambda rows: sorted((r[0], float(r[1]), r[2], r[3], int(r[4]), int(r[5])) for r in rows)
+    return norm(derived), norm(stored)
+
+conn = get_db()
+contested = conn.execute("SELECT id, current_bid FROM auctions WHERE status = 'live' ORDER BY id DESC LIMIT 1").fetchone()
+conn.close()
+opening = float(contested[1])
+app.config['RATE_LIMIT_ENABLED'] = False  # earlier sections spent these users' tokens
+placed = [bid(buyer, contested[0], amount=opening + 10),
+          bid(rival, contested[0], max_amount=opening + 100),   # takes the lead
+          bid(buyer, contested[0], amount=opening + 50)]         # answered by rival's maximum
+app.config['RATE_LIMIT_ENABLED'] = True
+derived, stored = summaries(contested[0])
+results.append(test_bool("Bids, proxy counter-bids and leader changes keep user_auction_state in step",
+                         all(d['success'] for d in placed) and placed[2]['outbid'] and len(stored) == 2
+                         and stored == derived))
+conn = get_db()
+conn.execute("UPDATE auctions SET status = 'completed' WHERE id = ?", (contested[0],))
+conn.commit()
+conn.close()
+derived, stored = summaries(contested[0])
+results.append(test_bool("Ending the auction clears is_live", stored == derived and not any(r[5] for r in stored)))
+
+# --- 17. Email batches ---
+print("\n17. Email batches")
+
+def queue_outbox(conn, user_id, digest, n):
+    conn.executemany('''
+        INSERT INTO email_outbox (user_id, to_addr, kind, subject, message, digest, send_after, created_at)
+        VALUES (?, 'x@test.com', 'outbid', 'Outbid', 'Bid again', ?, ?, ?)
+    ''', [(user_id, digest, now_str(-timedelta(minutes=1)), now_str())] * n)
+
+conn = get_db()
+conn.execute("DELETE FROM email_outbox WHERE status = 'queued'")
+queue_outbox(conn, buyer_id, 0, appmod.EMAIL_BATCH_SIZE + 5)
+for user in ('sub@test.com', 'rival@test.com'):
+    queue_outbox(conn, conn.execute('SELECT id FROM users WHERE email = ?', (user,)).fetchone()[0], 1, 3)
+conn.commit()
+with app.app_context():
+    batches = list(appmod._due_email_batches(conn, now_str()))
+digests = [ids for ids, *_ in batches if len(ids) > 1]
+results.append(test_bool("Digests get their share of a full batch",
+                         len(batches) == appmod.EMAIL_BATCH_SIZE and len(digests) == 2))
+conn.execute("DELETE FROM email_outbox WHERE digest = 1 AND status = 'queued'")
+conn.commit()
+with app.app_context():
+    batches = list(appmod._due_email_batches(conn, now_str()))
+results.append(test_bool("Unused digest slots go to immediate mail", len(batches) == appmod.EMAIL_BATCH_SIZE))
+conn.execute("DELETE FROM email_outbox WHERE status = 'queued'")
+conn.commit()
+conn.close()
+
+# --- 18. Reviving expired orders ---
+print("\n18. Expired orders")
+
+conn = get_db()
+rival_id = conn.execute("SELECT id FROM users WHERE email = 'rival@test.com'").fetchone()[0]
+spare = [conn.execute('''
+    INSERT INTO auctions (title, image, starting_bid, current_bid, current_bidder_id, status, ends_at, original_end)
+    VALUES (?, 'x.jpg', 100, 190, ?, 'unsold', ?, ?) RETURNING id
+''', (f'Lapsed {n}', rival_id, now_str(-timedelta(days=3)), now_str(-timedelta(days=3)))).fetchone()[0]
+         for n in range(3)]
+lapsed = []
+for auction_id in spare:
+    lapsed.append(conn.execute('''
+        INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at, completed_at)
+        VALUES (?, ?, 210, 'expired', ?, ?, ?, ?) RETURNING id
+    ''', (auction_id, buyer_id, f'lapsed-{auction_id}', now_str(-timedelta(days=3)),
+          now_str(-timedelta(days=1)), now_str(-timedelta(days=1)))).fetchone()[0])
+offer_id = conn.execute('''
+    INSERT INTO payments (auction_id, buyer_id, amount, status, payment_token, created_at, expires_at)
+    VALUES (?, ?, 190, 'awaiting_payment', 'second-chance', ?, ?) RETURNING id
+''', (spare[2], rival_id, now_str(), now_str(timedelta(days=2)))).fetchone()[0]
+conn.commit()
+conn.close()
+
+r = client.get(f'/admin/order/{lapsed[0]}')
+results.append(test("Expired order shows as the current status", r, 200, '<option value="expired" selected>'))
+client.post(f'/admin/order/{lapsed[0]}/edit', data={'status': 'paid'})
+client.post(f'/admin/order/{lapsed[1]}/edit', data={'status': 'awaiting_payment'})
+r = client.post(f'/admin/order/{lapsed[2]}/edit', data={'status': 'paid'}, follow_redirects=True)
+results.append(test("Refused while a second-chance offer is open", r, 200, f"order #{offer_id}"))
+conn = get_db()
+orders = {row['id']: row for row in conn.execute('''
+    SELECT p.id, p.status, p.completed_at, p.expires_at, a.status AS auction_status, a.current_bidder_id
+    FROM payments p JOIN auctions a ON a.id = p.auction_id WHERE p.id IN (?, ?, ?)
+''', lapsed)}
+conn.close()
+paid, reopened, kept = (orders[i] for i in lapsed)
+results.append(test_bool("Expired order paid off-platform can be marked paid",
+                         paid['status'] == 'paid' and paid['auction_status'] == 'paid'
+                         and paid['current_bidder_id'] == buyer_id and paid['completed_at'] > now_str(-timedelta(hours=1))))
+results.append(test_bool("Reopened expired order gets a fresh deadline",
+                         reopened['status'] == 'awaiting_payment' and reopened['expires_at'] > now_str()
+                         and reopened['completed_at'] is None and reopened['auction_status'] == 'ended'))
+results.append(test_bool("Order with an open offer stays expired", kept['status'] == 'expired'))
+
+# --- 19. Job lease heartbeat ---
+print("\n19. Job lease heartbeat")
+
+leases = []
+
+@appmod.job_task('lease_probe')
+def task_lease_probe(conn, payload):
+    time.sleep(0.6)
+    probe = get_db()
+    leases.append(probe.execute('SELECT locked_until FROM jobs WHERE id = ?', (payload['id'],)).fetchone()[0])
+    probe.close()
+
+conn = get_db()
+# Claimed with a lease that has already run out, as if the handler were slow
+probe_id = conn.execute('''
+    INSERT INTO jobs (task, status, attempts, run_at, locked_by, locked_until, created_at)
+    VALUES ('lease_probe', 'running', 1, ?, 'probe-worker', ?, ?) RETURNING id
+''', (now_str(), now_str(-timedelta(seconds=5)), now_str())).fetchone()[0]
+conn.execute('UPDATE jobs SET payload = ? WHERE id = ?', (json.dumps({'id': probe_id}), probe_id))
+conn.commit()
+job = conn.execute('SELECT * FROM jobs WHERE id = ?', (probe_id,)).fetchone()
+conn.close()
+saved_beat, appmod.JOB_HEARTBEAT_SECONDS = appmod.JOB_HEARTBEAT_SECONDS, 0.2
+with app.app_context():
+    ok = appmod.execute_job(job, 'probe-worker')
+appmod.JOB_HEARTBEAT_SECONDS = saved_beat
+results.append(test_bool("A running job's lease is renewed, so it can't be claimed twice",
+                         ok and leases and leases[0] > now_str()))
+conn = get_db()
+status = conn.execute('SELECT status, locked_until FROM jobs WHERE id = ?', (probe_id,)).fetchone()
+conn.close()
+results.append(test_bool("Finished job releases its lease", status[0] == 'done' and status[1] is None))
+
+# --- Summary ---
+passed = sum(1 for r in results if r)
+total = len(results)
+print(f"\n{'='*50}")
+print(f"Results: {passed}/{total} tests passed")
+if passed == total:
+    print("ALL TESTS PASSED!")
+else:
+    print(f"FAILED: {total - passed} tests")
+print(f"{'='*50}\n")
+
+sys.exit(0 if passed == total else 1)
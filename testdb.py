@@ -0,0 +1,167 @@
+"""Fast, isolated databases for the test scripts.
+
+Every test script gets its own copy of a "golden" pre-seeded database instead of
+deleting and re-seeding panties_fan.db. The golden file is built once (and rebuilt
+whenever app.py changes), then cloned with the SQLite backup API, which takes a few
+milliseconds. Clones live in a temp dir, so the dev database is never touched and
+scripts can run in parallel (see run_tests.py).
+
+Usage (before importing app):
+
+    import testdb
+    testdb.use_fresh_database()          # file clone in a temp dir
+    testdb.use_fresh_database(memory=True)  # shared-cache in-memory clone
+    from app import app, get_db
+
+PANTIESFAN_TEST_DB=memory switches the default to in-memory clones.
+
+PANTIESFAN_TEST_POSTGRES=postgresql://... runs against a PostgreSQL server
+instead: the golden copy is a database there, and each script gets a
+`CREATE DATABASE ... TEMPLATE` copy of it that is dropped at exit.
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import subprocess
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(ROOT, '.testdb')
+
+_keepalive = []
+
+
+def _fingerprint():
+    with open(os.path.join(ROOT, 'app.py'), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def golden_path():
+    return os.path.join(GOLDEN_DIR, f'golden-{_fingerprint()}.db')
+
+
+def _postgres_server():
+    return os.environ.get('PANTIESFAN_TEST_POSTGRES')
+
+
+def _postgres_url(server, dbname):
+    return urlsplit(server)._replace(path=f'/{dbname}').geturl()
+
+
+def _postgres_admin(server):
+    import psycopg
+    return psycopg.connect(server, autocommit=True)
+
+
+def ensure_golden():
+    """Build the golden database for the current app.py if it doesn't exist yet.
+    Safe to call from several processes at once: each builds privately, then
+    atomically renames into place."""
+    if _postgres_server():
+        return _ensure_golden_postgres(_postgres_server())
+    path = golden_path()
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    env = dict(os.environ, PANTIESFAN_DB=tmp, PANTIESFAN_UPLOADS=tempfile.gettempdir())
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    # Fold the WAL back into the main file so a plain rename carries everything
+    conn = sqlite3.connect(tmp)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.close()
+    os.replace(tmp, path)
+
+    # Drop goldens built from older versions of app.py
+    for name in os.listdir(GOLDEN_DIR):
+        stale = os.path.join(GOLDEN_DIR, name)
+        if stale != path and name.startswith('golden-'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return path
+
+
+def _ensure_golden_postgres(server):
+    name = f'pantiesfan_golden_{_fingerprint()}'
+    admin = _postgres_admin(server)
+    try:
+        if admin.execute('SELECT 1 FROM pg_database WHERE datname = %s', (name,)).fetchone():
+            return _postgres_url(server, name)
+        tmp = f'{name}_{os.getpid()}'
+        admin.execute(f'DROP DATABASE IF EXISTS {tmp}')
+        admin.execute(f'CREATE DATABASE {tmp}')
+        env = dict(os.environ, PANTIESFAN_DB=_postgres_url(server, tmp), PANTIESFAN_UPLOADS=tempfile.gettempdir())
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        try:
+            admin.execute(f'ALTER DATABASE {tmp} RENAME TO {name}')
+        except Exception:  # another process got there first
+            admin.execute(f'DROP DATABASE IF EXISTS {tmp}')
+
+        # Drop goldens built from older versions of app.py
+        stale = admin.execute("SELECT datname FROM pg_database WHERE datname LIKE 'pantiesfan\\_golden\\_%%' "
+                              "AND datname <> %s", (name,)).fetchall()
+        for (old,) in stale:
+            admin.execute(f'DROP DATABASE IF EXISTS {old}')
+    finally:
+        admin.close()
+    return _postgres_url(server, name)
+
+
+def _drop_postgres_database(server, name):
+    admin = _postgres_admin(server)
+    admin.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+    admin.close()
+
+
+def use_fresh_database(memory=None):
+    """Clone the golden DB and point the app (via PANTIESFAN_DB) at the clone.
+    Must run before `import app`. Returns the database path/URI in use."""
+    if memory is None:
+        memory = os.environ.get('PANTIESFAN_TEST_DB') == 'memory'
+
+    workdir = tempfile.mkdtemp(prefix='pf_test_')
+    atexit.register(shutil.rmtree, workdir, True)
+
+    server = _postgres_server()
+    if server:
+        golden = urlsplit(ensure_golden()).path.lstrip('/')
+        name = f'pf_test_{os.getpid()}'
+        admin = _postgres_admin(server)
+        admin.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+        admin.execute(f'CREATE DATABASE {name} TEMPLATE {golden}')
+        admin.close()
+        atexit.register(_drop_postgres_database, server, name)
+        target = _postgres_url(server, name)
+        os.environ['PANTIESFAN_DB'] = target
+        os.environ['PANTIESFAN_UPLOADS'] = os.path.join(workdir, 'uploads')
+        return target
+
+    if memory:
+        target = f'file:pf_test_{os.getpid()}?mode=memory&cache=shared'
+        dst = sqlite3.connect(target, uri=True)
+        _keepalive.append(dst)  # keeps the shared-cache DB alive for the process
+    else:
+        target = os.path.join(workdir, 'panties_fan.db')
+        dst = sqlite3.connect(target)
+
+    src = sqlite3.connect(ensure_golden())
+    src.backup(dst)
+    src.close()
+    if not memory:
+        dst.close()
+
+    os.environ['PANTIESFAN_DB'] = target
+    os.environ['PANTIESFAN_UPLOADS'] = os.path.join(workdir, 'uploads')
+    return target